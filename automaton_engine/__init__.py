@@ -1,24 +1,36 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import sys
+from automaton_engine.performance import startup
+
 import logging
 from os import environ
 
 from automaton_engine.engine import AutomatonEngine
+from automaton_engine.logs import setup_logging
+
+startup.mark("imports")
 
+""" Log from a background thread through a bounded queue, configured via
+- AUTOMATON_ENGINE_LOGLEVEL      : root log level (INFO)
+- AUTOMATON_ENGINE_LOG_FORMAT    : text or json (text)
+- AUTOMATON_ENGINE_LOG_RATELIMIT : burst/interval, records per message let
+                                   through every interval seconds at INFO
+                                   and below, off to disable (50/1)
+unless the embedding application has already configured logging
+"""
 try:
-    if "AUTOMATON_ENGINE_LOGLEVEL" in environ:
-        logging.basicConfig(
-            stream=sys.stdout,
-            level=environ.get("AUTOMATON_ENGINE_LOGLEVEL"),
-            format="%(asctime)s %(name)s %(levelname)s" + " %(message)s ",
-        )
-    else:
-        logging.basicConfig(
-            stream=sys.stdout,
-            level="INFO",
-            format="%(asctime)s %(name)s %(levelname)s" + " %(message)s ",
+    if not logging.getLogger().handlers:
+        rate_limit = environ.get("AUTOMATON_ENGINE_LOG_RATELIMIT", "50/1")
+        if rate_limit == "off":
+            rate_limit = None
+        else:
+            burst, _, interval = rate_limit.partition("/")
+            rate_limit = {"burst": int(burst), "interval": float(interval or 1)}
+        setup_logging(
+            level=environ.get("AUTOMATON_ENGINE_LOGLEVEL", "INFO"),
+            json_output=environ.get("AUTOMATON_ENGINE_LOG_FORMAT", "text") == "json",
+            rate_limit=rate_limit,
         )
     logger = logging.getLogger(__name__)
 except (KeyError, ValueError, AttributeError, Exception):
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+
+import hashlib
+import json
+import logging
+
+from automaton_engine.actions.common import BucketResult
+from automaton_engine.backoff import bucket_fingerprint, bucket_identity
+from automaton_engine.session import target_key
+
+logger = logging.getLogger(__name__)
+
+
+""" action parameters naming the destination an action delivers to, used
+to apply per-destination rate limits
+"""
+destination_keys = ("awx_url", "rocketchat_webhook")
+
+
+def idempotency_key(automaton: str, action_id: str, bucket: dict, key_field: str):
+    """Key identifying one delivery of a bucket's state by an action: the
+    same bucket content yields the same key.
+    """
+    return hashlib.sha1(
+        json.dumps(
+            [
+                automaton,
+                action_id,
+                bucket_identity(bucket.get(key_field)),
+                bucket_fingerprint(bucket),
+            ]
+        ).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+def destination(action: dict) -> str:
+    """Destination an action delivers to, its name when it has no url.
+    """
+    for key in destination_keys:
+        if key in action["parameters"]:
+            return target_key(action["parameters"][key])
+    return action["name"]
+
+
+@dataclass
+class ActionJob:
+    """Buckets an automaton's action is to be executed for.
+    """
+
+    automaton: str
+    action_id: str
+    destination: str
+    buckets: list
+    keys: list
+    ttl: float
+    attempts: int = 0
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+class RateLimiter:
+    """Token bucket allowing rate jobs per second with bursts of burst.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class JobNotOwned(Exception):
+    """Raised by a handler for a job of an automaton that is configured but
+    run by another process (shard or replica). The job is kept, journalled
+    and undelivered, and tried again after retry_delay.
+    """
+
+
+class ActionJournal:
+    """SQLite journal of queued jobs and recently delivered keys.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, job TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS delivered (key TEXT PRIMARY KEY, expires_at REAL)"
+        )
+        self.db.commit()
+
+    def load(self) -> tuple:
+        with self.lock:
+            jobs = self.db.execute("SELECT job FROM jobs ORDER BY rowid").fetchall()
+            delivered = self.db.execute(
+                "SELECT key, expires_at FROM delivered ORDER BY expires_at"
+            ).fetchall()
+        return [ActionJob(**json.loads(row[0])) for row in jobs], delivered
+
+    def save(self, job: ActionJob):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?)",
+                (job.id, json.dumps(asdict(job))),
+            )
+
+    def complete(self, job: ActionJob, delivered: list, remaining: bool):
+        """Record delivered (key, expires_at) pairs, and drop job unless it
+        has buckets remaining.
+        """
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO delivered VALUES (?, ?)", delivered
+            )
+            self.db.execute(
+                "DELETE FROM delivered WHERE expires_at <= ?", (time.time(),)
+            )
+            if remaining:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?)",
+                    (job.id, json.dumps(asdict(job))),
+                )
+            else:
+                self.db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class ActionQueue:
+    """Bounded queue of action jobs, executed by a pool of workers.
+
+    Polls only enqueue jobs, waiting when max_size jobs are queued. Each
+    job's destination is limited to its rate_limits ({destination url:
+    {"rate": jobs per second, "burst": jobs}}). Buckets that fail are
+    retried with exponential backoff from retry_delay seconds, up to
+    max_attempts, and then handed to on_failure.
+
+    Every bucket carries an idempotency key derived from its content:
+    a bucket already queued, or delivered within its ttl, is not queued
+    again. With a path, jobs are journalled to SQLite before put returns
+    and removed once delivered, so jobs outstanding at shutdown or crash
+    are delivered (at least once) after a restart.
+
+    handler(job) executes a job and returns a BucketResult per bucket, or
+    raises JobNotOwned to hold it.
+    """
+
+    def __init__(
+        self,
+        handler=None,
+        max_size: int = 1000,
+        workers: int = 4,
+        path: str = None,
+        rate_limits: dict = None,
+        max_attempts: int = 5,
+        retry_delay: float = 5.0,
+        on_failure=None,
+    ):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.max_size = max_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.limits = {
+            target_key(url): RateLimiter(**limit)
+            for url, limit in (rate_limits or {}).items()
+        }
+        self.journal = ActionJournal(path) if path else None
+        self.jobs = None
+        self.pending = set()
+        self.delivered = OrderedDict()
+        self.tasks = []
+        self.retrying = set()
+        self.restored = []
+        if self.journal is not None:
+            self.restored, delivered = self.journal.load()
+            now = time.time()
+            for key, expires_at in delivered:
+                if expires_at > now:
+                    self.delivered[key] = expires_at
+            if self.restored:
+                logger.info(
+                    "restored %s queued action jobs from %s", len(self.restored), path
+                )
+
+    async def run_in_executor(self, call, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, call, *args)
+
+    def expire(self, now: float):
+        while self.delivered:
+            key, expires_at = next(iter(self.delivered.items()))
+            if expires_at > now:
+                break
+            del self.delivered[key]
+
+    async def put(self, job: ActionJob, requeue: bool = False) -> bool:
+        """Queue job, waiting while the queue is full.
+
+            Args:
+                ActionJob:    job
+                bool:         requeue (job is being retried, skip deduplication)
+            Returns:
+                bool:         False when every bucket was a duplicate
+        """
+        if not requeue:
+            self.expire(time.time())
+            fresh = [
+                index
+                for index, key in enumerate(job.keys)
+                if key not in self.pending and key not in self.delivered
+            ]
+            if not fresh:
+                return False
+            job.buckets = [job.buckets[index] for index in fresh]
+            job.keys = [job.keys[index] for index in fresh]
+            self.pending.update(job.keys)
+            if self.journal is not None:
+                await self.run_in_executor(self.journal.save, job)
+        await self.jobs.put(job)
+        return True
+
+    async def requeue(self, job: ActionJob, delay: float):
+        await asyncio.sleep(delay)
+        await self.put(job, requeue=True)
+
+    async def work(self):
+        while True:
+            job = await self.jobs.get()
+            try:
+                await self.deliver(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("action job %s failed: %r", job.id, e)
+                # let later occurrences of its buckets be queued again
+                self.pending.difference_update(job.keys)
+            finally:
+                self.jobs.task_done()
+
+    async def deliver(self, job: ActionJob):
+        limit = self.limits.get(job.destination)
+        if limit is not None:
+            await limit.acquire()
+        try:
+            results = await self.handler(job)
+        except JobNotOwned:
+            logger.debug(
+                "holding action job %s of automaton %s, not run here",
+                job.id,
+                job.automaton,
+            )
+            task = asyncio.ensure_future(self.requeue(job, self.retry_delay))
+            self.retrying.add(task)
+            task.add_done_callback(self.retrying.discard)
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("action job %s failed: %r", job.id, e)
+            results = [BucketResult(bucket, False, e) for bucket in job.buckets]
+        results = list(results or [])
+        if len(results) != len(job.buckets):
+            logger.error(
+                "action job %s got %s results for %s buckets",
+                job.id,
+                len(results),
+                len(job.buckets),
+            )
+            missing = ValueError("no result for bucket")
+            results = results[: len(job.buckets)] + [
+                BucketResult(bucket, False, missing)
+                for bucket in job.buckets[len(results) :]
+            ]
+        job.attempts += 1
+        now = time.time()
+        delivered, failed = [], []
+        for key, result in zip(job.keys, results):
+            if result.success:
+                delivered.append((key, now + job.ttl))
+            else:
+                failed.append((key, result.bucket))
+        for key, expires_at in delivered:
+            self.pending.discard(key)
+            self.delivered[key] = expires_at
+        retry = failed and job.attempts < self.max_attempts
+        if retry:
+            job.keys = [key for key, bucket in failed]
+            job.buckets = [bucket for key, bucket in failed]
+        if self.journal is not None:
+            await self.run_in_executor(self.journal.complete, job, delivered, retry)
+        if retry:
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            logger.info(
+                "action job %s retrying %s buckets in %ss", job.id, len(failed), delay
+            )
+            task = asyncio.ensure_future(self.requeue(job, delay))
+            self.retrying.add(task)
+            task.add_done_callback(self.retrying.discard)
+        elif failed:
+            logger.error(
+                "action job %s gave up on %s buckets after %s attempts",
+                job.id,
+                len(failed),
+                job.attempts,
+            )
+            self.pending.difference_update(key for key, bucket in failed)
+            if self.on_failure is not None:
+                self.on_failure(job, [bucket for key, bucket in failed])
+
+    async def start(self):
+        """Start the workers and queue restored jobs, from within the
+        running loop.
+        """
+        self.jobs = asyncio.Queue(self.max_size)
+        self.tasks = [
+            asyncio.ensure_future(self.work()) for worker in range(self.workers)
+        ]
+        for job in self.restored:
+            self.pending.update(job.keys)
+            await self.jobs.put(job)
+        self.restored = []
+
+    async def join(self):
+        """Wait until every queued job has been attempted (jobs waiting to
+        be retried are not waited for).
+        """
+        await self.jobs.join()
+
+    async def close(self):
+        """Stop the workers, jobs still queued stay in the journal.
+        """
+        tasks = self.tasks + list(self.retrying)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+        if self.journal is not None:
+            self.journal.close()
@@ -3,54 +3,186 @@
 
 import asyncio
 import async_timeout
-from aiohttp import ClientSession, BasicAuth, TCPConnector
+from aiohttp import BasicAuth
+from functools import lru_cache
 
 import base64
-import json
 import logging
 
+from automaton_engine.action_queue import RateLimiter
+from automaton_engine.actions.common import BucketResult, fan_out
+from automaton_engine.serialization import dumps
+from automaton_engine.session import client_session
+
 logger = logging.getLogger(__name__)
 
 
-async def api_call(action_parameters, action_metadata):
-    """Calls Ansible AWX API.
+""" awx_launch modes
+- job   : launch awx_context once per bucket, with the bucket as extra_vars
+- batch : launch awx_context once per awx_batch_size buckets, with the
+          buckets listed under awx_batch_var in extra_vars (awx_context
+          may be a job template or a workflow job template launch)
+- bulk  : launch job template awx_job_template once per bucket through
+          the AWX bulk job launch API, awx_batch_size jobs per request
+"""
+launch_modes = ("job", "batch", "bulk")
+
+""" batching defaults, AWX caps a bulk launch at its BULK_JOB_MAX_LAUNCH
+setting (100 by default)
+"""
+default_batch_size = 100
+default_batch_var = "buckets"
+default_bulk_context = "/api/v2/bulk/job_launch/"
+
+""" launch rate limiters (awx_rate), keyed by awx_url
+"""
+rate_limiters = {}
+
+
+@lru_cache(maxsize=128)
+def awx_auth(username: str, password: str) -> BasicAuth:
+    """BasicAuth from base64 encoded awx_auth credentials, decoded once.
+    """
+    return BasicAuth(
+        base64.b64decode(username).decode("utf-8"),
+        base64.b64decode(password).decode("utf-8"),
+    )
+
+
+def rate_limiter(action_parameters) -> RateLimiter:
+    """Limiter shared by every launch against awx_url, None without awx_rate.
+    """
+    rate = action_parameters.get("awx_rate")
+    if not rate:
+        return None
+    burst = action_parameters.get("awx_burst", 1.0)
+    limiter = rate_limiters.get(action_parameters["awx_url"])
+    if limiter is None or (limiter.rate, limiter.burst) != (rate, max(burst, 1.0)):
+        limiter = rate_limiters[action_parameters["awx_url"]] = RateLimiter(rate, burst)
+    return limiter
+
+
+def teardown():
+    """Drop the rate limiters, called by the action registry on shutdown.
+    """
+    rate_limiters.clear()
+
+
+def launch_batches(action_parameters, action_metadata: list) -> list:
+    """Request bodies launching action_metadata, with the buckets each
+    launches.
 
         Args:
             list:    action_parameters (awx API action parameters)
             list:    action_metadata (mapped_responses from ResponseMapper)
         Returns:
-            None
+            list:    (context, body, buckets) per request
+        Raises:
+            ValueError
+    """
+    mode = action_parameters.get("awx_launch", "job")
+    if mode not in launch_modes:
+        raise ValueError(
+            "awx_launch must be one of {}, got: {}".format(launch_modes, mode)
+        )
+    if mode == "job":
+        return [
+            (action_parameters["awx_context"], {"extra_vars": bucket}, [bucket])
+            for bucket in action_metadata
+        ]
+    size = action_parameters.get("awx_batch_size", default_batch_size)
+    chunks = [
+        action_metadata[start : start + size]
+        for start in range(0, len(action_metadata), size)
+    ]
+    if mode == "batch":
+        batch_var = action_parameters.get("awx_batch_var", default_batch_var)
+        return [
+            (
+                action_parameters["awx_context"],
+                {"extra_vars": {batch_var: chunk}},
+                chunk,
+            )
+            for chunk in chunks
+        ]
+    body = {"name": action_parameters.get("awx_bulk_name", "automaton_engine")}
+    return [
+        (
+            action_parameters.get("awx_bulk_context", default_bulk_context),
+            dict(
+                body,
+                jobs=[
+                    {
+                        "unified_job_template": action_parameters["awx_job_template"],
+                        "extra_vars": bucket,
+                    }
+                    for bucket in chunk
+                ],
+            ),
+            chunk,
+        )
+        for chunk in chunks
+    ]
+
+
+async def api_call(action_parameters, action_metadata, session_manager=None):
+    """Calls Ansible AWX API.
+
+    Launches one job per bucket by default, or fewer launches carrying
+    several buckets each according to awx_launch (see launch_modes). With
+    awx_rate set, launches against the same awx_url are limited to
+    awx_rate per second, with bursts of awx_burst.
+
+        Args:
+            list:              action_parameters (awx API action parameters)
+            list:              action_metadata (mapped_responses from ResponseMapper)
+            SessionManager:    session_manager (shared session pools, optional)
+        Returns:
+            list:              BucketResult per launched bucket
         Raises:
-            asyncio.TimeoutError
             General Exception
     """
     try:
-        for index, action_obj in enumerate(action_metadata):
-            logging.debug("calling awx api with action metadata: {}".format(action_obj))
-            async with ClientSession(
-                skip_auto_headers=["User-Agent"],
-                auth=BasicAuth(
-                    base64.b64decode(action_parameters["awx_auth"]["username"]).decode(
-                        "utf-8"
-                    ),
-                    base64.b64decode(action_parameters["awx_auth"]["password"]).decode(
-                        "utf-8"
-                    ),
-                ),
-                connector=TCPConnector(verify_ssl=False),
-            ) as session:
+        auth = awx_auth(
+            action_parameters["awx_auth"]["username"],
+            action_parameters["awx_auth"]["password"],
+        )
+        limiter = rate_limiter(action_parameters)
+        batches = launch_batches(action_parameters, list(action_metadata))
+        async with client_session(
+            session_manager,
+            action_parameters["awx_url"],
+            verify_ssl=action_parameters.get("awx_verify_ssl", False),
+        ) as session:
+
+            async def launch(batch):
+                context, body, buckets = batch
+                logger.debug("calling awx api with action metadata: %s", buckets)
+                if limiter is not None:
+                    await limiter.acquire()
                 with async_timeout.timeout(action_parameters["awx_timeout"]):
                     async with session.post(
-                        action_parameters["awx_url"] + action_parameters["awx_context"],
-                        data=json.dumps({"extra_vars": action_obj}),
+                        action_parameters["awx_url"] + context,
+                        data=dumps(body),
                         headers={"content-type": "application/json"},
+                        auth=auth,
                     ) as response:
                         # Created
                         assert response.status == 201
-            logging.info("awx api call has been executed")
+                logger.info(
+                    "awx api call has been executed for %s buckets", len(buckets)
+                )
+
+            return [
+                BucketResult(bucket, result.success, result.error)
+                for result in await fan_out(
+                    batches, launch, action_parameters.get("concurrency")
+                )
+                for bucket in result.bucket[2]
+            ]
     except asyncio.TimeoutError as timeout_ex:
-        logging.error(timeout_ex)
+        logger.error(timeout_ex)
         raise
     except Exception as ex:
-        logging.error(ex)
+        logger.error(ex)
         raise
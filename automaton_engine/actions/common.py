@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import namedtuple
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+""" default number of buckets an action dispatches concurrently,
+overridden per action with the "concurrency" action parameter
+"""
+default_concurrency = 10
+
+""" BucketResult records the outcome of an action for a single bucket
+- bucket  : action metadata the call was made with
+- success : True when the call completed
+- error   : exception raised by the call, None on success
+"""
+BucketResult = namedtuple("BucketResult", ["bucket", "success", "error"])
+
+
+async def fan_out(action_metadata, bucket_call, concurrency: int = None) -> list:
+    """Await bucket_call for every bucket in action_metadata, running at
+    most concurrency calls at a time. A failing bucket is recorded and
+    does not prevent the remaining buckets from being dispatched.
+
+        Args:
+            list:         action_metadata (mapped_responses from ResponseMapper)
+            coroutine:    bucket_call (called with a single bucket)
+            int:          concurrency (maximum calls in flight)
+        Returns:
+            list:         BucketResult per bucket, in action_metadata order
+    """
+    buckets = list(enumerate(action_metadata))
+    results = [None] * len(buckets)
+    pending = iter(buckets)
+
+    async def worker():
+        for index, bucket in pending:
+            try:
+                await bucket_call(bucket)
+                results[index] = BucketResult(bucket, True, None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("action call failed for bucket: %s (%r)", bucket, e)
+                results[index] = BucketResult(bucket, False, e)
+
+    workers = min(concurrency or default_concurrency, len(buckets))
+    await asyncio.gather(*[worker() for _ in range(workers)])
+    return results
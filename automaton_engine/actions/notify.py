@@ -3,49 +3,227 @@
 
 import asyncio
 import async_timeout
-from aiohttp import ClientSession
 
-import json
 import logging
 
+from automaton_engine.actions.common import BucketResult, fan_out
+from automaton_engine.serialization import dumps
+from automaton_engine.session import client_session
+
 logger = logging.getLogger(__name__)
 
 
-async def rocketchat_webhook(action_parameters, action_metadata):
+""" default maximum length of a batched notification, RocketChat rejects
+messages over its Message_MaxAllowedSize setting (5000 by default)
+"""
+default_batch_max_chars = 4000
+
+""" batches awaiting their coalescing window, keyed by webhook url
+"""
+pending_batches = {}
+
+
+def truncate(text: str, limit: int) -> str:
+    """text cut down to limit characters, marked with an ellipsis.
+    """
+    if len(text) <= limit:
+        return text
+    return text[: max(limit - 3, 0)] + "..."
+
+
+def batch_chunks(entries: list, max_chars: int = default_batch_max_chars) -> list:
+    """Render (rocketchat_message, bucket) entries into as few notification
+    texts as max_chars allows. Buckets sharing a message are listed under
+    it, and the message is repeated at the top of every chunk it spans.
+    Messages and bucket lines too long to fit a chunk are truncated, so
+    that no text exceeds max_chars.
+
+        Args:
+            list:    entries ((rocketchat_message, bucket) tuples)
+            int:     max_chars (maximum length of a single text)
+        Returns:
+            list:    (text, entry indices) per chunk
+    """
+    chunks = []
+    lines, indices, size, current = [], [], 0, None
+    for index, (message, bucket) in enumerate(entries):
+        message = truncate(message, max_chars // 2)
+        line = truncate(
+            "action metadata: {}".format(bucket), max_chars - len(message) - 2
+        )
+        header = [] if message == current and lines else [message]
+        added = sum(len(part) + 1 for part in header + [line])
+        if lines and size + added > max_chars:
+            chunks.append(("\n".join(lines), indices))
+            lines, indices, size = [], [], 0
+            header = [message]
+            added = sum(len(part) + 1 for part in header + [line])
+        lines.extend(header + [line])
+        indices.append(index)
+        size += added
+        current = message
+    if lines:
+        chunks.append(("\n".join(lines), indices))
+    return chunks
+
+
+async def send_batch(session, action_parameters, entries: list) -> list:
+    """Post entries as chunked notifications to the webhook.
+
+        Args:
+            ClientSession:    session
+            list:             action_parameters (rocketchat action parameters)
+            list:             entries ((rocketchat_message, bucket) tuples)
+        Returns:
+            list:             BucketResult per entry
+    """
+    results = [None] * len(entries)
+
+    async def post(chunk):
+        text, indices = chunk
+        with async_timeout.timeout(action_parameters["rocketchat_timeout"]):
+            async with session.post(
+                action_parameters["rocketchat_webhook"],
+                data=dumps({"text": text}),
+                headers={"content-type": "application/json"},
+            ) as response:
+                assert response.status == 200
+        logger.info(
+            "rocketchat batch notification has been sent for %s buckets", len(indices)
+        )
+
+    chunks = batch_chunks(
+        entries,
+        action_parameters.get("rocketchat_batch_max_chars", default_batch_max_chars),
+    )
+    for chunk_result in await fan_out(
+        chunks, post, action_parameters.get("concurrency")
+    ):
+        for index in chunk_result.bucket[1]:
+            results[index] = BucketResult(
+                entries[index][1], chunk_result.success, chunk_result.error
+            )
+    return results
+
+
+async def coalesce(session, action_parameters, action_metadata: list) -> list:
+    """Add action_metadata to the batch pending for the webhook, sending it
+    once rocketchat_batch_window seconds have passed since the batch was
+    opened. Automatons targeting the same webhook within the window share
+    the batch.
+
+        Args:
+            ClientSession:    session
+            list:             action_parameters (rocketchat action parameters)
+            list:             action_metadata (mapped_responses from ResponseMapper)
+        Returns:
+            list:             BucketResult per bucket in action_metadata
+    """
+    webhook = action_parameters["rocketchat_webhook"]
+    batch = pending_batches.get(webhook)
+    owner = batch is None
+    if owner:
+        batch = pending_batches[webhook] = {
+            "entries": [],
+            "done": asyncio.get_event_loop().create_future(),
+            "flush": asyncio.Event(),
+        }
+    start = len(batch["entries"])
+    batch["entries"].extend(
+        (action_parameters["rocketchat_message"], bucket) for bucket in action_metadata
+    )
+    if owner:
+        try:
+            try:
+                await asyncio.wait_for(
+                    batch["flush"].wait(), action_parameters["rocketchat_batch_window"]
+                )
+            except asyncio.TimeoutError:
+                pass
+            del pending_batches[webhook]
+            batch["done"].set_result(
+                await send_batch(session, action_parameters, batch["entries"])
+            )
+        except BaseException as e:
+            pending_batches.pop(webhook, None)
+            if not batch["done"].done():
+                batch["done"].set_exception(e)
+            raise
+    results = await asyncio.shield(batch["done"])
+    return results[start : start + len(action_metadata)]
+
+
+async def flush():
+    """Send every pending batch without waiting for its window to close,
+    called by the action registry on shutdown.
+    """
+    batches = list(pending_batches.values())
+    for batch in batches:
+        batch["flush"].set()
+    await asyncio.gather(
+        *[asyncio.shield(batch["done"]) for batch in batches], return_exceptions=True
+    )
+
+
+async def rocketchat_webhook(action_parameters, action_metadata, session_manager=None):
     """Send notification via rocketchat webhook.
 
+    With rocketchat_batch set, all buckets are sent as one notification
+    (chunked by rocketchat_batch_max_chars) rather than one per bucket,
+    and rocketchat_batch_window additionally coalesces the buckets of
+    every automaton notifying the same webhook within the window.
+
         Args:
-            list:    action_parameters (rocketchat action parameters)
-            list:    action_metadata (mapped_responses from ResponseMapper)
+            list:              action_parameters (rocketchat action parameters)
+            list:              action_metadata (mapped_responses from ResponseMapper)
+            SessionManager:    session_manager (shared session pools, optional)
         Returns:
-            None
+            list:              BucketResult per notified bucket
         Raises:
-            asyncio.TimeoutError
             General Exception
     """
     try:
-        for index, action_obj in enumerate(action_metadata):
-            notification = {
-                "text": action_parameters["rocketchat_message"]
-                + "\naction metadata: {}".format(action_obj)
-            }
-            logging.debug(
-                "sending rocketchat notfication with action metadata: {}".format(
-                    action_obj
+        async with client_session(
+            session_manager, action_parameters["rocketchat_webhook"]
+        ) as session:
+
+            if action_parameters.get("rocketchat_batch", False):
+                action_metadata = list(action_metadata)
+                if action_parameters.get("rocketchat_batch_window"):
+                    return await coalesce(session, action_parameters, action_metadata)
+                return await send_batch(
+                    session,
+                    action_parameters,
+                    [
+                        (action_parameters["rocketchat_message"], bucket)
+                        for bucket in action_metadata
+                    ],
+                )
+
+            async def notify(action_obj):
+                notification = {
+                    "text": action_parameters["rocketchat_message"]
+                    + "\naction metadata: {}".format(action_obj)
+                }
+                logger.debug(
+                    "sending rocketchat notfication with action metadata: %s",
+                    action_obj,
                 )
-            )
-            async with ClientSession(skip_auto_headers=["User-Agent"]) as session:
                 with async_timeout.timeout(action_parameters["rocketchat_timeout"]):
                     async with session.post(
                         action_parameters["rocketchat_webhook"],
-                        data=json.dumps(notification),
+                        data=dumps(notification),
                         headers={"content-type": "application/json"},
                     ) as response:
                         assert response.status == 200
-            logging.info("rocketchat notification has been sent")
+                logger.info("rocketchat notification has been sent")
+
+            return await fan_out(
+                action_metadata, notify, action_parameters.get("concurrency")
+            )
     except asyncio.TimeoutError as timeout_ex:
-        logging.error(timeout_ex)
+        logger.error(timeout_ex)
         raise
     except Exception as ex:
-        logging.error(ex)
+        logger.error(ex)
         raise
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import importlib
+import inspect
+
+import logging
+
+from automaton_engine.actions.common import fan_out
+
+logger = logging.getLogger(__name__)
+
+
+""" entry point group third party packages register actions under, e.g.
+in setup.py:
+
+    entry_points={
+        "automaton_engine.actions": ["jira.create_issue = mypkg.jira:create_issue"]
+    }
+"""
+entry_point_group = "automaton_engine.actions"
+
+""" lifecycle hooks an action (or the module defining it) may provide
+- setup(session_manager) : called before the action is first used
+- flush()                : send anything the action is holding back
+- teardown()             : release the action's resources on shutdown
+"""
+lifecycle_hooks = ("setup", "flush", "teardown")
+
+
+def entry_point_specs(group: str = entry_point_group) -> dict:
+    """Action specs registered by installed packages, without importing
+    them.
+
+        Returns:
+            dict:    {action name: "module:attribute"}
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # pragma: no cover, python 3.7
+        try:
+            from importlib_metadata import entry_points
+        except ImportError:
+            return {}
+    discovered = entry_points()
+    if hasattr(discovered, "select"):
+        selected = discovered.select(group=group)
+    else:
+        selected = discovered.get(group, [])
+    return {entry_point.name: entry_point.value for entry_point in selected}
+
+
+def load_spec(spec: str):
+    """Import the object named by a "module:attribute" spec.
+    """
+    module_name, _, attribute = spec.partition(":")
+    target = importlib.import_module(module_name)
+    for part in attribute.split(".") if attribute else []:
+        target = getattr(target, part)
+    return target
+
+
+def accepts_session_manager(call) -> bool:
+    """Whether call takes a session_manager keyword, actions written for
+    the action_dispatcher dict only take (action_parameters, action_metadata).
+    """
+    try:
+        parameters = inspect.signature(call).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    return any(
+        parameter.name == "session_manager" or parameter.kind == parameter.VAR_KEYWORD
+        for parameter in parameters
+    )
+
+
+class RegisteredAction:
+    """An action resolved by ActionRegistry.
+
+    Actions are batch-aware by default: they are called with the whole
+    action_metadata list and return a BucketResult per bucket. An action
+    declaring batch = False is called once per bucket instead (as
+    call(action_parameters, bucket, session_manager=None)), fanned out
+    according to the "concurrency" action parameter. session_manager is
+    only passed to actions whose signature accepts it.
+
+    Actions defined as classes are instantiated once, so an instance can
+    hold resources shared by every call. Lifecycle hooks are looked up on
+    the instance, or for functions, on the module defining them.
+    """
+
+    def __init__(self, name: str, target):
+        self.name = name
+        if inspect.isclass(target):
+            target = target()
+            owner = target
+        else:
+            owner = inspect.getmodule(target)
+        self.call = target
+        self.batch = getattr(target, "batch", True)
+        self.session_aware = accepts_session_manager(target)
+        self.hooks = {
+            hook: getattr(owner, hook)
+            for hook in lifecycle_hooks
+            if callable(getattr(owner, hook, None))
+        }
+        self.owner = owner
+
+    async def __call__(self, action_parameters, action_metadata, session_manager=None):
+        options = {"session_manager": session_manager} if self.session_aware else {}
+        if self.batch:
+            return await self.call(action_parameters, action_metadata, **options)
+
+        async def bucket_call(bucket):
+            await self.call(action_parameters, bucket, **options)
+
+        return await fan_out(
+            action_metadata, bucket_call, action_parameters.get("concurrency")
+        )
+
+
+async def run_hook(hook, *args):
+    result = hook(*args)
+    if inspect.isawaitable(result):
+        await result
+
+
+class ActionRegistry:
+    """Resolve action names to their implementations on first use.
+
+    A name is looked up, in order, in modules ({name: "module:attribute"}),
+    in the automaton_engine.actions entry points of installed packages
+    (when entry_points is set), and finally as "module.attribute" within
+    each of packages. The built-in actions resolve through the default
+    package, e.g. awx.api_call to automaton_engine.actions.awx:api_call.
+
+    Nothing is imported until an action is first used. The registry is a
+    mapping of action names, for compatibility with the action_dispatcher
+    dict it replaces: assigning a callable registers it directly.
+    """
+
+    def __init__(
+        self, modules: dict = None, packages: list = None, entry_points: bool = True,
+    ):
+        self.modules = dict(modules or {})
+        self.packages = list(packages or []) + ["automaton_engine.actions"]
+        self.entry_points = entry_points
+        self.discovered = None
+        self.actions = {}
+        self.unknown = set()
+        self.session_manager = None
+        self.ready = {}
+
+    def spec(self, name: str) -> str:
+        if name in self.modules:
+            return self.modules[name]
+        if self.entry_points:
+            if self.discovered is None:
+                self.discovered = entry_point_specs()
+            if name in self.discovered:
+                return self.discovered[name]
+        return None
+
+    def resolve(self, name: str) -> RegisteredAction:
+        """Import the action registered as name.
+
+            Returns:
+                RegisteredAction, or None for an unknown action
+        """
+        if name in self.actions:
+            return self.actions[name]
+        if name in self.unknown:
+            return None
+        spec = self.spec(name)
+        if spec is not None:
+            target = load_spec(spec)
+        else:
+            target = None
+            module_name, _, attribute = name.rpartition(".")
+            for package in self.packages if module_name else []:
+                try:
+                    module = importlib.import_module(
+                        "{}.{}".format(package, module_name)
+                    )
+                except ModuleNotFoundError as e:
+                    # only a missing action module means try the next package
+                    if not "{}.{}".format(package, module_name).startswith(e.name):
+                        raise
+                    continue
+                target = getattr(module, attribute, None)
+                if target is not None:
+                    break
+        if target is None:
+            logger.warning("no action registered as: %s", name)
+            self.unknown.add(name)
+            return None
+        self.actions[name] = RegisteredAction(name, target)
+        logger.debug("registered action: %s", name)
+        return self.actions[name]
+
+    def __contains__(self, name: str) -> bool:
+        return self.resolve(name) is not None
+
+    def __getitem__(self, name: str) -> RegisteredAction:
+        action = self.resolve(name)
+        if action is None:
+            raise KeyError(name)
+        return action
+
+    def __setitem__(self, name: str, target):
+        if not isinstance(target, RegisteredAction):
+            target = RegisteredAction(name, target)
+        self.unknown.discard(name)
+        self.actions[name] = target
+        self.ready.pop(name, None)
+
+    def get(self, name: str, default=None) -> RegisteredAction:
+        action = self.resolve(name)
+        return default if action is None else action
+
+    def __delitem__(self, name: str):
+        del self.actions[name]
+        self.ready.pop(name, None)
+
+    async def acquire(self, name: str, session_manager=None) -> RegisteredAction:
+        """Resolve name, running the action's setup hook on first use.
+        """
+        action = self[name]
+        if name not in self.ready:
+            if session_manager is not None:
+                self.session_manager = session_manager
+            owner_ready = [
+                ready
+                for other, ready in self.ready.items()
+                if self.actions[other].owner is action.owner
+            ]
+            if owner_ready:
+                self.ready[name] = owner_ready[0]
+            else:
+                self.ready[name] = asyncio.ensure_future(self.setup(action))
+        await asyncio.shield(self.ready[name])
+        return action
+
+    async def setup(self, action: RegisteredAction):
+        if "setup" in action.hooks:
+            await run_hook(action.hooks["setup"], self.session_manager)
+            logger.debug("action: %s set up", action.name)
+
+    def owners(self) -> list:
+        """Actions in use, one per module or instance owning their hooks.
+        """
+        owners = {}
+        for name in self.ready:
+            owners.setdefault(id(self.actions[name].owner), self.actions[name])
+        return list(owners.values())
+
+    async def flush(self):
+        for action in self.owners():
+            if "flush" in action.hooks:
+                await run_hook(action.hooks["flush"])
+
+    async def close(self):
+        """Flush and tear down every action that was used.
+        """
+        await self.flush()
+        for action in self.owners():
+            if "teardown" in action.hooks:
+                try:
+                    await run_hook(action.hooks["teardown"])
+                except Exception as e:
+                    logger.error("action: %s teardown failed: %r", action.name, e)
+        self.ready = {}
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+""" adaptive polling defaults, min_interval defaults to query_interval and
+max_interval to max_ratio times query_interval
+- backoff_factor    : growth of the interval per poll without activity,
+                      or under cluster pressure
+- latency_ratio     : queries slower than latency_ratio times their average
+                      latency signal cluster pressure
+- latency_floor     : and at least latency_floor seconds slower than it, so
+                      that jitter on fast queries is not taken for
+                      pressure (0 disables the floor)
+- latency_smoothing : weight of the latest poll in the average latency
+- max_ratio         : default max_interval, in query_intervals
+"""
+adaptive_defaults = {
+    "backoff_factor": 2.0,
+    "latency_ratio": 2.0,
+    "latency_floor": 0.05,
+    "latency_smoothing": 0.2,
+    "max_ratio": 10,
+}
+
+
+def adaptive_settings(es_query: dict) -> dict:
+    """Adaptive polling settings of a query, None when it polls at its
+    fixed query_interval.
+
+        Raises:
+            ValueError
+    """
+    if "adaptive" not in es_query:
+        return None
+    settings = dict(adaptive_defaults, **(es_query["adaptive"] or {}))
+    max_ratio = settings.pop("max_ratio")
+    settings.setdefault("min_interval", es_query["query_interval"])
+    settings.setdefault("max_interval", es_query["query_interval"] * max_ratio)
+    for key, value in settings.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("adaptive {} must be a positive number".format(key))
+        if value < 0 or (value == 0 and key != "latency_floor"):
+            raise ValueError("adaptive {} must be a positive number".format(key))
+    if settings["min_interval"] > settings["max_interval"]:
+        raise ValueError("adaptive min_interval must not exceed max_interval")
+    if settings["backoff_factor"] <= 1 or settings["latency_ratio"] <= 1:
+        raise ValueError("adaptive backoff_factor and latency_ratio must exceed 1")
+    if settings["latency_smoothing"] > 1:
+        raise ValueError("adaptive latency_smoothing must not exceed 1")
+    return settings
+
+
+class AdaptiveInterval:
+    """Poll interval of an automaton, adapted after every poll.
+
+    The interval snaps back to min_interval when buckets appear or the
+    bucket count rises, holds while it does not, and grows by
+    backoff_factor up to max_interval while queries return no buckets.
+    Polls that fail, or whose queries take more than latency_ratio times
+    their average latency and at least latency_floor seconds more, grow
+    the interval whatever the activity, so a cluster under pressure is
+    queried less.
+    """
+
+    def __init__(
+        self,
+        query_interval: float,
+        min_interval: float,
+        max_interval: float,
+        backoff_factor: float = 2.0,
+        latency_ratio: float = 2.0,
+        latency_smoothing: float = 0.2,
+        latency_floor: float = 0.05,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.latency_ratio = latency_ratio
+        self.latency_smoothing = latency_smoothing
+        self.latency_floor = latency_floor
+        self.interval = min(max(query_interval, min_interval), max_interval)
+        self.latency = None
+        self.previous = None
+        self.reset()
+
+    def reset(self):
+        self.buckets = 0
+        self.queries = 0
+        self.elapsed = 0.0
+
+    def observe(self, latency: float):
+        """Record the latency of a query sent to elasticsearch by the
+        current poll, responses shared through the query_cache are not.
+        """
+        self.queries += 1
+        self.elapsed += latency
+
+    def count(self, buckets: int):
+        """Record buckets returned to the current poll (or a page of it).
+        """
+        self.buckets += buckets
+
+    def update(self, failed: bool = False) -> float:
+        """Adapt the interval to the poll just completed.
+
+            Args:
+                bool:     failed (the poll raised)
+            Returns:
+                float:    interval (seconds until the next poll)
+        """
+        pressure = failed
+        if not failed and self.queries:
+            latency = self.elapsed / self.queries
+            if self.latency is None:
+                self.latency = latency
+            else:
+                pressure = (
+                    latency > self.latency * self.latency_ratio
+                    and latency - self.latency >= self.latency_floor
+                )
+                self.latency += self.latency_smoothing * (latency - self.latency)
+        if pressure or not self.buckets:
+            interval = self.interval * self.backoff_factor
+        elif self.previous is None or self.buckets > self.previous:
+            interval = self.min_interval
+        else:
+            interval = self.interval
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        if not failed:
+            self.previous = self.buckets
+        self.reset()
+        return self.interval
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import OrderedDict
+
+import hashlib
+import json
+import logging
+import time
+
+from automaton_engine.buckets import BucketBatch, as_dict, column
+from automaton_engine.state import MemoryStateBackend, state_backend
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_identity(value) -> str:
+    """Stable string form of a bucket key (composite keys are dicts).
+    """
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def bucket_fingerprint(bucket: dict, dedup_fields: list = None) -> str:
+    """Digest of the bucket fields whose change re-triggers an action, all
+    fields unless dedup_fields is given.
+    """
+    if dedup_fields is not None:
+        bucket = {field: bucket.get(field) for field in dedup_fields}
+    else:
+        bucket = as_dict(bucket)
+    return hashlib.sha1(
+        json.dumps(bucket, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+class BackoffStore:
+    """Backoff and deduplication state per (automaton, action, bucket key).
+
+    An action fires for a bucket when its key has not fired before (or
+    not been seen for ttl seconds), or when backoff seconds have passed
+    since it last fired and its fingerprint has changed. Entries are
+    refreshed each time their key is seen, expire ttl seconds after they
+    were last seen, and the least recently seen are evicted beyond
+    max_entries.
+
+    Each entry is [fired_at, seen_at, fingerprint, expires_at].
+
+    Entries are loaded from backend at construction, and changes are
+    written back in batches every flush_interval seconds from a worker
+    thread, so persisting state never blocks the event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 100000,
+        backend: str = "memory",
+        flush_interval: float = 1.0,
+        **backend_options
+    ):
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.backend = state_backend(backend, **backend_options)
+        self.entries = OrderedDict()
+        self.changes = {}
+        self.flusher = None
+        now = time.time()
+        for key, entry in self.backend.load():
+            if entry[3] > now:
+                self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if self.entries:
+            logger.info(
+                "loaded %s backoff entries from %s state", len(self.entries), backend
+            )
+
+    def select(
+        self,
+        automaton: str,
+        action: str,
+        buckets: list,
+        key_field: str,
+        backoff: float,
+        ttl: float,
+        dedup_fields: list = None,
+        now: float = None,
+    ) -> list:
+        """Return the buckets action should fire for.
+
+            Args:
+                str:      automaton (automaton_engine name)
+                str:      action (action identifier within the automaton)
+                list:     buckets (mapped_responses from ResponseMapper)
+                str:      key_field (mapped name of the bucket key)
+                float:    backoff (minimum seconds between firings per key)
+                float:    ttl (seconds after which an unseen key is forgotten)
+                list:     dedup_fields (fields compared for changes, None for all)
+                float:    now (epoch seconds, defaults to the current time)
+            Returns:
+                list:     buckets to fire for
+        """
+        now = time.time() if now is None else now
+        self.expire(now)
+        selected = BucketBatch() if isinstance(buckets, BucketBatch) else []
+        for bucket, value in zip(buckets, column(buckets, key_field)):
+            key = (automaton, action, bucket_identity(value))
+            entry = self.entries.get(key)
+            if entry is None or entry[3] <= now:
+                selected.append(bucket)
+                continue
+            entry[1], entry[3] = now, now + ttl
+            self.entries.move_to_end(key)
+            self.changed(key, entry)
+            if now - entry[0] >= backoff and entry[2] != bucket_fingerprint(
+                bucket, dedup_fields
+            ):
+                selected.append(bucket)
+        return selected
+
+    def record(
+        self,
+        automaton: str,
+        action: str,
+        buckets: list,
+        key_field: str,
+        ttl: float,
+        dedup_fields: list = None,
+        now: float = None,
+    ):
+        """Record that action fired for buckets.
+        """
+        now = time.time() if now is None else now
+        for bucket in buckets:
+            key = (automaton, action, bucket_identity(bucket.get(key_field)))
+            self.entries[key] = [
+                now,
+                now,
+                bucket_fingerprint(bucket, dedup_fields),
+                now + ttl,
+            ]
+            self.entries.move_to_end(key)
+            self.changed(key, self.entries[key])
+        while len(self.entries) > self.max_entries:
+            self.changed(self.entries.popitem(last=False)[0], None)
+
+    def forget(self, automaton: str, action: str, buckets: list, key_field: str):
+        """Forget that action fired for buckets, so they are selected again.
+        """
+        for bucket in buckets:
+            key = (automaton, action, bucket_identity(bucket.get(key_field)))
+            if self.entries.pop(key, None) is not None:
+                self.changed(key, None)
+
+    def expire(self, now: float):
+        """Drop expired entries from the least recently seen end.
+        """
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry[3] > now:
+                break
+            del self.entries[key]
+            self.changed(key, None)
+
+    def changed(self, key: tuple, entry: list):
+        """Queue a change for the next batched write, starting the flusher
+        on first use from within the running loop.
+        """
+        if isinstance(self.backend, MemoryStateBackend):
+            return
+        self.changes[key] = None if entry is None else list(entry)
+        if self.flusher is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self.flusher = loop.create_task(self.flush_periodically())
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write queued changes to the backend from a worker thread.
+        """
+        if not self.changes:
+            return
+        changes, self.changes = self.changes, {}
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.backend.write, changes
+            )
+        except Exception as e:
+            logger.error("failed to persist backoff state: %r", e)
+            changes.update(self.changes)
+            self.changes = changes
+
+    async def close(self):
+        """Stop the flusher, write outstanding changes and close the backend.
+        """
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+        self.backend.close()
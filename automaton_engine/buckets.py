@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections.abc import Mapping
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Bucket(Mapping):
+    """A mapped bucket, read only: the values of an elasticsearch bucket in
+    a tuple, and the positions of its mapped field names in an index
+    shared by every bucket of the same layout.
+
+    Buckets cost a fraction of the dict they stand for and compare equal
+    to it. Actions are handed dicts, see to_dict and as_dicts.
+    """
+
+    __slots__ = ("index", "row")
+
+    def __init__(self, index: dict, row: tuple):
+        self.index = index
+        self.row = row
+
+    def __getitem__(self, name):
+        return self.row[self.index[name]]
+
+    def get(self, name, default=None):
+        position = self.index.get(name)
+        return default if position is None else self.row[position]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {name: self.row[position] for name, position in self.index.items()}
+
+
+class BucketBatch(list):
+    """Mapped buckets of a query response (or page), in order.
+
+    Fields are read a column at a time with column, which only looks a
+    field's position up again when the layout changes.
+    """
+
+    __slots__ = ()
+
+    def column(self, name, default=None) -> list:
+        """Value of field name for every bucket, default where it is absent.
+        """
+        values = []
+        index = position = None
+        for bucket in self:
+            if not isinstance(bucket, Bucket):
+                values.append(bucket.get(name, default))
+                continue
+            if bucket.index is not index:
+                index = bucket.index
+                position = index.get(name)
+            values.append(default if position is None else bucket.row[position])
+        return values
+
+
+def layout_index(names: list) -> dict:
+    """Index of the mapped field names of a bucket layout, the last
+    position winning should two names coincide (as in a dict).
+    """
+    return {name: position for position, name in enumerate(names)}
+
+
+def column(buckets: list, name, default=None) -> list:
+    """Value of field name for every bucket of buckets, a BucketBatch or
+    any list of mappings.
+    """
+    if isinstance(buckets, BucketBatch):
+        return buckets.column(name, default)
+    return [bucket.get(name, default) for bucket in buckets]
+
+
+def as_dict(bucket) -> dict:
+    return bucket.to_dict() if isinstance(bucket, Bucket) else bucket
+
+
+def as_dicts(buckets: list) -> list:
+    """buckets as a list of dicts, for actions and anything serialized.
+    """
+    return [as_dict(bucket) for bucket in buckets]
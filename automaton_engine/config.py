@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import ast
+import json
+import os
+from dataclasses import asdict, dataclass, field
+
+import logging
+
+from automaton_engine.adaptive import adaptive_settings
+from automaton_engine.paging import paging_settings
+from automaton_engine.predicate import Predicate, PredicateError
+
+logger = logging.getLogger(__name__)
+
+
+""" keys every automaton configuration must provide, per level
+"""
+automaton_keys = (
+    "name",
+    "enabled",
+    "runonce",
+    "elasticsearch",
+    "elasticsearch_query",
+    "actions",
+)
+elasticsearch_keys = ("url", "timeout")
+query_keys = (
+    "query_interval",
+    "query_endpoint",
+    "query_type",
+    "query_name",
+    "query_payload",
+    "query_response_mapping",
+)
+action_keys = ("name", "backoff_seconds", "parameters")
+
+
+class ConfigError(ValueError):
+    """Raised for configuration that cannot be loaded or is invalid.
+    """
+
+
+def require(section: dict, keys: tuple, where: str):
+    if not isinstance(section, dict):
+        raise ConfigError("{}: expected a mapping, got: {!r}".format(where, section))
+    missing = [key for key in keys if key not in section]
+    if missing:
+        raise ConfigError("{}: missing {}".format(where, ", ".join(missing)))
+
+
+@dataclass
+class AutomatonConfig:
+    """Validated configuration of a single automaton_engine.
+    """
+
+    name: str
+    enabled: bool
+    runonce: bool
+    elasticsearch: dict
+    elasticsearch_query: dict
+    actions: list
+    parallel_actions: bool = False
+
+    @classmethod
+    def from_dict(cls, automaton: dict) -> "AutomatonConfig":
+        """Validate and convert an automaton configuration.
+
+            Args:
+                dict:               automaton (automaton configuration)
+            Returns:
+                AutomatonConfig
+            Raises:
+                ConfigError
+        """
+        require(automaton, automaton_keys, "automaton")
+        where = "automaton {}".format(automaton["name"])
+        require(
+            automaton["elasticsearch"], elasticsearch_keys, where + " elasticsearch"
+        )
+        require(
+            automaton["elasticsearch_query"],
+            query_keys,
+            where + " elasticsearch_query",
+        )
+        if "predicate" in automaton["elasticsearch_query"]:
+            try:
+                Predicate(automaton["elasticsearch_query"]["predicate"])
+            except PredicateError as e:
+                raise ConfigError("{}: {}".format(where, e))
+        try:
+            paging_settings(automaton["elasticsearch_query"])
+            adaptive_settings(automaton["elasticsearch_query"])
+        except ValueError as e:
+            raise ConfigError("{}: {}".format(where, e))
+        if not isinstance(automaton["actions"], list):
+            raise ConfigError(where + ": actions must be a list")
+        for index, action in enumerate(automaton["actions"]):
+            require(action, action_keys, "{} action {}".format(where, index))
+        return cls(
+            automaton["name"],
+            bool(automaton["enabled"]),
+            bool(automaton["runonce"]),
+            automaton["elasticsearch"],
+            automaton["elasticsearch_query"],
+            automaton["actions"],
+            bool(automaton.get("parallel_actions", False)),
+        )
+
+
+@dataclass
+class EngineConfig:
+    """Validated automaton engine configuration: the automatons, and every
+    other top-level section (http, scheduler, backoff...) as given.
+    """
+
+    automatons: list
+    sections: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, config: dict) -> "EngineConfig":
+        """Validate and convert an automaton engine configuration.
+
+            Args:
+                dict:            config (automaton engine configuration)
+            Returns:
+                EngineConfig
+            Raises:
+                ConfigError
+        """
+        require(config, ("automatons",), "config")
+        automatons = [
+            AutomatonConfig.from_dict(automaton) for automaton in config["automatons"]
+        ]
+        names = [automaton.name for automaton in automatons]
+        duplicates = sorted(set(name for name in names if names.count(name) > 1))
+        if duplicates:
+            raise ConfigError(
+                "duplicate automaton names: {}".format(", ".join(duplicates))
+            )
+        sections = {key: value for key, value in config.items() if key != "automatons"}
+        for name, section in sections.items():
+            if not isinstance(section, dict):
+                raise ConfigError("config: section {} must be a mapping".format(name))
+        return cls(automatons, sections)
+
+    def section(self, name: str) -> dict:
+        """Copy of a top-level section, empty when not configured.
+        """
+        return dict(self.sections.get(name, {}))
+
+    def to_dict(self) -> dict:
+        config = dict(self.sections)
+        config["automatons"] = [asdict(automaton) for automaton in self.automatons]
+        return config
+
+
+def parse_document(text: str, source: str):
+    """Parse JSON, or the python literal form AUTOMATON_ENGINE_CONFIG
+    accepts (True/False rather than true/false).
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError) as e:
+        raise ConfigError("{}: unable to parse: {}".format(source, e))
+
+
+def config_files(path: str) -> list:
+    """Configuration files at path, a file or a directory of *.json files.
+    """
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.endswith(".json") and not name.startswith(".")
+        )
+    return [path]
+
+
+def load_config(path: str) -> EngineConfig:
+    """Load configuration from a file, or from every *.json file in a
+    directory (in name order). Each file holds either a complete
+    configuration, a single automaton, or a list of automatons. Sections
+    from later files override earlier ones, automatons are combined.
+
+        Args:
+            str:             path (file or directory)
+        Returns:
+            EngineConfig
+        Raises:
+            ConfigError
+    """
+    config = {"automatons": []}
+    for source in config_files(path):
+        try:
+            with open(source) as config_file:
+                document = parse_document(config_file.read(), source)
+        except OSError as e:
+            raise ConfigError("{}: {}".format(source, e))
+        if isinstance(document, list):
+            config["automatons"].extend(document)
+        elif isinstance(document, dict) and "automatons" in document:
+            automatons = config["automatons"] + list(document["automatons"])
+            config.update(document)
+            config["automatons"] = automatons
+        elif isinstance(document, dict) and "name" in document:
+            config["automatons"].append(document)
+        else:
+            raise ConfigError("{}: not an automaton configuration".format(source))
+    return EngineConfig.from_dict(config)
+
+
+def diff(current: dict, new: dict) -> tuple:
+    """Compare two {name: AutomatonConfig} mappings.
+
+        Returns:
+            tuple:    (added, removed, changed) automaton names
+    """
+    added = [name for name in new if name not in current]
+    removed = [name for name in current if name not in new]
+    changed = [name for name in new if name in current and current[name] != new[name]]
+    return added, removed, changed
+
+
+class ConfigWatcher:
+    """Watch a configuration file or directory for changes by polling the
+    modification time and size of its files every interval seconds.
+    """
+
+    def __init__(self, path: str, interval: float = 2.0):
+        self.path = path
+        self.interval = interval
+        self.fingerprint = None
+        self.sections = {}
+
+    def stat(self) -> tuple:
+        fingerprint = []
+        for source in config_files(self.path):
+            try:
+                stat = os.stat(source)
+            except OSError:
+                continue
+            fingerprint.append((source, stat.st_mtime_ns, stat.st_size))
+        return tuple(fingerprint)
+
+    def load(self) -> EngineConfig:
+        """Load the configuration, remembering the state it was loaded at
+        so that an invalid configuration is only reported once.
+        """
+        self.fingerprint = self.stat()
+        config = load_config(self.path)
+        self.sections = config.sections
+        return config
+
+    def changed(self) -> bool:
+        return self.stat() != self.fingerprint
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import logging
+
+from automaton_engine.sharding import HashRing
+
+logger = logging.getLogger(__name__)
+
+
+""" Lease stores record which replica owns which automaton, and which
+replicas are alive. Every method is synchronous and atomic:
+- heartbeat(replica, ttl)      : keep replica alive for ttl seconds,
+                                 returns the live replicas, sorted
+- acquire(names, owner, ttl)   : take or renew the leases on names that
+                                 are free, expired or already owner's,
+                                 returns the names owner now holds
+- release(names, owner)        : give up owner's leases on names
+- leave(replica)               : drop replica from the live replicas
+Expiry uses the wall clock, so replicas sharing a store need reasonably
+synchronised clocks.
+"""
+
+
+class MemoryLeaseStore:
+    """Leases held in memory, shared by the replicas of a single process
+    (testing).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.leases = {}
+        self.members = {}
+
+    def heartbeat(self, replica: str, ttl: float) -> list:
+        now = time.time()
+        with self.lock:
+            self.members[replica] = now + ttl
+            self.members = {
+                member: expires_at
+                for member, expires_at in self.members.items()
+                if expires_at > now
+            }
+            return sorted(self.members)
+
+    def acquire(self, names: list, owner: str, ttl: float) -> list:
+        now = time.time()
+        acquired = []
+        with self.lock:
+            for name in names:
+                holder, expires_at = self.leases.get(name, (None, 0.0))
+                if holder in (None, owner) or expires_at <= now:
+                    self.leases[name] = (owner, now + ttl)
+                    acquired.append(name)
+        return acquired
+
+    def release(self, names: list, owner: str):
+        with self.lock:
+            for name in names:
+                if self.leases.get(name, (None,))[0] == owner:
+                    del self.leases[name]
+
+    def leave(self, replica: str):
+        with self.lock:
+            self.members.pop(replica, None)
+
+    def close(self):
+        pass
+
+
+class SQLiteLeaseStore:
+    """Leases held in a SQLite database, shared by replicas on the same
+    host or volume. Each call is a single immediate transaction.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS leases "
+            "(name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS members (replica TEXT PRIMARY KEY, expires_at REAL)"
+        )
+
+    def transaction(self, statements):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self.db)
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+            return result
+
+    def heartbeat(self, replica: str, ttl: float) -> list:
+        now = time.time()
+
+        def statements(db):
+            db.execute(
+                "INSERT OR REPLACE INTO members VALUES (?, ?)", (replica, now + ttl)
+            )
+            db.execute("DELETE FROM members WHERE expires_at <= ?", (now,))
+            return [
+                row[0]
+                for row in db.execute("SELECT replica FROM members ORDER BY replica")
+            ]
+
+        return self.transaction(statements)
+
+    def acquire(self, names: list, owner: str, ttl: float) -> list:
+        now = time.time()
+
+        def statements(db):
+            acquired = []
+            for name in names:
+                db.execute(
+                    "UPDATE leases SET owner = ?, expires_at = ? "
+                    "WHERE name = ? AND (owner = ? OR expires_at <= ?)",
+                    (owner, now + ttl, name, owner, now),
+                )
+                db.execute(
+                    "INSERT OR IGNORE INTO leases VALUES (?, ?, ?)",
+                    (name, owner, now + ttl),
+                )
+                holder = db.execute(
+                    "SELECT owner FROM leases WHERE name = ?", (name,)
+                ).fetchone()
+                if holder[0] == owner:
+                    acquired.append(name)
+            return acquired
+
+        return self.transaction(statements)
+
+    def release(self, names: list, owner: str):
+        self.transaction(
+            lambda db: db.executemany(
+                "DELETE FROM leases WHERE name = ? AND owner = ?",
+                [(name, owner) for name in names],
+            )
+        )
+
+    def leave(self, replica: str):
+        self.transaction(
+            lambda db: db.execute("DELETE FROM members WHERE replica = ?", (replica,))
+        )
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class RedisLeaseStore:
+    """Leases held on a Redis server, shared by replicas anywhere. Leases
+    are keys expiring with their ttl, changed atomically by Lua scripts,
+    and replicas are members of a sorted set scored by expiry.
+
+    client needs the redis-py style methods eval, zadd, zremrangebyscore,
+    zrange and zrem, as provided by redis.Redis.
+    """
+
+    acquire_script = """
+    local acquired = {}
+    for index, key in ipairs(KEYS) do
+        local holder = redis.call('GET', key)
+        if not holder or holder == ARGV[1] then
+            redis.call('SET', key, ARGV[1], 'PX', ARGV[2])
+            table.insert(acquired, index)
+        end
+    end
+    return acquired
+    """
+    release_script = """
+    for index, key in ipairs(KEYS) do
+        if redis.call('GET', key) == ARGV[1] then
+            redis.call('DEL', key)
+        end
+    end
+    return 0
+    """
+
+    def __init__(self, client, prefix: str = "automaton_engine:"):
+        self.client = client
+        self.prefix = prefix
+        self.members = prefix + "members"
+
+    def keys(self, names: list) -> list:
+        return [self.prefix + "lease:" + name for name in names]
+
+    def heartbeat(self, replica: str, ttl: float) -> list:
+        now = time.time()
+        self.client.zadd(self.members, {replica: now + ttl})
+        self.client.zremrangebyscore(self.members, "-inf", now)
+        return sorted(
+            member.decode("utf-8") if isinstance(member, bytes) else member
+            for member in self.client.zrange(self.members, 0, -1)
+        )
+
+    def acquire(self, names: list, owner: str, ttl: float) -> list:
+        if not names:
+            return []
+        indices = self.client.eval(
+            self.acquire_script, len(names), *self.keys(names), owner, int(ttl * 1000)
+        )
+        return [names[int(index) - 1] for index in indices]
+
+    def release(self, names: list, owner: str):
+        if names:
+            self.client.eval(self.release_script, len(names), *self.keys(names), owner)
+
+    def leave(self, replica: str):
+        self.client.zrem(self.members, replica)
+
+    def close(self):
+        pass
+
+
+def lease_store(store: str = "memory", path: str = None, url: str = None):
+    """Create the lease store named by store.
+
+        Args:
+            str:    store (memory, sqlite or redis)
+            str:    path (sqlite database path)
+            str:    url (redis url, requires the redis package)
+        Returns:
+            lease store
+        Raises:
+            ValueError
+    """
+    if store == "memory":
+        return MemoryLeaseStore()
+    if store == "sqlite":
+        return SQLiteLeaseStore(path)
+    if store == "redis":
+        import redis
+
+        return RedisLeaseStore(redis.Redis.from_url(url))
+    raise ValueError("unknown lease store: {}".format(store))
+
+
+""" group members are registered as group/replica_id
+"""
+group_separator = "/"
+
+
+class LeaseCoordinator:
+    """Split the automatons of a Runtime between replicas sharing a lease
+    store.
+
+    Every renew_interval seconds each replica renews its membership, hashes
+    the automaton names onto the live replicas, releases the leases of
+    automatons hashed elsewhere and takes or renews the leases of those
+    hashed to it. Only automatons whose lease it holds are run. A replica
+    that stops renewing loses its membership and leases after lease_ttl
+    seconds, and the survivors take its automatons over. On close leases
+    are released, for an immediate handover. A poll already running when
+    an automaton changes hands is left to finish.
+
+    Replicas in a group only hash automatons onto the live members of the
+    same group. In sharded mode each shard worker joins the group of its
+    shard, so the automatons of a shard are split between the workers of
+    that shard on every replica only.
+    """
+
+    def __init__(
+        self,
+        runtime,
+        store,
+        replica_id: str = None,
+        lease_ttl: float = 15.0,
+        renew_interval: float = None,
+        group: str = None,
+    ):
+        self.runtime = runtime
+        self.store = store
+        replica_id = replica_id or "{}-{}".format(socket.gethostname(), os.getpid())
+        if group_separator in replica_id:
+            raise ValueError(
+                "replica_id must not contain {!r}: {}".format(
+                    group_separator, replica_id
+                )
+            )
+        self.group = group
+        self.replica_id = group + group_separator + replica_id if group else replica_id
+        self.lease_ttl = lease_ttl
+        self.renew_interval = renew_interval or lease_ttl / 3
+        self.owned = set()
+        self.members = []
+        self.renewed_at = None
+        self.task = None
+        self.select = runtime.select
+        runtime.select = self.owns
+
+    def peers(self, members: list) -> list:
+        """Live members of this replica's group.
+        """
+        return [
+            member
+            for member in members
+            if member.rpartition(group_separator)[0] == (self.group or "")
+        ]
+
+    def owns(self, name: str) -> bool:
+        return name in self.owned and (self.select is None or self.select(name))
+
+    async def run_in_executor(self, call, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, call, *args)
+
+    def update(self, owned: set):
+        if owned != self.owned:
+            logger.info(
+                "replica %s now owns %s automatons (gained %s, lost %s)",
+                self.replica_id,
+                len(owned),
+                sorted(owned - self.owned),
+                sorted(self.owned - owned),
+            )
+            self.owned = owned
+            self.runtime.apply(self.runtime.config)
+
+    async def renew(self):
+        """Renew membership and leases once, and apply the ownership that
+        results.
+        """
+        started = time.monotonic()
+        self.members = self.peers(
+            await self.run_in_executor(
+                self.store.heartbeat, self.replica_id, self.lease_ttl
+            )
+        )
+        ring = HashRing(self.members)
+        names = [
+            automaton.name
+            for automaton in self.runtime.config.automatons
+            if self.select is None or self.select(automaton.name)
+        ]
+        assigned = {name for name in names if ring.shard(name) == self.replica_id}
+        released = sorted(self.owned - assigned)
+        if released:
+            self.update(self.owned & assigned)
+            await self.run_in_executor(self.store.release, released, self.replica_id)
+        acquired = await self.run_in_executor(
+            self.store.acquire, sorted(assigned), self.replica_id, self.lease_ttl
+        )
+        self.renewed_at = started
+        self.update(set(acquired))
+
+    async def coordinate(self):
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                await self.renew()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("replica %s lease renewal failed: %r", self.replica_id, e)
+                if (
+                    self.renewed_at is None
+                    or time.monotonic() - self.renewed_at >= self.lease_ttl
+                ):
+                    # leases have expired, other replicas may hold them now
+                    self.update(set())
+
+    async def start(self):
+        self.runtime.scheduler.persistent = True
+        try:
+            await self.renew()
+        except Exception as e:
+            logger.error("replica %s lease renewal failed: %r", self.replica_id, e)
+        # stop automatons applied before select was wrapped
+        self.runtime.apply(self.runtime.config)
+        self.task = asyncio.ensure_future(self.coordinate())
+
+    async def close(self):
+        """Stop renewing and hand the owned automatons over.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        owned = sorted(self.owned)
+        self.update(set())
+        try:
+            await self.run_in_executor(self.store.release, owned, self.replica_id)
+            await self.run_in_executor(self.store.leave, self.replica_id)
+        except Exception as e:
+            logger.error("replica %s failed to release leases: %r", self.replica_id, e)
+        self.store.close()
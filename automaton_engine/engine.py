@@ -3,27 +3,80 @@
 
 import asyncio
 import async_timeout
-from aiohttp import ClientSession, BasicAuth
+import time
+from aiohttp import BasicAuth
 from dataclasses import dataclass
 
-import json
 import logging
-import datetime
 
-from automaton_engine.actions import awx
-from automaton_engine.actions import notify
+from automaton_engine.action_queue import (
+    ActionJob,
+    ActionQueue,
+    destination,
+    idempotency_key,
+)
+from automaton_engine.actions.common import BucketResult
+from automaton_engine.actions.registry import ActionRegistry
+from automaton_engine.adaptive import AdaptiveInterval, adaptive_settings
+from automaton_engine.backoff import BackoffStore
+from automaton_engine.buckets import Bucket, BucketBatch, as_dicts, layout_index
+from automaton_engine.incremental import IncrementalQuery, WatermarkStore
+from automaton_engine.metrics import MetricsRegistry
+from automaton_engine.msearch import MultiSearchBatcher
+from automaton_engine.paging import page_payload, paging_settings
+from automaton_engine.predicate import Predicate
+from automaton_engine.query_cache import QueryCache
+from automaton_engine.resilience import QueryStatusError, ResilienceManager
+from automaton_engine.scheduler import ClusterSlots, null_slot
+from automaton_engine.serialization import dumps, loads
+from automaton_engine.session import SessionManager, client_session
 
 logger = logging.getLogger(__name__)
 
 
-""" action_dispatcher defines actions which can be effected
+""" action_dispatcher defines actions which can be effected, imported on
+first use
 - actions.notify : send webhook notification to RocketChat
 - actions.awx    : send api call to ansible awx
+as well as actions registered by installed packages
 """
-action_dispatcher = {
-    "notify.rocketchat_webhook": notify.rocketchat_webhook,
-    "awx.api_call": awx.api_call,
-}
+action_dispatcher = ActionRegistry()
+
+
+class ActionSpec:
+    """An action of an automaton, read once from its configuration.
+    - config       : the action configuration as given
+    - action_id    : identifies the action within the automaton, its name
+                     unless several of the automaton's actions share it
+    - backoff      : backoff_seconds
+    - ttl          : dedup_ttl_seconds, backoff_seconds when not given
+    - dedup_fields : fields compared for changes, None for all
+    - destination  : what the action delivers to (see action_queue)
+    - labels       : metric labels
+    """
+
+    __slots__ = (
+        "config",
+        "name",
+        "action_id",
+        "parameters",
+        "backoff",
+        "ttl",
+        "dedup_fields",
+        "destination",
+        "labels",
+    )
+
+    def __init__(self, config: dict, action_id: str, labels: tuple):
+        self.config = config
+        self.name = config["name"]
+        self.action_id = action_id
+        self.parameters = config["parameters"]
+        self.backoff = config["backoff_seconds"]
+        self.ttl = config.get("dedup_ttl_seconds", self.backoff)
+        self.dedup_fields = config.get("dedup_fields")
+        self.destination = destination(config)
+        self.labels = labels
 
 
 @dataclass
@@ -37,9 +90,23 @@ class AutomatonEngine:
     elasticsearch: dict
     es_query: dict
     actions: list
+    session_manager: SessionManager = None
+    parallel_actions: bool = False
+    query_batcher: MultiSearchBatcher = None
+    checkpoint_store: WatermarkStore = None
+    backoff_store: BackoffStore = None
+    metrics: MetricsRegistry = None
+    resilience: ResilienceManager = None
+    action_queue: ActionQueue = None
+    action_registry: ActionRegistry = None
+    query_cache: QueryCache = None
+    cluster_slots: ClusterSlots = None
 
     def __post_init__(self):
-        """Initialise with BasicAuth if present in config.
+        """Initialise with BasicAuth if present in config, set up incremental
+        querying and adaptive polling if configured, and join the
+        query_batcher when one is provided. Actions sharing a name within the automaton are told
+        apart by their position for backoff purposes and metric labels.
         """
         if "auth" in self.elasticsearch:
             self.es_auth = BasicAuth(
@@ -48,10 +115,70 @@ class AutomatonEngine:
             )
         else:
             self.es_auth = None
+        self.query_path = (self.es_query["query_type"], self.es_query["query_name"])
+        self.mapped_keys = {}
+        self.bucket_key = self.es_query.get("query_response_mapping", {}).get(
+            "key", "key"
+        )
+        if self.backoff_store is None:
+            self.backoff_store = BackoffStore()
+        self.paging = paging_settings(self.es_query)
+        adaptive = adaptive_settings(self.es_query)
+        if adaptive is not None:
+            self.adaptive = AdaptiveInterval(
+                self.es_query["query_interval"], **adaptive
+            )
+        else:
+            self.adaptive = None
+        if "predicate" in self.es_query:
+            self.predicate = Predicate(self.es_query["predicate"], self.bucket_key)
+        else:
+            self.predicate = None
+        names = [action["name"] for action in self.actions]
+        self.action_ids = [
+            name if names.count(name) == 1 else "{}#{}".format(name, index)
+            for index, name in enumerate(names)
+        ]
+        if self.metrics is None:
+            self.metrics = MetricsRegistry()
+        if self.action_registry is None:
+            self.action_registry = action_dispatcher
+        self.metric_labels = (("automaton", self.name),)
+        self.action_labels = {
+            action_id: self.metric_labels + (("action", action_id),)
+            for action_id in self.action_ids
+        }
+        self.action_specs = [
+            ActionSpec(action, action_id, self.action_labels[action_id])
+            for action, action_id in zip(self.actions, self.action_ids)
+        ]
+        if self.es_query.get("incremental"):
+            self.incremental = IncrementalQuery(
+                self.name, self.es_query, self.checkpoint_store
+            )
+        else:
+            self.incremental = None
+        if self.query_batcher is not None:
+            self.query_batcher.register(self)
+        if self.query_cache is not None:
+            self.query_cache.register(self)
+
+    def PollInterval(self) -> float:
+        """Seconds from the start of a poll to the next, query_interval
+        unless polling is adaptive.
+        """
+        if self.adaptive is not None:
+            return self.adaptive.interval
+        return self.es_query["query_interval"]
 
     async def QueryExecutor(self) -> dict:
         """Runs query_payload and returns query_response.
 
+        Incremental automatons only query documents newer than their
+        watermark, and return the merged buckets of their window. Other
+        automatons share responses through the query_cache when one is
+        set.
+
             Args:
                 None
             Returns:
@@ -60,138 +187,525 @@ class AutomatonEngine:
                 asyncio.TimeoutError
                 General Exception
         """
+        with self.metrics.timer("query", self.metric_labels):
+            if self.incremental is None:
+                return await self.CachedSearch(self.es_query["query_payload"])
+            query_payload, now = self.incremental.prepare()
+            query_response = await self.SearchExecutor(query_payload)
+            return self.incremental.merge(query_response, now)
+
+    async def QueryPages(self):
+        """Runs a composite aggregation query_payload page by page.
+
+        Each page asks for the buckets after the after_key of the previous
+        one, until a page comes back short or without an after_key, or
+        max_buckets have been read.
+
+            Args:
+                None
+            Yields:
+                dict:    query_response (elasticsearch query response, per page)
+            Raises:
+                asyncio.TimeoutError
+                General Exception
+        """
+        after, total = None, 0
+        while True:
+            size = min(self.paging["page_size"], self.paging["max_buckets"] - total)
+            query_payload = page_payload(
+                self.es_query["query_payload"], self.es_query["query_name"], size, after
+            )
+            with self.metrics.timer("query", self.metric_labels):
+                query_response = await self.CachedSearch(query_payload)
+            self.metrics.inc("query_pages_total", self.metric_labels)
+            buckets = self.BucketExtractor(query_response)
+            total += len(buckets)
+            yield query_response
+            after = query_response[self.query_path[0]][self.query_path[1]].get(
+                "after_key"
+            )
+            if after is None or len(buckets) < size:
+                return
+            if total >= self.paging["max_buckets"]:
+                logger.warning(
+                    "automaton_engine: %s stopped paging at max_buckets %s",
+                    self.name,
+                    self.paging["max_buckets"],
+                )
+                return
+
+    async def CachedSearch(self, query_payload: dict) -> dict:
+        """SearchExecutor through the query_cache, when one is set.
+        """
+        if self.query_cache is not None:
+            return await self.query_cache.search(self, query_payload)
+        return await self.SearchExecutor(query_payload)
+
+    async def SearchExecutor(self, query_payload: dict, batched: bool = True) -> dict:
+        """Send query_payload to query_endpoint and return the response.
+
+        When a query_batcher is set the query is sent as part of a
+        _msearch request shared with other automatons on the same cluster.
+        With resilience set, failed queries are retried with backoff, a
+        cluster that keeps failing is left alone while its circuit is
+        open, and slow queries are hedged to elasticsearch secondary_url
+        when one is configured. Adaptive automatons record how long the
+        query took.
+
+            Args:
+                dict:    query_payload
+                bool:    batched (allow the query to be batched)
+            Returns:
+                dict:    query_response (elasticsearch query response)
+            Raises:
+                asyncio.TimeoutError
+                CircuitOpenError
+                General Exception
+        """
+        started = time.perf_counter()
         try:
-            async with ClientSession(
-                skip_auto_headers=["User-Agent"], auth=self.es_auth
-            ) as session:
-                with async_timeout.timeout(self.elasticsearch["timeout"]):
-                    async with session.post(
-                        self.elasticsearch["url"] + self.es_query["query_endpoint"],
-                        data=json.dumps(self.es_query["query_payload"]),
-                        headers={"content-type": "application/json"},
-                    ) as response:
-                        logger.debug(response)
-                        assert response.status == 200
-                        query_response = await response.json()
-                        return query_response
+            batch = (
+                batched
+                and self.query_batcher is not None
+                and self.query_batcher.batchable(self)
+            )
+
+            async def search():
+                if batch:
+                    return await self.query_batcher.search(self, query_payload)
+                return await self.SearchRequest(
+                    self.elasticsearch["url"], query_payload
+                )
+
+            async def secondary():
+                return await self.SearchRequest(
+                    self.elasticsearch["secondary_url"], query_payload
+                )
+
+            hedge = (
+                secondary
+                if not batch and "secondary_url" in self.elasticsearch
+                else None
+            )
+            if self.resilience is None:
+                query_response = await search()
+            else:
+                query_response = await self.resilience.guard(
+                    self.elasticsearch["url"]
+                ).call(search, hedge)
+            if self.adaptive is not None:
+                self.adaptive.observe(time.perf_counter() - started)
+            return query_response
         except asyncio.TimeoutError as tmo_e:
-            logging.error(tmo_e)
+            logger.error(tmo_e)
             raise
         except Exception as e:
-            logging.error(e)
+            logger.error(e)
             raise
 
+    async def SearchRequest(self, url: str, query_payload: dict) -> dict:
+        """Send query_payload to query_endpoint of the cluster at url, within
+        one of its cluster_slots when they are set.
+
+            Args:
+                str:     url (elasticsearch url)
+                dict:    query_payload
+            Returns:
+                dict:    query_response (elasticsearch query response)
+            Raises:
+                asyncio.TimeoutError
+                QueryStatusError
+                General Exception
+        """
+        slot = null_slot if self.cluster_slots is None else self.cluster_slots.slot(url)
+        async with slot, client_session(self.session_manager, url) as session:
+            with async_timeout.timeout(self.elasticsearch["timeout"]):
+                async with session.post(
+                    url + self.es_query["query_endpoint"],
+                    data=dumps(query_payload),
+                    headers={"content-type": "application/json"},
+                    auth=self.es_auth,
+                ) as response:
+                    logger.debug(response)
+                    if response.status != 200:
+                        raise QueryStatusError(url, response.status)
+                    return loads(await response.read())
+
+    def BucketExtractor(self, query_response: dict) -> list:
+        """Walk an elasticsearch query response to its buckets.
+
+            Args:
+                dict:    query_response (elasticsearch query response)
+            Returns:
+                list:    buckets of query_type.query_name
+            Raises:
+                KeyError
+        """
+        return query_response[self.query_path[0]][self.query_path[1]]["buckets"]
+
+    def BucketMapper(self, buckets: list):
+        """Lazily map buckets using query_response_mapping.
+
+        Mapped key names are computed once per distinct bucket layout,
+        rather than looked up for every key of every bucket, and shared
+        by the Buckets of that layout.
+
+            Args:
+                list:         buckets
+            Yields:
+                Bucket:       mapped_response (query_response_mapping)
+        """
+        mapped_keys = self.mapped_keys
+        mapping = self.es_query["query_response_mapping"]
+        for bucket in buckets:
+            layout = tuple(bucket)
+            index = mapped_keys.get(layout)
+            if index is None:
+                index = mapped_keys[layout] = layout_index(
+                    [mapping.get(key, key) for key in layout]
+                )
+            yield Bucket(index, tuple(bucket.values()))
+
     def ResponseMapper(self, query_response: list) -> list:
         """Map an elasticsearch query response using query_response_mapping.
 
             Args:
                 list:    query_response (elasticsearch query response)
             Returns:
-                list:    mapped_responses (query_response_mapping)
+                BucketBatch:    mapped_responses (query_response_mapping)
             Raises:
                 General Exception
         """
         try:
-            mapped_responses = []
-            for bucket in query_response[self.es_query["query_type"]][
-                self.es_query["query_name"]
-            ]["buckets"]:
-                mapped_response = {
-                    self.es_query["query_response_mapping"].get(key, key): value
-                    for key, value in bucket.items()
-                }
-                mapped_responses.append(mapped_response)
+            with self.metrics.timer("map", self.metric_labels):
+                mapped_responses = BucketBatch(
+                    self.BucketMapper(self.BucketExtractor(query_response))
+                )
+            self.metrics.inc("buckets_total", self.metric_labels, len(mapped_responses))
             return mapped_responses
         except Exception as e:
-            logging.error(e)
+            logger.error(e)
             raise
 
-    async def ActionProcessor(self, action_metadata: list):
+    def PredicateFilter(self, mapped_responses: list) -> list:
+        """Keep the mapped responses matching the automaton's predicate.
+
+            Args:
+                list:    mapped_responses (from ResponseMapper)
+            Returns:
+                list:    mapped_responses matching the predicate
+            Raises:
+                General Exception
+        """
+        try:
+            with self.metrics.timer("predicate", self.metric_labels):
+                matched = self.predicate.filter(mapped_responses, commit=False)
+            self.metrics.inc(
+                "predicate_rejected_total",
+                self.metric_labels,
+                len(mapped_responses) - len(matched),
+            )
+            return matched
+        except Exception as e:
+            logger.error(e)
+            raise
+
+    async def ActionExecutor(self, action: ActionSpec, action_metadata: list) -> list:
+        """Execute a single action for the buckets of action_metadata that
+        are new or have changed since it last fired (see BackoffStore), and
+        record the buckets that succeeded. Failed buckets are retried on
+        the next poll.
+
+        With an action_queue the buckets are queued for its workers instead
+        and no results are returned, the queue retries failed buckets.
+
+            Args:
+                ActionSpec:    action (automaton_engine action)
+                list:          action_metadata (mapped_responses from ResponseMapper)
+            Returns:
+                list:          BucketResult per dispatched bucket
+        """
+        buckets = self.backoff_store.select(
+            self.name,
+            action.action_id,
+            action_metadata,
+            self.bucket_key,
+            action.backoff,
+            action.ttl,
+            action.dedup_fields,
+        )
+        self.metrics.inc(
+            "action_buckets_total",
+            action.labels + (("outcome", "skipped"),),
+            len(action_metadata) - len(buckets),
+        )
+        if not buckets:
+            logger.debug(
+                "automaton_engine: %s action %s within backoff period %s for all buckets",
+                self.name,
+                action.name,
+                action.backoff,
+            )
+            return []
+        # only buckets an action fires for are turned into dicts
+        buckets = as_dicts(buckets)
+        if self.action_queue is not None:
+            # buckets are taken once queued, and forgotten again should the
+            # queue give up on them
+            self.backoff_store.record(
+                self.name,
+                action.action_id,
+                buckets,
+                self.bucket_key,
+                action.ttl,
+                action.dedup_fields,
+            )
+            job = ActionJob(
+                self.name,
+                action.action_id,
+                action.destination,
+                buckets,
+                [
+                    idempotency_key(
+                        self.name, action.action_id, bucket, self.bucket_key
+                    )
+                    for bucket in buckets
+                ],
+                action.ttl,
+            )
+            queued = await self.action_queue.put(job)
+            logger.info(
+                "automaton_engine: %s queued action: %s for %s of %s buckets",
+                self.name,
+                action.name,
+                len(job.buckets) if queued else 0,
+                len(action_metadata),
+            )
+            return []
+        results = await self.ActionDispatch(action, buckets)
+        succeeded = [result.bucket for result in results if result.success]
+        self.backoff_store.record(
+            self.name,
+            action.action_id,
+            succeeded,
+            self.bucket_key,
+            action.ttl,
+            action.dedup_fields,
+        )
+        return results
+
+    async def ActionDispatch(self, action: ActionSpec, buckets: list) -> list:
+        """Dispatch action for buckets, without regard to backoff.
+
+            Args:
+                ActionSpec:    action (automaton_engine action)
+                list:          buckets (mapped_responses to act on, as dicts)
+            Returns:
+                list:          BucketResult per bucket
+        """
+        logger.info(
+            "automaton_engine: %s executing action: %s for %s buckets",
+            self.name,
+            action.name,
+            len(buckets),
+        )
+        try:
+            with self.metrics.timer("action", action.labels):
+                dispatch = await self.action_registry.acquire(
+                    action.name, self.session_manager
+                )
+                results = await dispatch(
+                    action.parameters, buckets, session_manager=self.session_manager,
+                )
+            if results is None:
+                # actions predating per bucket results return nothing
+                results = [BucketResult(bucket, True, None) for bucket in buckets]
+            results = list(results)
+            if not all(isinstance(result, BucketResult) for result in results):
+                raise TypeError(
+                    "action must return a BucketResult per bucket, got: {!r}".format(
+                        results
+                    )
+                )
+            if len(results) != len(buckets):
+                logger.error(
+                    "automaton_engine: %s action: %s returned %s results for %s buckets",
+                    self.name,
+                    action.name,
+                    len(results),
+                    len(buckets),
+                )
+                missing = ValueError("action returned no result for bucket")
+                results = results[: len(buckets)] + [
+                    BucketResult(bucket, False, missing)
+                    for bucket in buckets[len(results) :]
+                ]
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(
+                "automaton_engine: %s action: %s failed: %r", self.name, action.name, e,
+            )
+            results = [BucketResult(bucket, False, e) for bucket in buckets]
+        succeeded = [result.bucket for result in results if result.success]
+        self.metrics.inc(
+            "action_buckets_total",
+            action.labels + (("outcome", "success"),),
+            len(succeeded),
+        )
+        self.metrics.inc(
+            "action_buckets_total",
+            action.labels + (("outcome", "failure"),),
+            len(results) - len(succeeded),
+        )
+        logger.info(
+            "automaton_engine: %s execution of action: %s completed (%s succeeded, %s failed)",
+            self.name,
+            action.name,
+            len(succeeded),
+            len(results) - len(succeeded),
+        )
+        return results
+
+    async def ActionProcessor(self, action_metadata: list) -> list:
         """Execute actions defined in automaton_engines actions.
-        Actions are functions expressed in action_dispatcher,
-        and are passed action_name, action_parameters and
-        action_metadata.
+        Actions are functions expressed in the action_registry,
+        and are passed action_name, action_parameters,
+        action_metadata and the shared session_manager.
 
-        For first time execution, action processor will add an
-        exec and timestamp key to the executed automaton_engine. Execution
-        will only re-occur once the time period expressed in
-        action_backoff_seconds is reached.
+        Backoff is tracked per bucket key: an action only fires for
+        buckets whose key is new, or that changed after the time period
+        expressed in action_backoff_seconds has passed since the action
+        last fired for that key.
+
+        Actions dispatch their buckets concurrently and report the
+        outcome of each bucket. When parallel_actions is set, the
+        actions of an automaton_engine also run concurrently.
 
 
             Args:
                 list:    action_metadata (mapped_responses from ResponseMapper)
+            Returns:
+                list:    (action name, BucketResult list) per action
+            Raises:
+                General Exception
+        """
+        try:
+            if not isinstance(action_metadata, list):
+                action_metadata = BucketBatch(action_metadata)
+            pending = [
+                action
+                for action in self.action_specs
+                if action.name in self.action_registry
+            ]
+            if self.parallel_actions:
+                results = await asyncio.gather(
+                    *[
+                        self.ActionExecutor(action, action_metadata)
+                        for action in pending
+                    ]
+                )
+            else:
+                results = [
+                    await self.ActionExecutor(action, action_metadata)
+                    for action in pending
+                ]
+            return [(action.name, result) for action, result in zip(pending, results)]
+        except Exception as e:
+            logger.error(e)
+            raise
+
+    async def ResponseProcessor(self, query_response: dict):
+        """Map, filter and act on the buckets of a query response.
+
+            Args:
+                dict:    query_response (elasticsearch query response, or page)
+            Returns:
+                None
+            Raises:
+                General Exception
+        """
+        buckets = self.BucketExtractor(query_response)
+        if self.adaptive is not None:
+            self.adaptive.count(len(buckets))
+        if not buckets:
+            logger.debug("automaton_engine: %s has detected no activity", self.name)
+            return
+        action_metadata = self.ResponseMapper(query_response)
+        if self.predicate is not None:
+            action_metadata = self.PredicateFilter(action_metadata)
+        if not action_metadata:
+            logger.debug("automaton_engine: %s no buckets matched predicate", self.name)
+            return
+        logger.info(
+            "automaton_engine: %s activity detected in %s buckets",
+            self.name,
+            len(action_metadata),
+        )
+        logger.debug(
+            "automaton_engine: %s activity detected with metadata: %s",
+            self.name,
+            action_metadata,
+        )
+        await self.ActionProcessor(action_metadata)
+
+    async def Poll(self):
+        """Single AutomatonEngine poll.
+        1. Calls QueryExecutor, or QueryPages for paged composite aggregations
+        2. If automaton_engine query returns buckets, map them with ResponseMapper
+        3. Filter mapped responses with the automaton's predicate, if any
+        4. Send mapped response to action processor which calls defined actions
+
+        Paged queries go through steps 2 to 4 a page at a time. Adaptive
+        automatons then adapt their poll interval to the activity and query
+        latency seen.
+
+
+            Args:
+                None
             Returns:
                 None
             Raises:
                 General Exception
         """
         try:
-            for index, action in enumerate(self.actions):
-                if action["name"] in action_dispatcher:
-                    if "executed" in action:
-                        if action["executed"] is False:
-                            logging.info(
-                                "automaton_engine: {} executing action: {}".format(
-                                    self.name, action["name"]
-                                )
-                            )
-                            await action_dispatcher[action["name"]](
-                                action["parameters"], action_metadata
-                            )
-                            action["executed"] = True
-                            action["exec_time"] = datetime.datetime.now()
-                            logging.info(
-                                "automaton_engine: {} execution of action: {} completed".format(
-                                    self.name, action["name"]
-                                )
-                            )
-                    else:
-                        logging.info(
-                            "automaton_engine: {} first time execution of action: {}".format(
-                                self.name, action["name"]
-                            )
-                        )
-                        await action_dispatcher[action["name"]](
-                            action["parameters"], action_metadata
-                        )
-                        action["executed"] = True
-                        action["exec_time"] = datetime.datetime.now()
-                    if "exec_time" in action:
-                        if action[
-                            "exec_time"
-                        ] < datetime.datetime.now() - datetime.timedelta(
-                            seconds=action["backoff_seconds"]
-                        ):
-                            logging.debug(
-                                "automaton_engine: {} action {} exceeded backoff period {} (previous execution time {})".format(
-                                    self.name,
-                                    action["name"],
-                                    action["backoff_seconds"],
-                                    action["exec_time"],
-                                )
-                            )
-                            action["executed"] = False
-                        else:
-                            logging.debug(
-                                "automaton_engine: {} action {} within backoff period {} (previous execution time {})".format(
-                                    self.name,
-                                    action["name"],
-                                    action["backoff_seconds"],
-                                    action["exec_time"],
-                                )
-                            )
+            with self.metrics.timer("poll", self.metric_labels):
+                if self.paging is None:
+                    await self.ResponseProcessor(await self.QueryExecutor())
+                else:
+                    async for query_response in self.QueryPages():
+                        await self.ResponseProcessor(query_response)
+            if self.predicate is not None:
+                self.predicate.commit()
         except Exception as e:
-            logging.error(e)
+            if self.predicate is not None:
+                self.predicate.rollback()
+            if self.adaptive is not None:
+                self.AdaptInterval(failed=True)
+            logger.error(e)
             raise
+        if self.adaptive is not None:
+            self.AdaptInterval()
+
+    def AdaptInterval(self, failed: bool = False):
+        """Adapt the poll interval of an adaptive automaton to its last poll.
+        """
+        interval = self.adaptive.interval
+        if self.adaptive.update(failed) != interval:
+            logger.debug(
+                "automaton_engine: %s poll interval %.3gs -> %.3gs",
+                self.name,
+                interval,
+                self.adaptive.interval,
+            )
 
     async def Poller(self):
-        """AutomatonEngine mainloop.
-        1. Calls QueryExecutor
-        2. If automaton_engine query returns valid data, call ResponseMapper
-        3. Send mapped response to action processor which calls defined actions
+        """AutomatonEngine mainloop, calls Poll every PollInterval period
+        until disabled (or once, for runonce automatons).
 
-        If no response is retrieved from QueryExecutor the automaton_engine waits
-        for the duration of the query_interval period.
+        Used when an automaton_engine runs standalone, runner drives Poll
+        from its Scheduler instead. A failed poll is logged and polling
+        carries on after the next PollInterval, runonce automatons raise.
 
 
             Args:
@@ -203,35 +717,16 @@ class AutomatonEngine:
         """
         try:
             while self.enabled:
-                query_response = await self.QueryExecutor()
-                if (
-                    query_response[self.es_query["query_type"]][
-                        self.es_query["query_name"]
-                    ]["buckets"]
-                    and len(
-                        query_response[self.es_query["query_type"]][
-                            self.es_query["query_name"]
-                        ]["buckets"]
-                    )
-                    > 0
-                ):
-                    action_metadata = self.ResponseMapper(query_response)
-                    logging.info(
-                        "automaton_engine: {} activity detected with metadata: {}".format(
-                            self.name, action_metadata
-                        )
-                    )
-                    await self.ActionProcessor(action_metadata)
-                else:
-                    logging.debug(
-                        "automaton_engine: {} has detected no activity".format(
-                            self.name
-                        )
-                    )
                 if self.runonce:
+                    await self.Poll()
                     break
-                else:
-                    await asyncio.sleep(self.es_query["query_interval"])
+                try:
+                    await self.Poll()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("automaton_engine: %s poll failed: %r", self.name, e)
+                await asyncio.sleep(self.PollInterval())
         except Exception as e:
-            logging.error(e)
+            logger.error(e)
             raise
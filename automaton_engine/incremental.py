@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import copy
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+""" elasticsearch date math units, in seconds
+"""
+time_units = {"s": 1, "m": 60, "h": 3600, "H": 3600, "d": 86400, "w": 604800}
+
+
+def parse_window(value: str) -> float:
+    """Parse a relative range such as now-1m (or 1m) into seconds.
+
+        Args:
+            str:      value
+        Returns:
+            float:    seconds
+        Raises:
+            ValueError
+    """
+    match = re.match(r"^(?:now-)?(\d+)([smhHdw])$", str(value).strip())
+    if match is None:
+        raise ValueError("unsupported incremental window: {}".format(value))
+    return int(match.group(1)) * time_units[match.group(2)]
+
+
+def find_range(node, timestamp_field: str):
+    """Locate the range clause on timestamp_field within a query payload.
+
+        Returns:
+            dict:    the clause (mutable), or None
+    """
+    if isinstance(node, dict):
+        if timestamp_field in node.get("range", {}):
+            return node["range"][timestamp_field]
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for child in children:
+        found = find_range(child, timestamp_field)
+        if found is not None:
+            return found
+    return None
+
+
+class WatermarkStore:
+    """Checkpoint incremental query state to a local JSON file.
+
+    Saves are kept in memory and written out at most every flush_interval
+    seconds (and on close) using an atomic rename. Within a running loop
+    a snapshot of the state is written from a worker thread, so polls do
+    not wait on serialization and disk. With no path the store is memory
+    only.
+    """
+
+    def __init__(self, path: str = None, flush_interval: float = 5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.state = {}
+        self.dirty = False
+        self.flushed = time.monotonic()
+        self.flusher = None
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as checkpoint:
+                self.state = json.load(checkpoint)
+            logger.info(
+                "loaded %s incremental checkpoints from %s", len(self.state), path
+            )
+
+    def load(self, name: str) -> dict:
+        return self.state.get(name)
+
+    def save(self, name: str, state: dict):
+        self.state[name] = state
+        if not self.path:
+            return
+        self.dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if time.monotonic() - self.flushed >= self.flush_interval:
+                self.write(self.snapshot())
+                self.dirty = False
+                self.flushed = time.monotonic()
+            return
+        if self.flusher is None:
+            self.flusher = loop.create_task(self.flush_later())
+
+    def snapshot(self) -> dict:
+        """Copy of the state safe to serialize while polls carry on, slices
+        are only ever appended to or replaced.
+        """
+        return {
+            name: {
+                key: list(value) if isinstance(value, list) else value
+                for key, value in state.items()
+            }
+            for name, state in self.state.items()
+        }
+
+    def write(self, snapshot: dict):
+        with self.lock:
+            partial = self.path + ".tmp"
+            with open(partial, "w") as checkpoint:
+                json.dump(snapshot, checkpoint)
+            os.replace(partial, self.path)
+
+    async def flush_later(self):
+        """Write the saves batched up over flush_interval, until there are
+        no more.
+        """
+        try:
+            while self.dirty:
+                await asyncio.sleep(
+                    max(self.flushed + self.flush_interval - time.monotonic(), 0)
+                )
+                await self.flush()
+        finally:
+            self.flusher = None
+
+    async def flush(self):
+        """Write a snapshot of the state from a worker thread.
+        """
+        if not (self.path and self.dirty):
+            return
+        snapshot = self.snapshot()
+        self.dirty = False
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self.write, snapshot)
+        except Exception as e:
+            logger.error("failed to checkpoint incremental state: %r", e)
+            self.dirty = True
+        self.flushed = time.monotonic()
+
+    async def close(self):
+        flusher = self.flusher
+        if flusher is not None:
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+            # the cancelled flush may not have been written
+            self.dirty = True
+        await self.flush()
+
+
+class IncrementalQuery:
+    """Incremental execution of an automaton's terms aggregation query.
+
+    Instead of re-running the full relative range (e.g. now-1m) every poll,
+    only documents newer than the watermark are queried. Each response is
+    kept as a slice of per-key bucket counts, and slices overlapping the
+    window are merged into the query_response handed to ResponseMapper.
+    Slices partially outside the window contribute pro rata to their
+    overlap. The aggregation's min_doc_count is applied to the merged
+    counts rather than by elasticsearch. Only doc_count is summed over the
+    window: any other field of a bucket, sub-aggregations included, is
+    taken from the newest slice holding its key.
+
+    Configured via the "incremental" key of elasticsearch_query:
+    - timestamp_field : field of the range clause (default @timestamp)
+    - window          : window length (default: the range clause's gte)
+    - delay           : seconds to lag behind now, allowing for ingest delay
+    """
+
+    def __init__(self, name: str, es_query: dict, store: WatermarkStore = None):
+        options = es_query["incremental"]
+        if options is True:
+            options = {}
+        self.name = name
+        self.es_query = es_query
+        self.store = store if store is not None else WatermarkStore()
+        self.timestamp_field = options.get("timestamp_field", "@timestamp")
+        self.delay = options.get("delay", 0)
+        time_range = find_range(es_query["query_payload"], self.timestamp_field)
+        if time_range is None:
+            raise ValueError(
+                "automaton_engine: {} incremental query has no range on {}".format(
+                    name, self.timestamp_field
+                )
+            )
+        self.window = parse_window(options.get("window", time_range.get("gte")))
+        aggregation = es_query["query_payload"].get(
+            "aggregations", es_query["query_payload"].get("aggs", {})
+        )[es_query["query_name"]]
+        self.min_doc_count = aggregation.get("terms", {}).get("min_doc_count", 1)
+        state = self.store.load(name) or {}
+        self.watermark = state.get("watermark")
+        self.slices = state.get("slices", [])
+
+    def prepare(self) -> tuple:
+        """Build the payload covering documents since the watermark.
+
+            Returns:
+                tuple:    (query_payload, now in epoch milliseconds)
+        """
+        now = int((time.time() - self.delay) * 1000)
+        start = now - int(self.window * 1000)
+        if self.watermark is not None and self.watermark > start:
+            start = self.watermark
+        payload = copy.deepcopy(self.es_query["query_payload"])
+        find_range(payload, self.timestamp_field).clear()
+        find_range(payload, self.timestamp_field).update(
+            {"gte": start, "lt": now, "format": "epoch_millis"}
+        )
+        aggregation = payload.get("aggregations", payload.get("aggs", {}))[
+            self.es_query["query_name"]
+        ]
+        if "terms" in aggregation:
+            aggregation["terms"]["min_doc_count"] = 1
+        return payload, now
+
+    def merge(self, query_response: dict, now: int) -> dict:
+        """Add query_response as a slice and return the merged window.
+
+            Args:
+                dict:    query_response (covering the payload from prepare)
+                int:     now (as returned by prepare)
+            Returns:
+                dict:    query_response holding the window's merged buckets
+        """
+        aggregation = query_response[self.es_query["query_type"]][
+            self.es_query["query_name"]
+        ]
+        start = now - int(self.window * 1000)
+        if self.watermark is not None and self.watermark > start:
+            start = self.watermark
+        self.slices.append([start, now, aggregation["buckets"]])
+        window_start = now - int(self.window * 1000)
+        self.slices = [s for s in self.slices if s[1] > window_start]
+        merged, counts = {}, {}
+        for slice_start, slice_end, buckets in self.slices:
+            overlap = (slice_end - max(slice_start, window_start)) / max(
+                slice_end - slice_start, 1
+            )
+            for bucket in buckets:
+                key = json.dumps(bucket["key"], sort_keys=True)
+                merged[key] = bucket
+                counts[key] = counts.get(key, 0) + bucket["doc_count"] * overlap
+        buckets = []
+        for key, bucket in merged.items():
+            doc_count = int(round(counts[key]))
+            if doc_count >= self.min_doc_count:
+                buckets.append(dict(bucket, doc_count=doc_count))
+        buckets.sort(key=lambda bucket: bucket["doc_count"], reverse=True)
+        self.watermark = now
+        self.store.save(self.name, {"watermark": now, "slices": self.slices})
+        logger.debug(
+            "automaton_engine: %s incremental window merged %s slices into %s buckets",
+            self.name,
+            len(self.slices),
+            len(buckets),
+        )
+        query_response = dict(query_response)
+        query_response[self.es_query["query_type"]] = dict(
+            query_response[self.es_query["query_type"]]
+        )
+        query_response[self.es_query["query_type"]][self.es_query["query_name"]] = dict(
+            aggregation, buckets=buckets
+        )
+        return query_response
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import atexit
+import queue
+import sys
+
+import json
+import logging
+import logging.handlers
+
+logger = logging.getLogger(__name__)
+
+
+""" format of text log lines
+"""
+text_format = "%(asctime)s %(name)s %(levelname)s %(message)s "
+
+""" attributes every log record has, any other attribute (passed via
+extra=) is emitted as a field of JSON log lines
+"""
+record_attributes = frozenset(vars(logging.makeLogRecord({}))) | {
+    "message",
+    "asctime",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single line JSON documents.
+    """
+
+    def format(self, record):
+        document = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in record_attributes:
+                document[key] = value
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most burst records per interval seconds for each
+    message of each logger, for records at or below max_level. The next
+    record let through for a message notes how many were suppressed.
+
+    Messages are told apart by their unformatted template, so repetitive
+    per-bucket messages logged with arguments share one limit.
+    """
+
+    def __init__(
+        self,
+        burst: int = 50,
+        interval: float = 1.0,
+        max_level: int = logging.INFO,
+        max_messages: int = 1000,
+    ):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_level = (
+            max_level if isinstance(max_level, int) else logging.getLevelName(max_level)
+        )
+        self.max_messages = max_messages
+        self.windows = {}
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else None)
+        window = self.windows.get(key)
+        if window is None or record.created - window[0] >= self.interval:
+            if len(self.windows) >= self.max_messages:
+                self.windows = {
+                    key: window
+                    for key, window in self.windows.items()
+                    if record.created - window[0] < self.interval
+                }
+            suppressed = window[2] if window is not None else 0
+            window = self.windows[key] = [record.created, 0, 0]
+            if suppressed:
+                record.suppressed = suppressed
+                record.msg = "{} [{} similar messages suppressed]".format(
+                    record.msg, suppressed
+                )
+        if window[1] >= self.burst:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to a QueueListener thread without blocking the caller.
+
+    Records are formatted by the listener thread rather than the caller,
+    so the arguments of a logging call must not be mutated afterwards.
+    When the queue is full records are dropped, and counted in a warning
+    once the queue has room again.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(
+                    logging.makeLogRecord(
+                        {
+                            "name": __name__,
+                            "levelno": logging.WARNING,
+                            "levelname": "WARNING",
+                            "msg": "dropped %s log records, log queue full",
+                            "args": (self.dropped,),
+                        }
+                    )
+                )
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def stop_listener(listener: logging.handlers.QueueListener):
+    """Write out the records still queued and stop listener, unless it
+    has already been stopped.
+    """
+    if getattr(listener, "_thread", None) is not None:
+        listener.stop()
+
+
+def setup_logging(
+    level="INFO",
+    json_output: bool = False,
+    stream=None,
+    rate_limit: dict = None,
+    max_queue: int = 10000,
+) -> logging.handlers.QueueListener:
+    """Log through a bounded queue to stream (stdout by default), written
+    from a listener thread so logging never blocks the event loop.
+
+        Args:
+            str:     level (root logger level)
+            bool:    json_output (emit JSON lines rather than text)
+            file:    stream (defaults to sys.stdout)
+            dict:    rate_limit (RateLimitFilter settings, None disables it)
+            int:     max_queue (records queued before dropping)
+        Returns:
+            QueueListener (stopped at exit)
+    """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(
+        JsonFormatter() if json_output else logging.Formatter(text_format)
+    )
+    log_queue = queue.Queue(max_queue)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    if rate_limit is not None:
+        queue_handler.addFilter(RateLimitFilter(**rate_limit))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(
+        log_queue, handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(stop_listener, listener)
+    return listener
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from bisect import bisect_left
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+""" metric_descriptions defines the metrics exposed on /metrics, every
+name is prefixed with automaton_engine_
+- *_duration_seconds : histograms labelled by automaton (and action)
+- *_errors_total     : exceptions raised out of the matching stage
+"""
+metric_descriptions = {
+    "query_duration_seconds": ("histogram", "Elasticsearch query latency"),
+    "query_errors_total": ("counter", "Failed elasticsearch queries"),
+    "map_duration_seconds": ("histogram", "Bucket mapping latency"),
+    "map_errors_total": ("counter", "Failed bucket mappings"),
+    "query_pages_total": ("counter", "Composite aggregation pages queried"),
+    "query_cache_total": (
+        "counter",
+        "Query cache lookups by outcome (hit, coalesced, miss)",
+    ),
+    "buckets_total": ("counter", "Buckets returned by queries"),
+    "predicate_duration_seconds": ("histogram", "Predicate evaluation latency"),
+    "predicate_errors_total": ("counter", "Failed predicate evaluations"),
+    "predicate_rejected_total": ("counter", "Buckets rejected by predicates"),
+    "action_duration_seconds": ("histogram", "Action dispatch latency"),
+    "action_errors_total": ("counter", "Actions that raised"),
+    "action_buckets_total": (
+        "counter",
+        "Buckets handled by actions by outcome (success, failure, skipped)",
+    ),
+    "poll_duration_seconds": ("histogram", "Complete poll latency"),
+    "poll_errors_total": ("counter", "Failed polls"),
+    "loop_lag_seconds": ("histogram", "Event loop scheduling lag"),
+    "loop_stalls_total": (
+        "counter",
+        "Event loop stalls by the automaton and action blocking it",
+    ),
+    "loop_stall_duration_seconds": ("histogram", "Event loop stall duration"),
+    "startup_duration_seconds": ("histogram", "Startup duration by phase"),
+}
+
+""" histogram bucket upper bounds in seconds, +Inf is implied
+"""
+default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class NullTimer:
+    """Timer used while metrics are disabled, does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+null_timer = NullTimer()
+
+
+class Timer:
+    """Observe the duration of a stage into its histogram, counting an
+    error if the stage raised (cancellation excluded).
+    """
+
+    __slots__ = ("registry", "stage", "labels", "start")
+
+    def __init__(self, registry, stage: str, labels: tuple):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(
+            self.stage + "_duration_seconds",
+            self.labels,
+            time.perf_counter() - self.start,
+        )
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            self.registry.inc(self.stage + "_errors_total", self.labels)
+        return False
+
+
+def format_labels(labels: tuple, extra: str = None) -> str:
+    pairs = [
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    ]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricsRegistry:
+    """In-process counters and histograms, rendered in the Prometheus text
+    exposition format.
+
+    Labels are tuples of (name, value) pairs, callers build them once and
+    reuse them. While disabled every method returns immediately, so
+    instrumented code costs a single attribute check per call.
+    """
+
+    def __init__(self, enabled: bool = False, buckets: tuple = default_buckets):
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        """Add value to counter name.
+        """
+        if not self.enabled:
+            return
+        series = self.counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, labels: tuple, value: float):
+        """Record value in histogram name.
+        """
+        if not self.enabled:
+            return
+        series = self.histograms.setdefault(name, {})
+        histogram = series.get(labels)
+        if histogram is None:
+            # [per bucket counts (the last being +Inf), sum]
+            histogram = series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        histogram[0][bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+
+    def timer(self, stage: str, labels: tuple):
+        """Context manager timing stage into stage_duration_seconds.
+        """
+        if not self.enabled:
+            return null_timer
+        return Timer(self, stage, labels)
+
+    def render(self) -> str:
+        """Render every metric recorded so far.
+
+            Returns:
+                str:    Prometheus text exposition format
+        """
+        lines = []
+        for name in sorted(set(self.counters) | set(self.histograms)):
+            metric = "automaton_engine_" + name
+            kind, description = metric_descriptions.get(name, ("untyped", name))
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} {}".format(metric, kind))
+            for labels, value in self.counters.get(name, {}).items():
+                lines.append("{}{} {}".format(metric, format_labels(labels), value))
+            for labels, (counts, total) in self.histograms.get(name, {}).items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(
+                        "{}_bucket{} {}".format(
+                            metric,
+                            format_labels(labels, 'le="{}"'.format(bound)),
+                            cumulative,
+                        )
+                    )
+                lines.append("{}_sum{} {}".format(metric, format_labels(labels), total))
+                lines.append(
+                    "{}_count{} {}".format(metric, format_labels(labels), cumulative)
+                )
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serve a MetricsRegistry on http://host:port/metrics, and sample
+    event loop lag every lag_interval seconds (0 disables sampling).
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        host: str = "0.0.0.0",
+        port: int = 9464,
+        lag_interval: float = 1.0,
+    ):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self.runner = None
+        self.sampler = None
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        return web.Response(
+            text=self.registry.render(),
+            content_type="text/plain",
+            headers={"cache-control": "no-cache"},
+        )
+
+    async def sample_lag(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            self.registry.observe(
+                "loop_lag_seconds", (), max(loop.time() - expected, 0)
+            )
+
+    async def start(self):
+        """Start serving, from within the running loop. aiohttp.web is
+        imported here, keeping it off the startup path when metrics are off.
+        """
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        if self.lag_interval:
+            self.sampler = asyncio.ensure_future(self.sample_lag())
+        logger.info("serving metrics on %s:%s/metrics", self.host, self.port)
+
+    async def close(self):
+        if self.sampler is not None:
+            self.sampler.cancel()
+            self.sampler = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import async_timeout
+
+import logging
+
+from automaton_engine.scheduler import null_slot
+from automaton_engine.serialization import dumps, loads
+from automaton_engine.session import client_session
+
+logger = logging.getLogger(__name__)
+
+
+def msearch_header(query_endpoint: str):
+    """Derive the _msearch header line for a query_endpoint.
+
+        Args:
+            str:     query_endpoint (e.g. /_search or /my-index/_search)
+        Returns:
+            dict:    header, or None when the endpoint cannot be batched
+    """
+    if "?" in query_endpoint or not query_endpoint.endswith("/_search"):
+        return None
+    index = query_endpoint[: -len("/_search")].strip("/")
+    return {"index": index} if index else {}
+
+
+def group_key(engine) -> tuple:
+    """Automatons sharing a cluster, credentials and query_interval are
+    batched together. Automatons polling adaptively drift apart, so each
+    is a group of its own rather than holding its group's batches back.
+    """
+    auth = engine.es_auth
+    return (
+        engine.elasticsearch["url"].rstrip("/"),
+        (auth.login, auth.password) if auth is not None else None,
+        engine.es_query["query_interval"]
+        if engine.adaptive is None
+        else ("adaptive", engine.name),
+    )
+
+
+class MultiSearchBatcher:
+    """Coalesce QueryExecutor calls from automatons polling the same cluster
+    on the same query_interval into a single _msearch request.
+
+    A batch is sent once every registered automaton of its group has
+    submitted a query, when max_batch queries are waiting, or linger
+    seconds after the first query arrived, whichever is first. Items the
+    cluster answers with an error are re-run as individual queries.
+    """
+
+    def __init__(
+        self, session_manager=None, linger: float = 0.05, max_batch: int = 100
+    ):
+        self.session_manager = session_manager
+        self.linger = linger
+        self.max_batch = max_batch
+        self.groups = {}
+        self.pending = {}
+
+    def register(self, engine):
+        """Make the batcher aware of an automaton so full groups are sent
+        without waiting for the linger period.
+        """
+        if msearch_header(engine.es_query["query_endpoint"]) is not None:
+            self.groups.setdefault(group_key(engine), set()).add(engine.name)
+
+    def unregister(self, engine):
+        members = self.groups.get(group_key(engine))
+        if members is not None:
+            members.discard(engine.name)
+
+    def batchable(self, engine) -> bool:
+        return msearch_header(engine.es_query["query_endpoint"]) is not None
+
+    def phase_key(self, engine) -> str:
+        """Name the scheduler spreads engine's polls by: its group, so that
+        the automatons of a group fall due together and share a batch, or
+        None when its queries are not batched.
+        """
+        if not self.batchable(engine):
+            return None
+        return repr(group_key(engine))
+
+    async def search(self, engine, query_payload: dict) -> dict:
+        """Queue engine's query_payload for the next _msearch of its group.
+
+            Args:
+                AutomatonEngine:    engine
+                dict:               query_payload
+            Returns:
+                dict:               query_response (elasticsearch query response)
+            Raises:
+                asyncio.TimeoutError
+                General Exception
+        """
+        loop = asyncio.get_event_loop()
+        key = group_key(engine)
+        future = loop.create_future()
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = []
+            loop.call_later(self.linger, self.flush, key, batch)
+        batch.append((engine, query_payload, future))
+        if len(batch) >= min(len(self.groups.get(key, ())) or 1, self.max_batch):
+            self.flush(key, batch)
+        query_response = await future
+        if query_response is None:
+            logger.debug(
+                "automaton_engine: %s msearch item failed, falling back to _search",
+                engine.name,
+            )
+            return await engine.SearchRequest(
+                engine.elasticsearch["url"], query_payload
+            )
+        return query_response
+
+    def flush(self, key: tuple, batch: list):
+        """Send batch unless it has already been sent.
+        """
+        if self.pending.get(key) is not batch:
+            return
+        del self.pending[key]
+        asyncio.ensure_future(self.execute(key, batch))
+
+    async def execute(self, key: tuple, batch: list):
+        """Run batch as one _msearch request and resolve each waiting query
+        with its response, or None where the query should be retried alone.
+        The request holds one of the cluster_slots of its url, when set.
+        """
+        url = key[0]
+        es_auth = batch[0][0].es_auth
+        cluster_slots = batch[0][0].cluster_slots
+        slot = null_slot if cluster_slots is None else cluster_slots.slot(url)
+        body = b"".join(
+            dumps(msearch_header(engine.es_query["query_endpoint"]))
+            + b"\n"
+            + dumps(query_payload)
+            + b"\n"
+            for engine, query_payload, future in batch
+        )
+        try:
+            async with slot, client_session(self.session_manager, url) as session:
+                with async_timeout.timeout(
+                    max(engine.elasticsearch["timeout"] for engine, *_ in batch)
+                ):
+                    async with session.post(
+                        url + "/_msearch",
+                        data=body,
+                        headers={"content-type": "application/x-ndjson"},
+                        auth=es_auth,
+                    ) as response:
+                        logger.debug(response)
+                        if response.status != 200:
+                            logger.error(
+                                "msearch to %s returned status %s, falling back to _search",
+                                url,
+                                response.status,
+                            )
+                            responses = [None] * len(batch)
+                        else:
+                            responses = loads(await response.read())["responses"]
+            logger.debug("msearch to %s batched %s queries", url, len(batch))
+            responses = list(responses) + [None] * (len(batch) - len(responses))
+            for (engine, query_payload, future), item in zip(batch, responses):
+                if item is not None and (
+                    "error" in item or item.get("status", 200) != 200
+                ):
+                    item = None
+                if not future.done():
+                    future.set_result(item)
+        except Exception as e:
+            logger.error(e)
+            for engine, query_payload, future in batch:
+                if not future.done():
+                    future.set_exception(e)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+""" paging defaults for composite aggregations
+- page_size   : buckets requested per page
+- max_buckets : buckets read per poll at most, further pages are skipped
+"""
+paging_defaults = {"page_size": 1000, "max_buckets": 100000}
+
+
+def paging_settings(es_query: dict) -> dict:
+    """Paging settings of a query, None when it is not paged.
+
+        Raises:
+            ValueError
+    """
+    if "paging" not in es_query:
+        return None
+    settings = dict(paging_defaults, **(es_query["paging"] or {}))
+    if es_query.get("incremental"):
+        raise ValueError("paging cannot be combined with incremental queries")
+    if es_query["query_type"] != "aggregations":
+        raise ValueError("paging requires query_type aggregations")
+    for key in ("page_size", "max_buckets"):
+        if not isinstance(settings[key], int) or settings[key] < 1:
+            raise ValueError("paging {} must be a positive integer".format(key))
+    composite_aggregation(es_query["query_payload"], es_query["query_name"])
+    return settings
+
+
+def aggregations_key(query_payload: dict) -> str:
+    return "aggs" if "aggs" in query_payload else "aggregations"
+
+
+def composite_aggregation(query_payload: dict, query_name: str) -> dict:
+    """The composite aggregation named query_name in query_payload.
+
+        Raises:
+            ValueError
+    """
+    aggregation = query_payload.get(aggregations_key(query_payload), {}).get(
+        query_name, {}
+    )
+    if "composite" not in aggregation:
+        raise ValueError(
+            "paging requires a composite aggregation named {}".format(query_name)
+        )
+    return aggregation["composite"]
+
+
+def page_payload(query_payload: dict, query_name: str, size: int, after=None) -> dict:
+    """Copy of query_payload requesting size composite buckets after the
+    after_key of the previous page. Only the path to the composite
+    aggregation is copied.
+    """
+    key = aggregations_key(query_payload)
+    payload = dict(query_payload)
+    payload[key] = dict(query_payload[key])
+    aggregation = payload[key][query_name] = dict(query_payload[key][query_name])
+    composite = aggregation["composite"] = dict(aggregation["composite"], size=size)
+    if after is not None:
+        composite["after"] = after
+    else:
+        composite.pop("after", None)
+    return payload
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import heapq
+import itertools
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """Durations of the phases of process startup, each marked as it ends.
+    """
+
+    def __init__(self):
+        self.started = self.marked = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, phase: str) -> float:
+        now = time.perf_counter()
+        self.phases[phase] = now - self.marked
+        self.marked = now
+        return self.phases[phase]
+
+    def total(self) -> float:
+        return self.marked - self.started
+
+
+""" startup of this process, imported first by automaton_engine so the
+imports phase covers the whole package
+- imports : importing automaton_engine
+- config  : loading and validating the configuration
+- runtime : building the engines, stores and scheduler
+"""
+startup = Startup()
+
+
+def use_uvloop() -> bool:
+    """Create event loops with uvloop from now on, when it is installed
+    (pip install automaton-engine[fast]).
+
+        Returns:
+            bool:    whether uvloop is used
+    """
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning("uvloop is not installed, using the default event loop")
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def blame(frame) -> tuple:
+    """Automaton and action the code running in frame works for, found in
+    the engine and action locals of the frames awaiting it.
+
+        Returns:
+            tuple:    (automaton name, action name), None where unknown
+    """
+    from automaton_engine.engine import ActionSpec, AutomatonEngine
+
+    automaton = action = None
+    while frame is not None and (automaton is None or action is None):
+        local = frame.f_locals
+        for name in ("self", "engine"):
+            if automaton is None and isinstance(local.get(name), AutomatonEngine):
+                automaton = local[name].name
+        if action is None and isinstance(local.get("action"), ActionSpec):
+            action = local["action"].name
+        frame = frame.f_back
+    return automaton, action
+
+
+class LoopMonitor:
+    """Find out what blocks the event loop.
+
+    A heartbeat on the loop notes when it last ran. A watchdog thread
+    captures the stack of the loop thread once the heartbeat is threshold
+    seconds late, and the heartbeat reports the stall with that stack when
+    the loop runs again. Stalls are logged and counted per automaton and
+    action, and the slowest are kept.
+
+    profile_signal profiles the loop thread with cProfile for
+    profile_seconds and writes the stats to profile_dir. dump_signal logs
+    the slowest stalls and what every task is waiting on.
+    """
+
+    def __init__(
+        self,
+        metrics=None,
+        threshold: float = 0.25,
+        slowest: int = 10,
+        profile_seconds: float = 30.0,
+        profile_dir: str = None,
+        profile_signal: str = "SIGUSR1",
+        dump_signal: str = "SIGUSR2",
+    ):
+        self.metrics = metrics
+        self.threshold = threshold
+        self.size = slowest
+        self.profile_seconds = profile_seconds
+        self.profile_dir = profile_dir or tempfile.gettempdir()
+        self.signals = {profile_signal: self.profile, dump_signal: self.dump}
+        self.slowest = []
+        self.sequence = itertools.count()
+        self.beat = time.monotonic()
+        self.capture = None
+        self.loop = None
+        self.thread_id = None
+        self.heartbeat_task = None
+        self.watchdog = None
+        self.stopping = threading.Event()
+        self.profiler = None
+        self.profile_timer = None
+        self.handled = []
+
+    async def start(self):
+        """Start watching, from within the running loop.
+        """
+        self.loop = asyncio.get_event_loop()
+        self.thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self.stopping.clear()
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
+        self.watchdog = threading.Thread(
+            target=self.watch, name="automaton_engine-watchdog", daemon=True
+        )
+        self.watchdog.start()
+        for name, handler in self.signals.items():
+            if not name:
+                continue
+            try:
+                self.loop.add_signal_handler(getattr(signal, name), handler)
+                self.handled.append(getattr(signal, name))
+            except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+                logger.warning("cannot handle signal %s here", name)
+        if self.metrics is not None:
+            for phase, seconds in startup.phases.items():
+                self.metrics.observe(
+                    "startup_duration_seconds", (("phase", phase),), seconds
+                )
+
+    async def heartbeat(self):
+        interval = self.threshold / 2
+        while True:
+            self.beat = time.monotonic()
+            expected = self.loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = self.loop.time() - expected
+            if lag >= self.threshold:
+                self.stalled(lag)
+            else:
+                self.capture = None
+
+    def watch(self):
+        """Watchdog thread, captures the loop thread's stack during a stall.
+        """
+        while not self.stopping.wait(self.threshold / 2):
+            if (
+                self.capture is not None
+                or time.monotonic() - self.beat <= self.threshold
+            ):
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            try:
+                self.capture = (traceback.extract_stack(frame), blame(frame))
+            except Exception as e:
+                logger.debug("watchdog capture failed: %r", e)
+            finally:
+                del frame
+
+    def stalled(self, lag: float):
+        stack, (automaton, action) = self.capture or ([], (None, None))
+        self.capture = None
+        where = (
+            "{}:{} in {}".format(stack[-1].filename, stack[-1].lineno, stack[-1].name)
+            if stack
+            else "unknown"
+        )
+        logger.warning(
+            "event loop stalled for %.3fs, automaton: %s action: %s at %s",
+            lag,
+            automaton,
+            action,
+            where,
+        )
+        logger.debug(
+            "stalled event loop stack:\n%s", "".join(stack.format()) if stack else ""
+        )
+        if self.metrics is not None:
+            labels = (("automaton", automaton or ""), ("action", action or ""))
+            self.metrics.inc("loop_stalls_total", labels)
+            self.metrics.observe("loop_stall_duration_seconds", labels, lag)
+        entry = (lag, next(self.sequence), automaton, action, where)
+        if len(self.slowest) < self.size:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def report(self) -> list:
+        """Slowest stalls so far, slowest first.
+
+            Returns:
+                list:    dict of seconds, automaton, action and where per stall
+        """
+        return [
+            {"seconds": lag, "automaton": automaton, "action": action, "where": where}
+            for lag, _, automaton, action, where in sorted(self.slowest, reverse=True)
+        ]
+
+    def dump(self):
+        """Log the slowest stalls and the stack of every task.
+        """
+        lines = ["slowest event loop stalls:"]
+        lines.extend(
+            "  {seconds:.3f}s automaton: {automaton} action: {action} at {where}".format(
+                **stall
+            )
+            for stall in self.report()
+        )
+        tasks = asyncio.all_tasks(self.loop)
+        lines.append("{} tasks:".format(len(tasks)))
+        for task in tasks:
+            lines.append("  {!r}".format(task))
+            for frame in task.get_stack(limit=3):
+                lines.append(
+                    "    {}:{} in {}".format(
+                        frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name
+                    )
+                )
+        logger.info("\n".join(lines))
+
+    def profile(self):
+        """Profile the loop thread for profile_seconds, unless already
+        profiling.
+        """
+        if self.profiler is not None:
+            return
+        import cProfile
+
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        self.profile_timer = self.loop.call_later(
+            self.profile_seconds, self.write_profile
+        )
+        logger.info("profiling the event loop for %ss", self.profile_seconds)
+
+    def write_profile(self) -> str:
+        """Stop profiling and write the stats (pstats format, readable by
+        snakeviz or python -m pstats), logging the costliest calls.
+
+            Returns:
+                str:    path of the stats file
+        """
+        import io
+        import pstats
+
+        profiler, self.profiler = self.profiler, None
+        self.profile_timer.cancel()
+        profiler.disable()
+        path = os.path.join(
+            self.profile_dir,
+            "automaton_engine-{}-{}.prof".format(os.getpid(), int(time.time())),
+        )
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+        logger.info("event loop profile written to %s\n%s", path, summary.getvalue())
+        return path
+
+    async def close(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        self.stopping.set()
+        if self.watchdog is not None:
+            self.watchdog.join()
+            self.watchdog = None
+        if self.profiler is not None:
+            self.write_profile()
+        for signum in self.handled:
+            self.loop.remove_signal_handler(signum)
+        self.handled = []
+        if self.slowest:
+            logger.info(
+                "slowest event loop stalls: %s",
+                ", ".join(
+                    "{seconds:.3f}s ({automaton}/{action})".format(**stall)
+                    for stall in self.report()
+                ),
+            )
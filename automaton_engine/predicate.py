@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import ast
+import operator
+import sys
+import time
+from collections import deque
+from functools import reduce
+
+import logging
+
+from automaton_engine.backoff import bucket_identity
+from automaton_engine.buckets import BucketBatch, column
+
+logger = logging.getLogger(__name__)
+
+""" Evaluate predicates with NumPy when it is installed (pip install
+automaton-engine[fast]), falling back to evaluating bucket by bucket.
+NumPy is imported by the first predicate compiled, so startup does not
+pay for it unless an automaton uses a predicate.
+"""
+unloaded = object()
+numpy = unloaded
+
+
+def load_numpy():
+    global numpy
+    if numpy is unloaded:
+        try:
+            import numpy as module
+        except ImportError:  # pragma: no cover
+            module = None
+        numpy = module
+
+
+""" operators a predicate may use
+"""
+binary_operators = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+compare_operators = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+""" functions a predicate may call
+- abs(value)                        : absolute value
+- delta(field)                      : change of field since the previous poll
+- rate(field)                       : change of field per second since the previous poll
+- percentile(field, q, window=10)   : q-th percentile of the bucket's last window values
+"""
+predicate_functions = ("abs", "delta", "rate", "percentile")
+default_window = 10
+
+
+class PredicateError(ValueError):
+    """Raised for a predicate expression that cannot be compiled.
+    """
+
+
+def truthy(value) -> bool:
+    return value is not None and value == value and bool(value)
+
+
+def safe(op, left, right):
+    """Apply op to a single pair of values, None where either is missing
+    or op does not apply.
+    """
+    if left is None or right is None:
+        return None
+    try:
+        return op(left, right)
+    except (TypeError, ArithmeticError):
+        return None
+
+
+def interpolated_percentile(values: list, q: float):
+    values = sorted(
+        value for value in values if isinstance(value, (int, float)) and value == value
+    )
+    if not values:
+        return None
+    rank = (len(values) - 1) * min(max(q, 0.0), 100.0) / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+class Frame:
+    """Columns of the buckets a predicate is evaluated over.
+
+    Columns are NumPy arrays when NumPy is installed (float where every
+    value is numeric, object otherwise), lists of values when it is not.
+    Constants stay scalars and are broadcast as needed.
+    """
+
+    def __init__(self, buckets: list, previous: dict, now: float):
+        self.buckets = buckets
+        self.size = len(buckets)
+        self.previous = previous
+        self.now = now
+        self.columns = {}
+        self.arrays = {}
+
+    def values(self, path: tuple) -> list:
+        if path not in self.columns:
+            values = column(self.buckets, path[0])
+            if len(path) > 1:
+                for index, value in enumerate(values):
+                    for part in path[1:]:
+                        value = value.get(part) if isinstance(value, dict) else None
+                    values[index] = value
+            self.columns[path] = values
+        return self.columns[path]
+
+    def column(self, values: list):
+        if numpy is None:
+            return values
+        if all(isinstance(value, (int, float)) or value is None for value in values):
+            return numpy.array(
+                [numpy.nan if value is None else value for value in values],
+                dtype=float,
+            )
+        column = numpy.empty(len(values), dtype=object)
+        for index, value in enumerate(values):
+            column[index] = value
+        return column
+
+    def field(self, path: tuple):
+        if path not in self.arrays:
+            self.arrays[path] = self.column(self.values(path))
+        return self.arrays[path]
+
+    def expand(self, value) -> list:
+        if numpy is not None and isinstance(value, numpy.ndarray):
+            return value.tolist()
+        if isinstance(value, list):
+            return value
+        return [value] * self.size
+
+    def numeric(self, value) -> bool:
+        if isinstance(value, numpy.ndarray):
+            return value.dtype.kind in "bif"
+        return isinstance(value, (int, float))
+
+    def missing(self, value):
+        """Where a numeric value is missing (NaN).
+        """
+        if isinstance(value, numpy.ndarray):
+            if value.dtype.kind == "f":
+                return numpy.isnan(value)
+            return numpy.zeros(value.shape, dtype=bool)
+        return value != value
+
+    def apply(self, op, left, right):
+        """Apply op elementwise, vectorized where both sides are numeric.
+        """
+        if numpy is not None and self.numeric(left) and self.numeric(right):
+            with numpy.errstate(all="ignore"):
+                result = op(left, right)
+            if getattr(result, "dtype", None) is not None and result.dtype.kind == "b":
+                # a comparison with a missing value is false, as without NumPy
+                result = result & ~(self.missing(left) | self.missing(right))
+            return result
+        return self.column(
+            [
+                safe(op, left_value, right_value)
+                for left_value, right_value in zip(
+                    self.expand(left), self.expand(right)
+                )
+            ]
+        )
+
+    def truth(self, value):
+        """Boolean mask of value, missing values are false.
+        """
+        if numpy is None:
+            return [truthy(item) for item in self.expand(value)]
+        if isinstance(value, numpy.ndarray) and value.dtype.kind == "b":
+            return value
+        if isinstance(value, numpy.ndarray) and value.dtype.kind == "f":
+            return (value != 0) & ~numpy.isnan(value)
+        return numpy.array([truthy(item) for item in self.expand(value)], dtype=bool)
+
+    def logical(self, combine, values: list):
+        masks = [self.truth(value) for value in values]
+        if numpy is not None:
+            return reduce(
+                numpy.logical_and if combine is all else numpy.logical_or, masks
+            )
+        return [combine(row) for row in zip(*masks)]
+
+    def negate(self, value):
+        mask = self.truth(value)
+        if numpy is not None:
+            return ~mask
+        return [not item for item in mask]
+
+
+class Predicate:
+    """Predicate expression over the mapped fields of buckets, compiled
+    once and evaluated over every bucket of a poll at once.
+
+    Expressions use python syntax: field names (nested fields as
+    field.subfield), constants, arithmetic, comparisons, and/or/not and
+    predicate_functions, e.g.
+
+        order_rate > 3 and order_state == 'x' and delta(order_rate) > 0
+
+    Missing fields and values an operator does not apply to make the
+    comparisons they are part of false. delta, rate and percentile
+    compare a bucket, identified by its key_field, with its values in
+    previous polls; buckets absent from a poll lose their history.
+    """
+
+    def __init__(self, expression: str, key_field: str = "key"):
+        load_numpy()
+        self.expression = expression
+        self.key_field = key_field
+        self.windows = {}
+        if not isinstance(expression, str):
+            raise PredicateError("predicate must be a string: {!r}".format(expression))
+        try:
+            tree = ast.parse(expression.strip(), mode="eval")
+        except SyntaxError as e:
+            raise PredicateError("invalid predicate {!r}: {}".format(expression, e))
+        self.evaluator = self.compile(tree.body)
+        self.history = {}
+        self.polled = {}
+
+    def compile(self, node):
+        """Compile an expression node into a function of a Frame.
+        """
+        if isinstance(node, ast.BoolOp):
+            combine = all if isinstance(node.op, ast.And) else any
+            values = [self.compile(value) for value in node.values]
+            return lambda frame: frame.logical(
+                combine, [value(frame) for value in values]
+            )
+        if isinstance(node, ast.UnaryOp):
+            operand = self.compile(node.operand)
+            if isinstance(node.op, ast.Not):
+                return lambda frame: frame.negate(operand(frame))
+            if isinstance(node.op, ast.USub):
+                return lambda frame: frame.apply(
+                    lambda value, _: -value, operand(frame), 0
+                )
+            if isinstance(node.op, ast.UAdd):
+                return operand
+        if isinstance(node, ast.BinOp) and type(node.op) in binary_operators:
+            op = binary_operators[type(node.op)]
+            left, right = self.compile(node.left), self.compile(node.right)
+            return lambda frame: frame.apply(op, left(frame), right(frame))
+        if isinstance(node, ast.Compare):
+            operands = [self.compile(node.left)] + [
+                self.compile(comparator) for comparator in node.comparators
+            ]
+            ops = []
+            for op in node.ops:
+                if type(op) not in compare_operators:
+                    raise PredicateError(
+                        "unsupported comparison in predicate: {}".format(
+                            type(op).__name__
+                        )
+                    )
+                ops.append(compare_operators[type(op)])
+
+            def compare(frame):
+                values = [operand(frame) for operand in operands]
+                return frame.logical(
+                    all,
+                    [
+                        frame.apply(op, values[index], values[index + 1])
+                        for index, op in enumerate(ops)
+                    ],
+                )
+
+            return compare
+        if isinstance(node, ast.Call):
+            return self.compile_call(node)
+        path = self.field_path(node)
+        if path is not None:
+            return lambda frame: frame.field(path)
+        constant = self.constant(node)
+        if constant is not None:
+            return lambda frame: constant[0]
+        raise PredicateError(
+            "unsupported expression in predicate: {}".format(type(node).__name__)
+        )
+
+    def field_path(self, node) -> tuple:
+        if isinstance(node, ast.Name):
+            return (node.id,)
+        if isinstance(node, ast.Attribute):
+            parent = self.field_path(node.value)
+            if parent is not None:
+                return parent + (node.attr,)
+        return None
+
+    def constant(self, node) -> tuple:
+        """(value,) of a constant node, None for any other node.
+        """
+        if sys.version_info < (3, 8):  # pragma: no cover
+            if isinstance(node, ast.Num):
+                return (node.n,)
+            if isinstance(node, ast.Str):
+                return (node.s,)
+            if isinstance(node, ast.NameConstant):
+                return (node.value,)
+        if isinstance(node, ast.Constant):
+            return (node.value,)
+        return None
+
+    def compile_call(self, node):
+        name = node.func.id if isinstance(node.func, ast.Name) else None
+        if name not in predicate_functions or node.keywords:
+            raise PredicateError(
+                "unsupported function in predicate: {}".format(ast.dump(node.func))
+            )
+        if name == "abs":
+            if len(node.args) != 1:
+                raise PredicateError("abs takes a single argument")
+            value = self.compile(node.args[0])
+            return lambda frame: frame.apply(lambda item, _: abs(item), value(frame), 0)
+        path = self.field_path(node.args[0]) if node.args else None
+        if path is None:
+            raise PredicateError("{} takes a field name first".format(name))
+        arguments = [self.constant(argument) for argument in node.args[1:]]
+        if None in arguments or not all(
+            isinstance(argument[0], (int, float)) for argument in arguments
+        ):
+            raise PredicateError(
+                "{} takes numeric constants after the field".format(name)
+            )
+        arguments = [argument[0] for argument in arguments]
+        if name == "percentile":
+            if len(arguments) not in (1, 2):
+                raise PredicateError("percentile takes a field, q and optional window")
+            q = arguments[0]
+            window = int(arguments[1]) if len(arguments) == 2 else default_window
+            if window < 1:
+                raise PredicateError("percentile window must be at least 1")
+            # the current value makes up the rest of the window
+            self.windows[path] = max(self.windows.get(path, 0), window - 1)
+
+            def percentile(frame):
+                return frame.column(
+                    [
+                        interpolated_percentile(
+                            [value for at, value in history][
+                                max(len(history) - window + 1, 0) :
+                            ]
+                            + [current],
+                            q,
+                        )
+                        for history, current in zip(
+                            frame.previous[path], frame.values(path)
+                        )
+                    ]
+                )
+
+            return percentile
+        if arguments:
+            raise PredicateError("{} takes a single field".format(name))
+        self.windows[path] = max(self.windows.get(path, 0), 1)
+
+        def change(frame):
+            changes = []
+            for history, current in zip(frame.previous[path], frame.values(path)):
+                if not history:
+                    changes.append(None)
+                    continue
+                at, previous = history[-1]
+                difference = safe(operator.sub, current, previous)
+                if name == "rate":
+                    difference = safe(operator.truediv, difference, frame.now - at)
+                changes.append(difference)
+            return frame.column(changes)
+
+        return change
+
+    def evaluate(self, buckets: list, now: float = None, commit: bool = True) -> list:
+        """Evaluate the predicate over buckets and remember the values
+        of the fields whose history it uses.
+
+            Args:
+                list:    buckets (mapped_responses from ResponseMapper)
+                float:   now (unix time of the poll, defaults to the current time)
+                bool:    commit (buckets are the whole poll, see commit)
+            Returns:
+                list:    bool per bucket
+        """
+        if not buckets:
+            if commit:
+                self.commit()
+            return []
+        now = time.time() if now is None else now
+        identities = [
+            bucket_identity(value) for value in column(buckets, self.key_field)
+        ]
+        previous = {
+            path: [
+                self.history.get(path, {}).get(identity, ()) for identity in identities
+            ]
+            for path in self.windows
+        }
+        frame = Frame(buckets, previous, now)
+        mask = frame.truth(self.evaluator(frame))
+        if numpy is not None:
+            mask = mask.tolist()
+        for path, window in self.windows.items():
+            history = self.polled.setdefault(path, {})
+            for identity, entries, value in zip(
+                identities, previous[path], frame.values(path)
+            ):
+                entries = deque(entries, maxlen=window)
+                entries.append((now, value))
+                history[identity] = entries
+        if commit:
+            self.commit()
+        return mask
+
+    def commit(self):
+        """End a poll whose buckets were evaluated in several parts (pages),
+        the history of buckets it did not return is forgotten.
+        """
+        self.history = self.polled
+        self.polled = {}
+
+    def rollback(self):
+        """Forget the values of a poll that failed part way.
+        """
+        self.polled = {}
+
+    def filter(self, buckets: list, now: float = None, commit: bool = True) -> list:
+        """Buckets matching the predicate.
+        """
+        buckets = buckets if isinstance(buckets, BucketBatch) else list(buckets)
+        return type(buckets)(
+            bucket
+            for bucket, match in zip(buckets, self.evaluate(buckets, now, commit))
+            if match
+        )
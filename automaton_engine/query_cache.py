@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import OrderedDict
+
+import json
+import logging
+import time
+
+from automaton_engine.session import target_key
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(engine, query_payload: dict) -> tuple:
+    """Automatons sending the same query_payload to the same endpoint of a
+    cluster with the same credentials share results. The payload is
+    canonicalized so key order does not matter.
+    """
+    auth = engine.es_auth
+    return (
+        target_key(engine.elasticsearch["url"]),
+        (auth.login, auth.password) if auth is not None else None,
+        engine.es_query["query_endpoint"],
+        json.dumps(query_payload, sort_keys=True, separators=(",", ":"), default=str),
+    )
+
+
+class QueryCache:
+    """Share query responses between automatons running identical queries.
+
+    A response is reused for ttl_ratio of the smallest query_interval of
+    the automatons registered for its query, so each distinct query costs
+    one elasticsearch request per interval of its fastest automaton.
+    Identical queries arriving while one is in flight wait for its
+    response rather than sending their own, failures are not cached. At
+    most max_entries responses are kept, least recently used first out.
+
+    Cached responses are shared: they must be treated as read only.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_ratio: float = 0.9):
+        self.max_entries = max_entries
+        self.ttl_ratio = ttl_ratio
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.intervals = {}
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, engine):
+        """Make the cache aware of an automaton's query_interval (its
+        min_interval, when polling adaptively), which bounds how long its
+        query's responses are reused.
+        """
+        if engine.incremental is None:
+            key = cache_key(engine, engine.es_query["query_payload"])
+            self.intervals.setdefault(key, {})[engine.name] = (
+                engine.adaptive.min_interval
+                if engine.adaptive is not None
+                else engine.es_query["query_interval"]
+            )
+
+    def unregister(self, engine):
+        key = cache_key(engine, engine.es_query["query_payload"])
+        members = self.intervals.get(key)
+        if members is not None:
+            members.pop(engine.name, None)
+            if not members:
+                del self.intervals[key]
+                self.entries.pop(key, None)
+
+    def ttl(self, key: tuple, engine) -> float:
+        members = self.intervals.get(key)
+        interval = (
+            min(members.values()) if members else engine.es_query["query_interval"]
+        )
+        return interval * self.ttl_ratio
+
+    def get(self, key: tuple, now: float):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, query_response = entry
+        if expires_at <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return query_response
+
+    def put(self, key: tuple, query_response: dict, expires_at: float):
+        self.entries[key] = (expires_at, query_response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def search(self, engine, query_payload: dict) -> dict:
+        """Return a cached response to engine's query_payload, or run it
+        through engine.SearchExecutor.
+
+            Args:
+                AutomatonEngine:    engine
+                dict:               query_payload
+            Returns:
+                dict:               query_response (elasticsearch query response)
+            Raises:
+                asyncio.TimeoutError
+                General Exception
+        """
+        key = cache_key(engine, query_payload)
+        # the ttl runs from when the query was sent, so the next interval
+        # of the fastest automaton always finds the response expired
+        start = time.monotonic()
+        query_response = self.get(key, start)
+        if query_response is not None:
+            self.hits += 1
+            engine.metrics.inc(
+                "query_cache_total", engine.metric_labels + (("outcome", "hit"),)
+            )
+            return query_response
+        future = self.inflight.get(key)
+        if future is not None:
+            self.hits += 1
+            engine.metrics.inc(
+                "query_cache_total", engine.metric_labels + (("outcome", "coalesced"),)
+            )
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # the automaton running the query was cancelled, not this one
+                return await self.search(engine, query_payload)
+        self.misses += 1
+        engine.metrics.inc(
+            "query_cache_total", engine.metric_labels + (("outcome", "miss"),)
+        )
+        future = self.inflight[key] = asyncio.get_event_loop().create_future()
+        try:
+            query_response = await engine.SearchExecutor(query_payload)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # waiters log the failure themselves
+                future.exception()
+            raise
+        else:
+            future.set_result(query_response)
+            self.put(key, query_response, start + self.ttl(key, engine))
+            return query_response
+        finally:
+            del self.inflight[key]
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import aiohttp
+from collections import deque
+
+import logging
+import random
+import time
+
+from automaton_engine.session import target_key
+
+logger = logging.getLogger(__name__)
+
+
+""" resilience defaults applied to every elasticsearch cluster unless
+overridden
+- retries           : retries after a failed query
+- retry_base_delay  : seconds before the first retry, doubled per retry
+- retry_max_delay   : cap on the delay between attempts (full jitter)
+- retry_statuses    : response statuses worth retrying
+- failure_threshold : consecutive failures opening the circuit
+- reset_timeout     : seconds an open circuit waits before probing
+- hedge_quantile    : latency quantile after which a secondary_url is tried
+- hedge_min_delay   : lower bound on the hedge delay, in seconds
+- hedge_min_samples : latencies recorded before hedging starts
+"""
+resilience_defaults = {
+    "retries": 2,
+    "retry_base_delay": 0.2,
+    "retry_max_delay": 5.0,
+    "retry_statuses": (429, 502, 503, 504),
+    "failure_threshold": 5,
+    "reset_timeout": 30.0,
+    "hedge_quantile": 0.99,
+    "hedge_min_delay": 0.05,
+    "hedge_min_samples": 20,
+}
+
+
+class QueryStatusError(Exception):
+    """Elasticsearch answered a query with an unexpected status.
+    """
+
+    def __init__(self, url: str, status: int):
+        super().__init__("{} returned status {}".format(url, status))
+        self.status = status
+
+
+class CircuitOpenError(Exception):
+    """A query was refused because the circuit of its cluster is open.
+    """
+
+
+class CircuitBreaker:
+    """Stop sending queries to a cluster after failure_threshold
+    consecutive failures. Once reset_timeout seconds have passed a single
+    probe is let through: its success closes the circuit, its failure
+    re-opens it for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_timeout:
+            return False
+        # let one probe through, further queries wait for its outcome or
+        # for another reset_timeout should it never report back
+        self.state = "half-open"
+        self.opened_at = now
+        return True
+
+    def success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == "half-open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(
+                    "circuit opened after %s consecutive failures", self.failures
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Latencies of the most recent window queries.
+    """
+
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.latencies.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class ClusterGuard:
+    """Retries, circuit breaking and hedging for the queries sent to one
+    elasticsearch cluster.
+    """
+
+    def __init__(self, url: str, settings: dict):
+        self.url = url
+        self.settings = settings
+        self.breaker = CircuitBreaker(
+            settings["failure_threshold"], settings["reset_timeout"]
+        )
+        self.latency = LatencyTracker()
+        self.retried = 0
+        self.hedged = 0
+
+    def retryable(self, e: Exception) -> bool:
+        if isinstance(e, QueryStatusError):
+            return e.status in self.settings["retry_statuses"]
+        return isinstance(e, (asyncio.TimeoutError, aiohttp.ClientError))
+
+    def delay(self, retry: int) -> float:
+        """Full jitter exponential backoff before retry number retry.
+        """
+        return random.uniform(
+            0,
+            min(
+                self.settings["retry_max_delay"],
+                self.settings["retry_base_delay"] * 2 ** retry,
+            ),
+        )
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait on the primary before hedging, None until enough
+        latencies have been recorded.
+        """
+        if len(self.latency.latencies) < self.settings["hedge_min_samples"]:
+            return None
+        return max(
+            self.latency.quantile(self.settings["hedge_quantile"]),
+            self.settings["hedge_min_delay"],
+        )
+
+    async def call(self, request, hedge=None):
+        """Run request, retrying failures worth retrying.
+
+            Args:
+                coroutine function:    request (sends the query)
+                coroutine function:    hedge (sends the query to a secondary, optional)
+            Returns:
+                request's result
+            Raises:
+                CircuitOpenError
+                General Exception (the last failure)
+        """
+        retry = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError("circuit open for {}".format(self.url))
+            try:
+                result = await self.attempt(request, hedge)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not self.retryable(e):
+                    # the cluster answered, the query is at fault
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                if retry >= self.settings["retries"]:
+                    raise
+                delay = self.delay(retry)
+                retry += 1
+                self.retried += 1
+                logger.warning(
+                    "query to %s failed (%r), retry %s in %.2fs",
+                    self.url,
+                    e,
+                    retry,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.success()
+                return result
+
+    async def attempt(self, request, hedge=None):
+        """Run request once, racing it against hedge when it takes longer
+        than the configured latency quantile.
+        """
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        hedge_delay = self.hedge_delay() if hedge is not None else None
+        if hedge_delay is None:
+            result = await request()
+            self.latency.record(loop.time() - start)
+            return result
+        primary = asyncio.ensure_future(request())
+        done, pending = await asyncio.wait([primary], timeout=hedge_delay)
+        if done:
+            self.latency.record(loop.time() - start)
+            return primary.result()
+        self.hedged += 1
+        logger.debug("hedging query to %s after %.3fs", self.url, hedge_delay)
+        pending = {primary, asyncio.ensure_future(hedge())}
+        failure = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self.latency.record(loop.time() - start)
+                        return task.result()
+                    if failure is None or task is primary:
+                        failure = task.exception()
+            raise failure
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+class ResilienceManager:
+    """One ClusterGuard per elasticsearch cluster. Settings can be given
+    globally or per cluster, for example:
+
+        {
+            "retries": 3,
+            "targets": {
+                "https://es.local:9200": {"failure_threshold": 10}
+            }
+        }
+    """
+
+    def __init__(self, config: dict = None):
+        config = dict(config or {})
+        targets = config.pop("targets", {})
+        self.defaults = dict(resilience_defaults, **config)
+        self.targets = {
+            target_key(url): dict(self.defaults, **settings)
+            for url, settings in targets.items()
+        }
+        self.guards = {}
+
+    def guard(self, url: str) -> ClusterGuard:
+        key = target_key(url)
+        if key not in self.guards:
+            self.guards[key] = ClusterGuard(key, self.targets.get(key, self.defaults))
+        return self.guards[key]
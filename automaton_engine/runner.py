@@ -4,63 +4,518 @@
 import sys
 import logging
 import asyncio
-import biome
 import os
+import signal
 
 
 from automaton_engine import AutomatonEngine
+from automaton_engine.action_queue import ActionJob, ActionQueue, JobNotOwned
+from automaton_engine.actions.common import BucketResult
+from automaton_engine.actions.registry import ActionRegistry
+from automaton_engine.backoff import BackoffStore
+from automaton_engine.config import (
+    AutomatonConfig,
+    ConfigError,
+    ConfigWatcher,
+    EngineConfig,
+    diff,
+)
+from automaton_engine.coordination import LeaseCoordinator, lease_store
+from automaton_engine.engine import action_dispatcher
+from automaton_engine.incremental import WatermarkStore
+from automaton_engine.metrics import MetricsRegistry, MetricsServer, default_buckets
+from automaton_engine.msearch import MultiSearchBatcher
+from automaton_engine.performance import LoopMonitor, startup, use_uvloop
+from automaton_engine.query_cache import QueryCache
+from automaton_engine.resilience import ResilienceManager
+from automaton_engine.scheduler import Scheduler
+from automaton_engine.session import SessionManager
+from automaton_engine.sharding import HashRing, ShardSupervisor, forward_logs
 
 logger = logging.getLogger(__name__)
 
 
+class Runtime:
+    """Resources shared by the automaton engines of a process, the
+    scheduler driving them, and the engines built from the automaton
+    configurations applied so far.
+
+    Applying a new configuration only starts, stops or rebuilds the
+    automatons that were added, removed or changed. Backoff state and
+    incremental watermarks are kept by name, so they survive a rebuild.
+    select, when given, limits the automatons run to those it accepts.
+    """
+
+    def __init__(self, config: EngineConfig, select=None):
+        self.select = select
+        self.resources = []
+        self.automatons = {}
+        self.engines = {}
+        """ Optionally expose metrics on an http /metrics endpoint,
+        configured via the "metrics" section
+        """
+        metrics_config = config.section("metrics")
+        self.metrics = MetricsRegistry(
+            metrics_config.pop("enabled", False),
+            metrics_config.pop("buckets", default_buckets),
+        )
+        if self.metrics.enabled:
+            self.resources.append(MetricsServer(self.metrics, **metrics_config))
+        """ Shared http session pools, configured via the optional
+        "http" section of the automaton engine configuration
+        """
+        self.session_manager = SessionManager(config.section("http"))
+        """ Incremental query watermarks, checkpointed to the optional
+        "checkpoints" path
+        """
+        self.checkpoint_store = WatermarkStore(**config.section("checkpoints"))
+        """ Per bucket backoff state shared by every automaton, bounded and
+        persisted via the optional "backoff" section
+        """
+        self.backoff_store = BackoffStore(**config.section("backoff"))
+        """ Retry, circuit breaking and hedging settings per elasticsearch
+        cluster, tuned via the optional "resilience" section
+        """
+        self.resilience = ResilienceManager(config.section("resilience"))
+        """ Optionally batch queries of automatons sharing a cluster and
+        query_interval into _msearch requests
+        """
+        msearch = config.section("msearch")
+        if msearch.pop("enabled", False):
+            self.query_batcher = MultiSearchBatcher(self.session_manager, **msearch)
+        else:
+            self.query_batcher = None
+        """ Optionally share the responses of identical queries between
+        automatons, configured via the "query_cache" section
+        """
+        query_cache = config.section("query_cache")
+        if query_cache.pop("enabled", False):
+            self.query_cache = QueryCache(**query_cache)
+        else:
+            self.query_cache = None
+        """ Optionally decouple actions from polls through a bounded queue
+        and worker pool, configured via the "action_queue" section
+        """
+        action_queue = config.section("action_queue")
+        if action_queue.pop("enabled", False):
+            self.action_queue = ActionQueue(
+                self.deliver, on_failure=self.undeliverable, **action_queue
+            )
+            self.resources.append(self.action_queue)
+        else:
+            self.action_queue = None
+        """ Actions resolved on first use, from the module paths, packages
+        and entry points of the optional "action_registry" section, set
+        up with the shared session pools and flushed on shutdown
+        """
+        action_registry = config.section("action_registry")
+        if action_registry:
+            self.action_registry = ActionRegistry(**action_registry)
+        else:
+            self.action_registry = action_dispatcher
+        self.resources.append(self.action_registry)
+        """ Schedule polls of the automaton configurations, tuned via
+        the optional "scheduler" section
+        """
+        self.scheduler = Scheduler(**config.section("scheduler"))
+        self.resources.extend(
+            [self.checkpoint_store, self.backoff_store, self.session_manager]
+        )
+        """ Optionally split the automatons between replicas holding leases
+        in a shared store, configured via the "coordination" section
+        """
+        coordination = config.section("coordination")
+        if coordination.pop("enabled", False):
+            store = lease_store(
+                coordination.pop("store", "memory"),
+                coordination.pop("path", None),
+                coordination.pop("url", None),
+            )
+            self.coordinator = LeaseCoordinator(self, store, **coordination)
+            self.resources.insert(0, self.coordinator)
+        else:
+            self.coordinator = None
+        """ Optionally watch the event loop for stalls and profile it on
+        signal, configured via the "performance" section
+        """
+        performance = config.section("performance")
+        if performance.pop("enabled", False):
+            performance.pop("uvloop", None)
+            self.loop_monitor = LoopMonitor(self.metrics, **performance)
+            self.resources.insert(0, self.loop_monitor)
+        else:
+            self.loop_monitor = None
+        self.apply(config)
+
+    def build_engine(self, automaton: AutomatonConfig) -> AutomatonEngine:
+        return AutomatonEngine(
+            automaton.name,
+            automaton.enabled,
+            automaton.runonce,
+            automaton.elasticsearch,
+            automaton.elasticsearch_query,
+            automaton.actions,
+            self.session_manager,
+            parallel_actions=automaton.parallel_actions,
+            query_batcher=self.query_batcher,
+            checkpoint_store=self.checkpoint_store,
+            backoff_store=self.backoff_store,
+            metrics=self.metrics,
+            resilience=self.resilience,
+            action_queue=self.action_queue,
+            action_registry=self.action_registry,
+            query_cache=self.query_cache,
+            cluster_slots=self.scheduler.cluster_slots,
+        )
+
+    def job_action(self, job: ActionJob) -> tuple:
+        """Engine and action a queued job belongs to, (None, None) once the
+        automaton or action has been removed.
+        """
+        engine = self.engines.get(job.automaton)
+        if engine is None or job.action_id not in engine.action_ids:
+            return None, None
+        return engine, engine.action_specs[engine.action_ids.index(job.action_id)]
+
+    async def deliver(self, job: ActionJob) -> list:
+        if job.automaton not in self.engines and any(
+            automaton.name == job.automaton for automaton in self.config.automatons
+        ):
+            # configured, but run by another shard or replica
+            raise JobNotOwned(job.automaton)
+        engine, action = self.job_action(job)
+        if engine is None:
+            logger.warning(
+                "dropping queued job for removed action: %s of automaton: %s",
+                job.action_id,
+                job.automaton,
+            )
+            return [BucketResult(bucket, True, None) for bucket in job.buckets]
+        return await engine.ActionDispatch(action, job.buckets)
+
+    def undeliverable(self, job: ActionJob, buckets: list):
+        engine, action = self.job_action(job)
+        if engine is not None:
+            self.backoff_store.forget(
+                job.automaton, job.action_id, buckets, engine.bucket_key
+            )
+
+    def start(self, automaton: AutomatonConfig):
+        engine = self.build_engine(automaton)
+        self.automatons[automaton.name] = automaton
+        self.engines[automaton.name] = engine
+        if engine.enabled:
+            self.scheduler.add(engine)
+
+    def stop(self, name: str):
+        """Stop scheduling an automaton, a poll already running is left to
+        finish.
+        """
+        engine = self.engines.pop(name)
+        del self.automatons[name]
+        self.scheduler.remove(engine)
+        if self.query_batcher is not None:
+            self.query_batcher.unregister(engine)
+        if self.query_cache is not None:
+            self.query_cache.unregister(engine)
+
+    def apply(self, config: EngineConfig) -> tuple:
+        """Bring the running automatons in line with config.
+
+            Args:
+                EngineConfig:    config
+            Returns:
+                tuple:           (added, removed, changed) automaton names
+        """
+        automatons = {
+            automaton.name: automaton
+            for automaton in config.automatons
+            if self.select is None or self.select(automaton.name)
+        }
+        self.config = config
+        added, removed, changed = diff(self.automatons, automatons)
+        for name in removed + changed:
+            self.stop(name)
+        for name in added + changed:
+            self.start(automatons[name])
+        return added, removed, changed
+
+
+class ConfigReloader:
+    """Apply configuration changes picked up by watcher to runtime.
+
+    Only automatons are reloaded, changes to other sections are logged
+    and take effect on restart. Invalid configuration is logged and
+    ignored, the running automatons are left as they are.
+    """
+
+    def __init__(self, runtime: Runtime, watcher: ConfigWatcher):
+        self.runtime = runtime
+        self.watcher = watcher
+        self.task = None
+
+    def reload(self):
+        sections = self.watcher.sections
+        try:
+            config = self.watcher.load()
+        except ConfigError as e:
+            logger.error("configuration reload failed: %s", e)
+            return
+        added, removed, changed = self.runtime.apply(config)
+        logger.info(
+            "configuration reloaded: %s added, %s removed, %s changed",
+            added,
+            removed,
+            changed,
+        )
+        restart = sorted(
+            name
+            for name in set(sections) | set(config.sections)
+            if sections.get(name) != config.sections.get(name)
+        )
+        if restart:
+            logger.warning(
+                "configuration sections changed, restart to apply: %s",
+                ", ".join(restart),
+            )
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.watcher.interval)
+            if self.watcher.changed():
+                self.reload()
+
+    async def start(self):
+        self.runtime.scheduler.persistent = True
+        self.task = asyncio.ensure_future(self.watch())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+def build_scheduler(config, watcher: ConfigWatcher = None, select=None) -> tuple:
+    """Create the automaton engines described by config, and the scheduler
+    driving them.
+
+        Args:
+            EngineConfig:     config (or an automaton engine configuration dict)
+            ConfigWatcher:    watcher (reload automatons on change, optional)
+            callable:         select (automaton name filter, optional)
+        Returns:
+            tuple:            (Scheduler, list of resources to start and close)
+    """
+    if not isinstance(config, EngineConfig):
+        config = EngineConfig.from_dict(config)
+    runtime = Runtime(config, select)
+    if watcher is not None:
+        runtime.resources.insert(0, ConfigReloader(runtime, watcher))
+    return runtime.scheduler, runtime.resources
+
+
+async def serve(scheduler: Scheduler, resources: list):
+    """Run scheduler to completion, starting resources that need the
+    running loop first and closing every resource on the way out.
+    """
+    try:
+        for resource in resources:
+            if hasattr(resource, "start"):
+                await resource.start()
+        await scheduler.run()
+    finally:
+        for resource in resources:
+            await resource.close()
+
+
+""" signals stopping the engine gracefully: polls are cancelled and every
+resource closed, so leases are released and state is flushed
+"""
+stop_signals = ("SIGTERM", "SIGINT")
+
+
+def run_until_stopped(loop, main):
+    """Run coroutine main on loop to completion, or until a stop signal
+    cancels it and its cleanup has run.
+    """
+    task = loop.create_task(main)
+
+    def stop(name: str):
+        logger.info("received %s, shutting down", name)
+        task.cancel()
+
+    handled = []
+    for name in stop_signals:
+        try:
+            loop.add_signal_handler(getattr(signal, name), stop, name)
+            handled.append(getattr(signal, name))
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            logger.debug("cannot handle signal %s here", name)
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        for signum in handled:
+            loop.remove_signal_handler(signum)
+
+
+def worker_config(shard: int, config: dict) -> dict:
+    """Adapt the configuration of a shard to run beside the other shards
+    of the same process group.
+
+        Args:
+            int:     shard
+            dict:    config (configuration of the shard, see shard_config)
+        Returns:
+            dict:    configuration of the shard worker
+    """
+    """ Local state files are not shared between workers, so each shard
+    writes its own (sqlite databases handle concurrent writers)
+    """
+    for section in ("checkpoints", "backoff"):
+        options = config.get(section, {})
+        if options.get("path") and options.get("backend") != "sqlite":
+            path = "{}.shard-{}".format(options["path"], shard)
+            config = dict(config, **{section: dict(options, path=path)})
+    """ Each shard journals the queued jobs of its own automatons, so that
+    it only restores and completes those
+    """
+    action_queue = config.get("action_queue", {})
+    if action_queue.get("path"):
+        path = "{}.shard-{}".format(action_queue["path"], shard)
+        config = dict(config, action_queue=dict(action_queue, path=path))
+    """ Each shard serves its metrics on its own port
+    """
+    metrics = config.get("metrics", {})
+    if metrics.get("enabled"):
+        port = metrics.get("port", 9464) + shard
+        config = dict(config, metrics=dict(metrics, port=port))
+    """ Each shard coordinates with the same shard of the other replicas
+    only, as the automatons of other shards are not its to run
+    """
+    coordination = config.get("coordination", {})
+    if coordination.get("enabled"):
+        group = "shard-{}".format(shard)
+        config = dict(config, coordination=dict(coordination, group=group))
+    return config
+
+
+def run_shard(shard: int, config: dict, log_queue, stats_queue):
+    """Worker process entrypoint for sharded mode, runs the automatons of
+    one shard and reports its stats to the supervisor.
+    """
+    forward_logs(shard, log_queue)
+    config = worker_config(shard, config)
+    stats_interval = config.get("sharding", {}).get("stats_interval", 60.0)
+    """ When reloading, load the current automatons from source rather
+    than the supervisor's copy, and keep those hashed to this shard
+    """
+    ring = HashRing(config["sharding"]["workers"])
+    reload = config.get("reload", {})
+    watcher = None
+    if reload.get("path") and reload.get("enabled", True):
+        watcher = ConfigWatcher(reload["path"], reload.get("interval", 2.0))
+        config = dict(config, automatons=watcher.load().to_dict()["automatons"])
+
+    def report(scheduler):
+        stats_queue.put(
+            {
+                "shard": shard,
+                "pid": os.getpid(),
+                "automatons": len(scheduler.entries),
+                "polls": scheduler.polls,
+                "errors": scheduler.errors,
+            }
+        )
+
+    async def reporter(scheduler):
+        while True:
+            await asyncio.sleep(stats_interval)
+            report(scheduler)
+
+    async def run():
+        scheduler, resources = build_scheduler(
+            config, watcher, lambda name: ring.shard(name) == shard
+        )
+        reporting = asyncio.ensure_future(reporter(scheduler))
+        try:
+            await serve(scheduler, resources)
+        finally:
+            reporting.cancel()
+            report(scheduler)
+
+    performance = config.get("performance", {})
+    if performance.get("enabled") and performance.get("uvloop", True):
+        use_uvloop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        run_until_stopped(loop, run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+
+
 def runner(argv=None):
     try:
-        logging.info("AutomatonEngine starting")
-        automaton_engines = []
-        """ Fetch automaton configurations from environment
-        """
-        for cfg in range(len(biome.AUTOMATON_ENGINE.get_dict("config")["automatons"])):
-            automaton_engines.append(
-                AutomatonEngine(
-                    biome.AUTOMATON_ENGINE.get_dict("config")["automatons"][cfg][
-                        "name"
-                    ],
-                    biome.AUTOMATON_ENGINE.get_dict("config")["automatons"][cfg][
-                        "enabled"
-                    ],
-                    biome.AUTOMATON_ENGINE.get_dict("config")["automatons"][cfg][
-                        "runonce"
-                    ],
-                    biome.AUTOMATON_ENGINE.get_dict("config")["automatons"][cfg][
-                        "elasticsearch"
-                    ],
-                    biome.AUTOMATON_ENGINE.get_dict("config")["automatons"][cfg][
-                        "elasticsearch_query"
-                    ],
-                    biome.AUTOMATON_ENGINE.get_dict("config")["automatons"][cfg][
-                        "actions"
-                    ],
-                )
-            )
-        loop = asyncio.get_event_loop()
-        """ Call poller with automaton configurations collected from
-        environment variables
+        logger.info("AutomatonEngine starting")
+        """ Load automaton engine configuration from the file or directory
+        at AUTOMATON_ENGINE_CONFIG_PATH, reloading automatons as it changes,
+        or once from the AUTOMATON_ENGINE_CONFIG environment variable
+        """
+        watcher = None
+        path = os.environ.get("AUTOMATON_ENGINE_CONFIG_PATH")
+        if path:
+            watcher = ConfigWatcher(path)
+            config = watcher.load()
+            reload = config.section("reload")
+            watcher.interval = reload.get("interval", watcher.interval)
+            if reload.get("enabled", True):
+                config.sections = dict(config.sections, reload=dict(reload, path=path))
+            else:
+                watcher = None
+        else:
+            import biome
+
+            config = EngineConfig.from_dict(biome.AUTOMATON_ENGINE.get_dict("config"))
+        startup.mark("config")
+        """ Optionally shard automatons across worker processes
         """
-        automaton_engine_t = [
-            (AutomatonEngine.Poller(automaton))
-            for index, automaton in enumerate(automaton_engines)
-        ]
+        sharding = config.section("sharding")
+        if sharding.pop("enabled", False):
+            ShardSupervisor(config.to_dict(), run_shard, **sharding).run()
+            return
+        """ Optionally run on uvloop, in every shard too
+        """
+        performance = config.section("performance")
+        if performance.get("enabled") and performance.get("uvloop", True):
+            use_uvloop()
+        loop = asyncio.get_event_loop()
+        scheduler, resources = build_scheduler(config, watcher)
+        startup.mark("runtime")
+        logger.info(
+            "AutomatonEngine started in %.3fs (%s)",
+            startup.total(),
+            ", ".join(
+                "{} {:.3f}s".format(phase, seconds)
+                for phase, seconds in startup.phases.items()
+            ),
+        )
         """ Start event loop
         """
-        loop.run_until_complete(asyncio.gather(*automaton_engine_t))
-        loop.close()
+        try:
+            run_until_stopped(loop, serve(scheduler, resources))
+        finally:
+            loop.close()
     except KeyboardInterrupt:
         try:
             sys.exit(0)
         except SystemExit:
             os._exit(0)
     except Exception as e:
-        logging.error(e)
+        logger.error(e)
         raise
 
 
@@ -68,5 +523,5 @@ if __name__ == "__main__":
     try:
         runner()
     except Exception as e:
-        logging.error(e)
+        logger.error(e)
         raise
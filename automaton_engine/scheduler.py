@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import heapq
+import itertools
+import random
+import zlib
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+""" missed tick policies
+- skip     : drop ticks that fell due while a poll was running or the loop
+             was stalled, and resume on the next tick of the fixed-rate grid
+- catch-up : run every missed tick, back to back, as soon as possible
+"""
+missed_tick_policies = ("skip", "catch-up")
+
+
+class NullSlot:
+    """Slot of a cluster whose requests are not bounded, does nothing.
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+null_slot = NullSlot()
+
+
+class ClusterSlots:
+    """Per elasticsearch url semaphores bounding the requests in flight to
+    each cluster, limit 0 for no bound.
+
+    Only the elasticsearch requests hold a slot, so actions dispatched
+    by a poll never keep other automatons' queries waiting.
+    """
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.clusters = {}
+
+    def slot(self, url: str):
+        """Async context manager holding one of url's slots.
+        """
+        if not self.limit:
+            return null_slot
+        url = url.rstrip("/")
+        if url not in self.clusters:
+            self.clusters[url] = asyncio.Semaphore(self.limit)
+        return self.clusters[url]
+
+
+class Scheduler:
+    """Drive every automaton_engine's Poll from a single task.
+
+    Ticks are fixed-rate: an automaton's n-th tick is due at
+    start + phase + n * query_interval regardless of how long its polls
+    take. With spread enabled each automaton's phase is derived from its
+    name so automatons sharing an interval are spread across it instead
+    of firing in lockstep. Automatons batching their queries into _msearch
+    requests take the phase of their batch group instead, so the group
+    still falls due together. jitter adds up to that many random seconds
+    to every tick. max_in_flight bounds the elasticsearch requests in flight
+    per url, through the cluster_slots given to the automatons.
+
+    A persistent scheduler keeps running with no automatons scheduled, for
+    automatons to be added while it runs. A failed poll is logged and
+    counted and the automaton polls again on its next tick, unless
+    fail_fast is set, in which case run raises the first poll error.
+
+    Automatons polling adaptively have their next tick scheduled once a
+    poll completes, PollInterval seconds after it fell due.
+    """
+
+    def __init__(
+        self,
+        jitter: float = 0.0,
+        spread: bool = True,
+        missed_ticks: str = "skip",
+        max_in_flight: int = 0,
+        persistent: bool = False,
+        fail_fast: bool = False,
+    ):
+        if missed_ticks not in missed_tick_policies:
+            raise ValueError(
+                "missed_ticks must be one of {}, got: {}".format(
+                    missed_tick_policies, missed_ticks
+                )
+            )
+        self.jitter = jitter
+        self.spread = spread
+        self.missed_ticks = missed_ticks
+        self.cluster_slots = ClusterSlots(max_in_flight)
+        self.persistent = persistent
+        self.fail_fast = fail_fast
+        self.entries = {}
+        self.timers = []
+        self.tasks = set()
+        self.running = 0
+        self.polls = 0
+        self.errors = 0
+        self.sequence = itertools.count()
+        self.wakeup = None
+        self.error = None
+
+    def phase(self, engine) -> float:
+        """Stable offset of engine's first tick within its query_interval.
+        """
+        if not self.spread:
+            return 0.0
+        name = engine.name
+        batcher = getattr(engine, "query_batcher", None)
+        if batcher is not None:
+            name = batcher.phase_key(engine) or name
+        return (
+            (zlib.crc32(name.encode("utf-8")) % 1000)
+            / 1000.0
+            * engine.es_query["query_interval"]
+        )
+
+    def add(self, engine):
+        """Schedule engine, its first tick falls due after its phase.
+        """
+        key = id(engine)
+        self.entries[key] = {
+            "engine": engine,
+            "due": None,
+            "running": False,
+            "backlog": 0,
+        }
+        if self.wakeup is not None:
+            self.schedule(key, asyncio.get_event_loop().time() + self.phase(engine))
+        logger.debug("scheduler: added automaton_engine: %s", engine.name)
+
+    def remove(self, engine):
+        """Stop scheduling engine, a poll already running is left to finish.
+        """
+        self.entries.pop(id(engine), None)
+        if self.wakeup is not None:
+            self.wakeup.set()
+        logger.debug("scheduler: removed automaton_engine: %s", engine.name)
+
+    def schedule(self, key: int, due: float):
+        self.entries[key]["due"] = due
+        heapq.heappush(self.timers, (due, next(self.sequence), key))
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def adaptive(self, engine) -> bool:
+        return getattr(engine, "adaptive", None) is not None
+
+    def tick(self, key: int, due: float, now: float):
+        """Fire the tick due for entry key and schedule the following one.
+        """
+        entry = self.entries[key]
+        engine = entry["engine"]
+        interval = engine.es_query["query_interval"]
+        if entry["running"]:
+            if self.missed_ticks == "catch-up":
+                entry["backlog"] += 1
+            else:
+                logger.debug(
+                    "scheduler: automaton_engine: %s still polling, skipping tick",
+                    engine.name,
+                )
+        else:
+            self.fire(key)
+        if engine.runonce or self.adaptive(engine):
+            return
+        due += interval
+        if self.missed_ticks == "skip" and due <= now:
+            due += interval * (int((now - due) // interval) + 1)
+        self.schedule(key, due)
+
+    def fire(self, key: int):
+        entry = self.entries[key]
+        entry["running"] = True
+        self.running += 1
+        task = asyncio.ensure_future(self.poll(key, entry))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def poll(self, key: int, entry: dict):
+        engine = entry["engine"]
+        try:
+            while True:
+                if self.jitter:
+                    await asyncio.sleep(random.uniform(0, self.jitter))
+                await engine.Poll()
+                self.polls += 1
+                if entry["backlog"] == 0 or key not in self.entries:
+                    break
+                entry["backlog"] -= 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errors += 1
+            logger.error(
+                "scheduler: automaton_engine: %s poll failed: %r", engine.name, e
+            )
+            if self.fail_fast and self.error is None:
+                self.error = e
+        finally:
+            entry["running"] = False
+            self.running -= 1
+            if engine.runonce:
+                self.entries.pop(key, None)
+            elif self.adaptive(engine) and self.entries.get(key) is entry:
+                self.schedule(
+                    key,
+                    max(
+                        entry["due"] + engine.PollInterval(),
+                        asyncio.get_event_loop().time(),
+                    ),
+                )
+            if self.wakeup is not None:
+                self.wakeup.set()
+
+    async def run(self):
+        """Run until every scheduled automaton_engine has been removed (or
+        has completed, for runonce automatons), or until cancelled when
+        persistent.
+
+            Raises:
+                General Exception (the first exception raised by a poll,
+                when fail_fast)
+        """
+        loop = asyncio.get_event_loop()
+        self.wakeup = asyncio.Event()
+        start = loop.time()
+        for key, entry in list(self.entries.items()):
+            self.schedule(key, start + self.phase(entry["engine"]))
+        try:
+            while self.entries or self.running or self.persistent:
+                if self.error is not None:
+                    raise self.error
+                self.wakeup.clear()
+                now = loop.time()
+                while self.timers and self.timers[0][0] <= now:
+                    due, sequence, key = heapq.heappop(self.timers)
+                    if key in self.entries and self.entries[key]["due"] == due:
+                        self.tick(key, due, now)
+                timeout = self.timers[0][0] - now if self.timers else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if self.error is not None:
+                raise self.error
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            self.wakeup = None
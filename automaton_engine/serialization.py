@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+""" Use orjson for request and response bodies when it is installed
+(pip install automaton-engine[fast]), falling back to the standard
+library json module.
+"""
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def loads(body):
+    """Decode a JSON document from bytes or str.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def dumps(obj) -> bytes:
+    """Encode obj as a UTF-8 JSON document.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from aiohttp import ClientSession, TCPConnector
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+""" session defaults applied to every target unless overridden
+- limit             : total simultaneous connections per target pool
+- limit_per_host    : simultaneous connections per resolved host (0 = no limit)
+- keepalive_timeout : seconds an idle keep-alive connection is retained
+- ttl_dns_cache     : seconds resolved addresses are cached
+- verify_ssl        : verify TLS certificates
+"""
+session_defaults = {
+    "limit": 100,
+    "limit_per_host": 0,
+    "keepalive_timeout": 30,
+    "ttl_dns_cache": 300,
+    "verify_ssl": True,
+}
+
+
+def target_key(url: str) -> str:
+    """Reduce a url to the scheme://host:port it connects to.
+
+        Args:
+            str:    url
+        Returns:
+            str:    target key
+    """
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return "{}://{}:{}".format(parts.scheme, parts.hostname, port)
+
+
+class SessionManager:
+    """Process-wide pool of aiohttp sessions, one keep-alive pool per target.
+
+    Sessions are created lazily on first use from within the running loop
+    and are shared by every engine and action addressing the same target.
+    Limits can be set globally or per target, for example:
+
+        {
+            "limit": 100,
+            "targets": {
+                "https://awx.local": {"limit": 10, "verify_ssl": False}
+            }
+        }
+    """
+
+    def __init__(self, config: dict = None):
+        config = dict(config or {})
+        targets = config.pop("targets", {})
+        self.defaults = dict(session_defaults, **config)
+        self.targets = {
+            target_key(url): dict(self.defaults, **settings)
+            for url, settings in targets.items()
+        }
+        self.sessions = {}
+
+    def settings(self, url: str) -> dict:
+        """Resolve pool settings for the target addressed by url.
+        """
+        return self.targets.get(target_key(url), self.defaults)
+
+    def get(self, url: str, verify_ssl: bool = None) -> ClientSession:
+        """Return the shared session for url, creating its pool if required.
+
+            Args:
+                str:     url
+                bool:    verify_ssl (overrides the target setting when given)
+            Returns:
+                ClientSession
+        """
+        settings = self.settings(url)
+        if verify_ssl is None:
+            verify_ssl = settings["verify_ssl"]
+        key = (target_key(url), verify_ssl)
+        session = self.sessions.get(key)
+        if session is None or session.closed:
+            logger.debug(
+                "creating session pool for %s with settings: %s", key, settings
+            )
+            session = ClientSession(
+                skip_auto_headers=["User-Agent"],
+                connector=TCPConnector(
+                    limit=settings["limit"],
+                    limit_per_host=settings["limit_per_host"],
+                    keepalive_timeout=settings["keepalive_timeout"],
+                    ttl_dns_cache=settings["ttl_dns_cache"],
+                    ssl=None if verify_ssl else False,
+                ),
+            )
+            self.sessions[key] = session
+        return session
+
+    async def close(self):
+        """Close every pooled session and its connector.
+        """
+        sessions, self.sessions = list(self.sessions.values()), {}
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+        logger.debug("closed %s session pools", len(sessions))
+
+
+@asynccontextmanager
+async def client_session(
+    session_manager: SessionManager, url: str, verify_ssl: bool = None
+):
+    """Yield a pooled session from session_manager, or a single-use session
+    when no manager has been injected.
+
+        Args:
+            SessionManager:    session_manager (may be None)
+            str:               url
+            bool:              verify_ssl (None defers to the target setting)
+        Yields:
+            ClientSession
+    """
+    if session_manager is not None:
+        yield session_manager.get(url, verify_ssl=verify_ssl)
+    else:
+        async with ClientSession(
+            skip_auto_headers=["User-Agent"],
+            connector=TCPConnector(ssl=False if verify_ssl is False else None),
+        ) as session:
+            yield session
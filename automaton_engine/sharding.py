@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import hashlib
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """Consistent hash ring assigning automaton names to shards, so that
+    changing the number of shards only moves the automatons it must.
+    Shards are numbered from 0 when shards is a number, otherwise shards
+    lists their names.
+    """
+
+    def __init__(self, shards, replicas: int = 100):
+        if isinstance(shards, int):
+            shards = range(shards)
+        self.ring = sorted(
+            (self.hash("{}-{}".format(shard, replica)), shard)
+            for shard in shards
+            for replica in range(replicas)
+        )
+        self.keys = [key for key, shard in self.ring]
+
+    @staticmethod
+    def hash(value: str) -> int:
+        return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+    def shard(self, name: str) -> int:
+        """Shard owning name.
+        """
+        index = bisect.bisect(self.keys, self.hash(name)) % len(self.keys)
+        return self.ring[index][1]
+
+
+def shard_config(config: dict, shards: int) -> list:
+    """Split config into one config per shard, each holding the automatons
+    the hash ring assigns to it. Every other section is copied as is,
+    the sharding section recording the number of workers.
+
+        Args:
+            dict:    config (automaton engine configuration)
+            int:     shards
+        Returns:
+            list:    configuration per shard
+    """
+    ring = HashRing(shards)
+    sharding = dict(config.get("sharding", {}), workers=shards)
+    configs = [
+        dict(config, automatons=[], sharding=sharding) for shard in range(shards)
+    ]
+    for automaton in config["automatons"]:
+        configs[ring.shard(automaton["name"])]["automatons"].append(automaton)
+    return configs
+
+
+class ShardFilter(logging.Filter):
+    """Tag worker log records with the shard that emitted them.
+    """
+
+    def __init__(self, shard: int):
+        super().__init__()
+        self.shard = shard
+
+    def filter(self, record):
+        record.name = "{}[shard-{}]".format(record.name, self.shard)
+        return True
+
+
+def forward_logs(shard: int, log_queue):
+    """Route a worker's logging to the supervisor through log_queue.
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(ShardFilter(shard))
+    root.addHandler(handler)
+
+
+def interrupt(signum, frame):
+    """SIGTERM handler of the supervisor, stopping it like SIGINT does.
+    """
+    raise KeyboardInterrupt
+
+
+class ShardSupervisor:
+    """Run automatons across worker processes.
+
+    Automatons are assigned to workers by consistent hashing on their
+    name. Each worker runs worker(shard, config, log_queue, stats_queue)
+    with its share of the configuration; its logs are emitted by the
+    supervisor's handlers, and stats it puts on stats_queue are summarised
+    every stats_interval seconds. Workers exiting with an error are
+    restarted after restart_delay seconds, the supervisor returns once
+    every worker has exited cleanly.
+
+    Shards without automatons get no worker, unless the configuration is
+    reloaded: automatons added later may hash to any shard, so a worker
+    is started for every shard.
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        worker,
+        workers: int = None,
+        restart_delay: float = 1.0,
+        stats_interval: float = 60.0,
+    ):
+        self.worker = worker
+        self.workers = workers or os.cpu_count() or 1
+        self.restart_delay = restart_delay
+        self.stats_interval = stats_interval
+        self.configs = shard_config(config, self.workers)
+        reload = config.get("reload", {})
+        self.reloading = bool(reload.get("path")) and reload.get("enabled", True)
+        self.processes = {}
+        self.restarts = {}
+        self.stats = {}
+        self.log_queue = multiprocessing.Queue()
+        self.stats_queue = multiprocessing.Queue()
+
+    def start(self, shard: int):
+        process = multiprocessing.Process(
+            target=self.worker,
+            name="automaton-engine-shard-{}".format(shard),
+            args=(shard, self.configs[shard], self.log_queue, self.stats_queue),
+        )
+        process.start()
+        self.processes[shard] = process
+        logger.info(
+            "shard %s started with pid %s for %s automatons",
+            shard,
+            process.pid,
+            len(self.configs[shard]["automatons"]),
+        )
+
+    def collect_stats(self):
+        while True:
+            try:
+                stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.stats[stats["shard"]] = stats
+
+    def summary(self) -> dict:
+        """Stats aggregated across every shard.
+        """
+        summary = {
+            "shards": len(self.processes),
+            "restarts": sum(self.restarts.values()),
+        }
+        for stats in self.stats.values():
+            for key, value in stats.items():
+                if key not in ("shard", "pid") and isinstance(value, (int, float)):
+                    summary[key] = summary.get(key, 0) + value
+        return summary
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join()
+
+    def run(self):
+        """Start a worker per non-empty shard, or per shard when reloading,
+        and supervise them until all have exited cleanly.
+        """
+        listener = logging.handlers.QueueListener(
+            self.log_queue, *logging.getLogger().handlers, respect_handler_level=True
+        )
+        listener.start()
+        # on SIGTERM stop the workers, letting them shut down cleanly
+        try:
+            previous = signal.signal(signal.SIGTERM, interrupt)
+        except ValueError:  # not the main thread
+            previous = None
+        try:
+            for shard, config in enumerate(self.configs):
+                if config["automatons"] or self.reloading:
+                    self.start(shard)
+            restarts_due = {}
+            next_summary = time.monotonic() + self.stats_interval
+            while any(process.exitcode != 0 for process in self.processes.values()):
+                time.sleep(0.5)
+                self.collect_stats()
+                now = time.monotonic()
+                for shard, process in self.processes.items():
+                    if process.exitcode not in (None, 0) and shard not in restarts_due:
+                        logger.error(
+                            "shard %s exited with code %s, restarting in %ss",
+                            shard,
+                            process.exitcode,
+                            self.restart_delay,
+                        )
+                        restarts_due[shard] = now + self.restart_delay
+                for shard, due in list(restarts_due.items()):
+                    if due <= now:
+                        del restarts_due[shard]
+                        self.restarts[shard] = self.restarts.get(shard, 0) + 1
+                        self.start(shard)
+                if now >= next_summary:
+                    logger.info("shard stats: %s", self.summary())
+                    next_summary = now + self.stats_interval
+            self.collect_stats()
+            logger.info("shard stats: %s", self.summary())
+        finally:
+            if previous is not None:
+                signal.signal(signal.SIGTERM, previous)
+            self.stop()
+            listener.stop()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+""" State backends persist BackoffStore entries. Keys are
+(automaton, action, bucket key) tuples and entries are
+[fired_at, seen_at, fingerprint, expires_at] lists.
+
+Backends are synchronous and called from a worker thread:
+- load()           : return all stored (key, entry) pairs
+- write(changes)   : apply {key: entry} changes, an entry of None deletes
+- close()          : release resources
+"""
+
+
+def encode_key(key: tuple) -> str:
+    return json.dumps(list(key))
+
+
+def decode_key(key) -> tuple:
+    if isinstance(key, bytes):
+        key = key.decode("utf-8")
+    return tuple(json.loads(key))
+
+
+class MemoryStateBackend:
+    """Keep no state beyond the process lifetime.
+    """
+
+    def load(self) -> list:
+        return []
+
+    def write(self, changes: dict):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStateBackend:
+    """Persist state to a local SQLite database in WAL mode, applying each
+    batch of changes in a single transaction.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS backoff ("
+            "key TEXT PRIMARY KEY, fired_at REAL, seen_at REAL, "
+            "fingerprint TEXT, expires_at REAL)"
+        )
+        self.db.commit()
+
+    def load(self) -> list:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT key, fired_at, seen_at, fingerprint, expires_at "
+                "FROM backoff ORDER BY seen_at"
+            ).fetchall()
+        return [(decode_key(row[0]), list(row[1:])) for row in rows]
+
+    def write(self, changes: dict):
+        upserts = [
+            (encode_key(key), *entry)
+            for key, entry in changes.items()
+            if entry is not None
+        ]
+        deletes = [
+            (encode_key(key),) for key, entry in changes.items() if entry is None
+        ]
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO backoff VALUES (?, ?, ?, ?, ?)", upserts
+            )
+            self.db.executemany("DELETE FROM backoff WHERE key = ?", deletes)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class FileStateBackend:
+    """Persist state to an append-only JSON lines file, one change per line.
+
+    Each batch is flushed and fsynced before write returns. The file is
+    compacted on load once it holds more than compact_ratio times as many
+    lines as live entries.
+    """
+
+    def __init__(self, path: str, compact_ratio: float = 2.0):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.log = None
+
+    def load(self) -> list:
+        entries, lines = {}, 0
+        if os.path.exists(self.path):
+            with open(self.path) as log:
+                for line in log:
+                    try:
+                        key, entry = json.loads(line)
+                    except ValueError:
+                        # torn final line from a crash mid-write
+                        continue
+                    lines += 1
+                    if entry is None:
+                        entries.pop(key, None)
+                    else:
+                        entries[key] = entry
+        if lines > self.compact_ratio * max(len(entries), 1):
+            partial = self.path + ".tmp"
+            with open(partial, "w") as log:
+                for key, entry in entries.items():
+                    log.write(json.dumps([key, entry]) + "\n")
+                log.flush()
+                os.fsync(log.fileno())
+            os.replace(partial, self.path)
+        return sorted(
+            ((decode_key(key), entry) for key, entry in entries.items()),
+            key=lambda item: item[1][1],
+        )
+
+    def write(self, changes: dict):
+        if self.log is None:
+            self.log = open(self.path, "a")
+        self.log.write(
+            "".join(
+                json.dumps([encode_key(key), entry]) + "\n"
+                for key, entry in changes.items()
+            )
+        )
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+
+class RedisStateBackend:
+    """Persist state to a single hash on a Redis-compatible server.
+
+    client needs the redis-py style synchronous methods hset(name,
+    mapping=...), hgetall(name) and hdel(name, *keys), as provided by
+    redis.Redis or LocalRedis.
+    """
+
+    def __init__(self, client, name: str = "automaton_engine:backoff"):
+        self.client = client
+        self.name = name
+
+    def load(self) -> list:
+        entries = [
+            (decode_key(key), json.loads(entry))
+            for key, entry in self.client.hgetall(self.name).items()
+        ]
+        return sorted(entries, key=lambda item: item[1][1])
+
+    def write(self, changes: dict):
+        upserts = {
+            encode_key(key): json.dumps(entry)
+            for key, entry in changes.items()
+            if entry is not None
+        }
+        deletes = [encode_key(key) for key, entry in changes.items() if entry is None]
+        if upserts:
+            self.client.hset(self.name, mapping=upserts)
+        if deletes:
+            self.client.hdel(self.name, *deletes)
+
+    def close(self):
+        pass
+
+
+class LocalRedis:
+    """In-process stand-in for the subset of the Redis API used by
+    RedisStateBackend.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+    def hset(self, name: str, key=None, value=None, mapping: dict = None) -> int:
+        with self.lock:
+            values = self.hashes.setdefault(name, {})
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = len([key for key in items if key not in values])
+            values.update(items)
+            return added
+
+    def hgetall(self, name: str) -> dict:
+        with self.lock:
+            return dict(self.hashes.get(name, {}))
+
+    def hdel(self, name: str, *keys) -> int:
+        with self.lock:
+            values = self.hashes.get(name, {})
+            return len([values.pop(key) for key in keys if key in values])
+
+
+def state_backend(backend: str = "memory", path: str = None, url: str = None):
+    """Create the state backend named by backend.
+
+        Args:
+            str:    backend (memory, sqlite, file or redis)
+            str:    path (sqlite database or file path)
+            str:    url (redis url, requires the redis package)
+        Returns:
+            state backend
+        Raises:
+            ValueError
+    """
+    if backend == "memory":
+        return MemoryStateBackend()
+    if backend == "sqlite":
+        return SQLiteStateBackend(path)
+    if backend == "file":
+        return FileStateBackend(path)
+    if backend == "redis":
+        import redis
+
+        return RedisStateBackend(redis.Redis.from_url(url))
+    raise ValueError("unknown state backend: {}".format(backend))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import multiprocessing
+from aiohttp import web
+from urllib.request import urlopen
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+""" fake service defaults
+- buckets    : buckets returned per elasticsearch query
+- es_latency : seconds elasticsearch takes to answer a query
+- latency    : seconds awx and rocketchat take to answer a request
+"""
+fake_defaults = {"buckets": 10, "es_latency": 0.0, "latency": 0.0}
+
+
+def counted(handler):
+    """Count requests answered by handler in the application's stats.
+    """
+
+    async def wrapper(request):
+        request.app["stats"]["requests"] += 1
+        return await handler(request)
+
+    return wrapper
+
+
+async def stats(request):
+    return web.json_response(request.app["stats"])
+
+
+def elasticsearch_app(buckets: int = 10, latency: float = 0.0) -> web.Application:
+    """Elasticsearch stand-in answering _search and _msearch with a terms
+    aggregation named after the query_name of each payload.
+
+    Bucket doc counts change with every query, so each poll presents
+    changed buckets to the automaton's actions.
+    """
+
+    def response(payload: dict, sequence: int) -> dict:
+        return {
+            "aggregations": {
+                payload.get("query_name", "bench"): {
+                    "buckets": [
+                        {"key": "bucket-{}".format(index), "doc_count": sequence}
+                        for index in range(buckets)
+                    ]
+                }
+            }
+        }
+
+    async def search(request):
+        payload = await request.json()
+        await asyncio.sleep(latency)
+        return web.json_response(response(payload, request.app["stats"]["requests"]))
+
+    async def msearch(request):
+        lines = (await request.text()).strip().split("\n")
+        await asyncio.sleep(latency)
+        sequence = request.app["stats"]["requests"]
+        return web.json_response(
+            {
+                "responses": [
+                    dict(response(json.loads(payload), sequence), status=200)
+                    for payload in lines[1::2]
+                ]
+            }
+        )
+
+    app = web.Application()
+    app["stats"] = {"requests": 0}
+    app.router.add_post("/_search", counted(search))
+    app.router.add_post("/_msearch", counted(msearch))
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def webhook_app(path: str, status: int, latency: float = 0.0) -> web.Application:
+    """AWX or RocketChat stand-in accepting posts to path with status.
+    """
+
+    async def post(request):
+        await request.read()
+        await asyncio.sleep(latency)
+        return web.json_response({}, status=status)
+
+    app = web.Application()
+    app["stats"] = {"requests": 0}
+    app.router.add_post(path, counted(post))
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def serve(options: dict, ready):
+    """Fake services process entrypoint, reports the service urls on ready
+    and serves until terminated.
+    """
+    options = dict(fake_defaults, **options)
+    apps = {
+        "elasticsearch": elasticsearch_app(options["buckets"], options["es_latency"]),
+        # awx answers job launches with 201 Created
+        "awx": webhook_app("/api/v2/job_templates/1/launch/", 201, options["latency"]),
+        "rocketchat": webhook_app("/hooks/bench", 200, options["latency"]),
+    }
+
+    async def start():
+        urls = {}
+        for name, app in apps.items():
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = runner.addresses[0][1]
+            urls[name] = "http://127.0.0.1:{}".format(port)
+        ready.put(urls)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(start())
+    loop.run_forever()
+
+
+class FakeServices:
+    """Run the fake elasticsearch, awx and rocketchat services in a child
+    process, so their cost is not measured against the engine.
+
+        with FakeServices(buckets=100) as services:
+            services.urls["elasticsearch"]
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.process = None
+        self.urls = {}
+
+    def __enter__(self):
+        ready = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve, args=(self.options, ready), daemon=True
+        )
+        self.process.start()
+        self.urls = ready.get(timeout=30)
+        return self
+
+    def stats(self) -> dict:
+        """Requests answered so far per service.
+        """
+        counts = {}
+        for name, url in self.urls.items():
+            with urlopen(url + "/stats") as response:
+                counts[name] = json.loads(response.read())["requests"]
+        return counts
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        self.process.join()
+        return False
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Drive automaton engines against local fake services and report
+throughput, latency and resource usage as JSON.
+
+    python -m benchmarks.loadtest --automatons 100 --buckets 50 \
+        --output results/$(git rev-parse --short HEAD).json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import logging
+
+from automaton_engine.runner import build_scheduler, serve
+from benchmarks.fakes import FakeServices
+
+logger = logging.getLogger(__name__)
+
+
+def b64(value: str) -> str:
+    return base64.b64encode(value.encode("utf-8")).decode("utf-8")
+
+
+def automaton_config(index: int, urls: dict, options) -> dict:
+    """Synthetic automaton querying the fake elasticsearch and firing both
+    actions for every changed bucket.
+    """
+    return {
+        "name": "bench-{}".format(index),
+        "enabled": True,
+        "runonce": False,
+        "elasticsearch": {"url": urls["elasticsearch"], "timeout": 10},
+        "elasticsearch_query": {
+            "query_interval": options.interval,
+            "query_endpoint": "/_search",
+            "query_type": "aggregations",
+            "query_name": "bench",
+            "query_payload": {"size": 0, "query_name": "bench"},
+            "query_response_mapping": {"key": "state", "doc_count": "rate"},
+        },
+        "actions": [
+            {
+                "name": "notify.rocketchat_webhook",
+                "backoff_seconds": 0,
+                "parameters": {
+                    "rocketchat_webhook": urls["rocketchat"] + "/hooks/bench",
+                    "rocketchat_message": "benchmark",
+                    "rocketchat_timeout": 10,
+                },
+            },
+            {
+                "name": "awx.api_call",
+                "backoff_seconds": 0,
+                "parameters": {
+                    "awx_url": urls["awx"],
+                    "awx_context": "/api/v2/job_templates/1/launch/",
+                    "awx_timeout": 10,
+                    "awx_auth": {"username": b64("bench"), "password": b64("bench")},
+                },
+            },
+        ],
+    }
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of values, None when there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q / 100.0 * len(ordered)), len(ordered) - 1)]
+
+
+def git_commit() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def measure(config: dict, duration: float) -> dict:
+    """Serve config for duration seconds, timing every poll.
+    """
+    scheduler, resources = build_scheduler(config)
+    latencies = []
+
+    def timed(poll):
+        async def wrapper():
+            start = time.perf_counter()
+            await poll()
+            latencies.append(time.perf_counter() - start)
+
+        return wrapper
+
+    for entry in scheduler.entries.values():
+        entry["engine"].Poll = timed(entry["engine"].Poll)
+    task = asyncio.ensure_future(serve(scheduler, resources))
+    await asyncio.sleep(duration)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return {
+        "polls": scheduler.polls,
+        "errors": scheduler.errors,
+        "latencies": latencies,
+    }
+
+
+def run(options) -> dict:
+    """Run a single benchmark.
+
+        Args:
+            argparse.Namespace:    options (see parser)
+        Returns:
+            dict:                  benchmark results
+    """
+    with FakeServices(
+        buckets=options.buckets,
+        es_latency=options.es_latency,
+        latency=options.action_latency,
+    ) as services:
+        config = {
+            "automatons": [
+                automaton_config(index, services.urls, options)
+                for index in range(options.automatons)
+            ],
+            "msearch": {"enabled": options.msearch},
+        }
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        cpu_before = time.process_time()
+        loop = asyncio.new_event_loop()
+        try:
+            measured = loop.run_until_complete(measure(config, options.duration))
+        finally:
+            loop.close()
+        cpu = time.process_time() - cpu_before
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        requests = services.stats()
+    actions = requests["awx"] + requests["rocketchat"]
+    latencies = measured["latencies"]
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "parameters": {
+            "automatons": options.automatons,
+            "buckets": options.buckets,
+            "interval": options.interval,
+            "duration": options.duration,
+            "es_latency": options.es_latency,
+            "action_latency": options.action_latency,
+            "msearch": options.msearch,
+        },
+        "results": {
+            "polls": measured["polls"],
+            "poll_errors": measured["errors"],
+            "polls_per_second": measured["polls"] / options.duration,
+            "queries": requests["elasticsearch"],
+            "actions": actions,
+            "actions_per_second": actions / options.duration,
+            "poll_latency_p50": percentile(latencies, 50),
+            "poll_latency_p99": percentile(latencies, 99),
+            "cpu_seconds": cpu,
+            "cpu_seconds_per_automaton": cpu / options.automatons,
+            # ru_maxrss is in kilobytes on linux
+            "max_rss_kb": rss,
+            "rss_kb_per_automaton": max(rss - rss_before, 0) / options.automatons,
+        },
+    }
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--automatons", type=int, default=10)
+    parser.add_argument("--buckets", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--es-latency", type=float, default=0.0)
+    parser.add_argument("--action-latency", type=float, default=0.0)
+    parser.add_argument("--msearch", action="store_true")
+    parser.add_argument("--output", help="also write results to this file")
+    return parser
+
+
+def main(argv=None):
+    logging.getLogger().setLevel(logging.WARNING)
+    options = parser().parse_args(argv)
+    results = run(options)
+    rendered = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as output:
+            output.write(rendered + "\n")
+    print(rendered)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -10,7 +10,7 @@ setup(
     author="Julian Gericke, LSD Information Technology",
     author_email="julian@lsd.co.za",
     url="https://github.com/jgericke/automaton_engine",
-    packages=find_packages(exclude=("tests", "tests.*")),
+    packages=find_packages(exclude=("tests", "tests.*", "benchmarks", "benchmarks.*")),
     entry_points={
         "console_scripts": ["automaton-engine = automaton_engine.runner:runner"]
     },
@@ -31,12 +31,13 @@ setup(
     setup_requires=["pytest-runner>=4.4"],
     tests_require=["pytest>=4.4.2", "pytest-asyncio>=0.10.0", "asynctest>=0.13.0"],
     extras_require={
+        "fast": ["orjson>=2.0.0", "numpy>=1.16.0", "uvloop>=0.14.0"],
         "dev": [
             "coverage>=4.5.3",
             "black>=19.3b0",
             "setuptools-black>=0.1.4",
             "flake8>=3.7.7",
             "pre-commit>=1.16.1",
-        ]
+        ],
     },
 )
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Action Queue Tests"""
+
+import pytest
+import asyncio
+import time
+
+from automaton_engine import engine as automaton_engine
+from automaton_engine.action_queue import (
+    ActionJob,
+    ActionQueue,
+    RateLimiter,
+    destination,
+    idempotency_key,
+)
+from automaton_engine.actions.common import BucketResult
+from automaton_engine.config import EngineConfig
+from automaton_engine.runner import Runtime, worker_config
+
+
+def job(*states, automaton="automaton"):
+    buckets = [{"state": state} for state in states]
+    return ActionJob(
+        automaton,
+        "awx.api_call",
+        "https://awx.local:443",
+        buckets,
+        [
+            idempotency_key(automaton, "awx.api_call", bucket, "state")
+            for bucket in buckets
+        ],
+        60,
+    )
+
+
+def queued_config(**sections):
+    return dict(
+        sections,
+        automatons=[
+            {
+                "name": "queued",
+                "enabled": True,
+                "runonce": True,
+                "elasticsearch": {"url": "http://es.loc:9200", "timeout": 1},
+                "elasticsearch_query": {
+                    "query_interval": 5,
+                    "query_endpoint": "/_search",
+                    "query_type": "aggregations",
+                    "query_name": "states",
+                    "query_payload": {},
+                    "query_response_mapping": {},
+                },
+                "actions": [
+                    {
+                        "name": "awx.api_call",
+                        "backoff_seconds": 60,
+                        "parameters": {"awx_url": "https://awx.local"},
+                    }
+                ],
+            }
+        ],
+    )
+
+
+class Handler(object):
+    """Records delivered buckets, failing each bucket fails times first"""
+
+    def __init__(self, fails=0):
+        self.fails = fails
+        self.attempts = {}
+        self.delivered = []
+
+    async def __call__(self, job):
+        results = []
+        for bucket in job.buckets:
+            attempt = self.attempts[bucket["state"]] = (
+                self.attempts.get(bucket["state"], 0) + 1
+            )
+            if attempt > self.fails:
+                self.delivered.append(bucket["state"])
+            results.append(BucketResult(bucket, attempt > self.fails, None))
+        return results
+
+
+class TestActionQueue(object):
+    def test_destination(self):
+        awx = {"name": "awx.api_call", "parameters": {"awx_url": "https://awx.local"}}
+        assert destination(awx) == "https://awx.local:443"
+        assert destination({"name": "custom", "parameters": {}}) == "custom"
+
+    @pytest.mark.asyncio
+    async def test_idempotent_delivery(self):
+        handler = Handler()
+        queue = ActionQueue(handler, workers=2)
+        await queue.start()
+        assert await queue.put(job("a", "b"))
+        assert not await queue.put(job("a", "b"))
+        await queue.join()
+        assert await queue.put(job("a", "c"))
+        await queue.join()
+        await queue.close()
+        assert sorted(handler.delivered) == ["a", "b", "c"]
+
+    @pytest.mark.asyncio
+    async def test_retries_and_give_up(self):
+        failures = []
+        handler = Handler(fails=1)
+        queue = ActionQueue(
+            handler,
+            max_attempts=2,
+            retry_delay=0.01,
+            on_failure=lambda job, buckets: failures.append(buckets),
+        )
+        await queue.start()
+        await queue.put(job("a"))
+        await asyncio.sleep(0.1)
+        assert handler.delivered == ["a"]
+
+        handler.fails = 5
+        await queue.put(job("b"))
+        await asyncio.sleep(0.1)
+        await queue.close()
+        assert handler.attempts["b"] == 2
+        assert failures == [[{"state": "b"}]]
+        assert queue.pending == set()
+
+    @pytest.mark.asyncio
+    async def test_handler_errors(self, tmp_path):
+        calls = []
+
+        async def handler(job):
+            calls.append(job.attempts)
+            raise ConnectionError("destination unavailable")
+
+        failures = []
+        queue = ActionQueue(
+            handler,
+            max_attempts=2,
+            retry_delay=0.01,
+            on_failure=lambda job, buckets: failures.append(buckets),
+        )
+        await queue.start()
+        await queue.put(job("a"))
+        await asyncio.sleep(0.1)
+        # a raising handler fails the job's buckets, retried then given up
+        assert calls == [0, 1]
+        assert failures == [[{"state": "a"}]]
+        assert queue.pending == set()
+        assert await queue.put(job("a"))
+        await queue.close()
+
+        async def partial(job):
+            return [BucketResult(job.buckets[0], True, None)]
+
+        failures = []
+        queue = ActionQueue(
+            partial,
+            max_attempts=1,
+            on_failure=lambda job, buckets: failures.append(buckets),
+        )
+        await queue.start()
+        await queue.put(job("c", "d"))
+        await queue.join()
+        # a bucket the handler returned no result for has failed
+        assert failures == [[{"state": "d"}]]
+        assert queue.pending == set()
+        assert await queue.put(job("d"))
+        await queue.close()
+
+        queue = ActionQueue(Handler(), path=str(tmp_path / "actions.db"))
+
+        def broken(*args):
+            raise OSError("disk full")
+
+        queue.journal.complete = broken
+        await queue.start()
+        await queue.put(job("b"))
+        await queue.join()
+        # keys of a job that failed outside the handler are released too
+        assert queue.pending == set()
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_backpressure(self):
+        queue = ActionQueue(Handler(), max_size=1, workers=0)
+        await queue.start()
+        await queue.put(job("a"))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.put(job("b")), 0.05)
+        await queue.close()
+
+    @pytest.mark.asyncio
+    async def test_rate_limiter(self):
+        limiter = RateLimiter(rate=50, burst=2)
+        start = time.monotonic()
+        for attempt in range(6):
+            await limiter.acquire()
+        assert time.monotonic() - start >= 0.07
+
+    @pytest.mark.asyncio
+    async def test_journal_redelivery(self, tmp_path):
+        path = str(tmp_path / "actions.db")
+        queue = ActionQueue(Handler(), path=path, workers=0)
+        await queue.start()
+        await queue.put(job("a", "b"))
+        await queue.close()
+
+        handler = Handler()
+        queue = ActionQueue(handler, path=path)
+        assert len(queue.restored) == 1
+        await queue.start()
+        await queue.join()
+        assert not await queue.put(job("a"))
+        await queue.close()
+        assert sorted(handler.delivered) == ["a", "b"]
+
+        assert ActionQueue(Handler(), path=path).restored == []
+
+
+class TestQueuedActions(object):
+    @pytest.mark.asyncio
+    async def test_runtime_action_queue(self, monkeypatch):
+        dispatched = []
+
+        async def api_call(action_parameters, action_metadata, session_manager=None):
+            dispatched.extend(action_metadata)
+            return [BucketResult(bucket, True, None) for bucket in action_metadata]
+
+        monkeypatch.setitem(
+            automaton_engine.action_dispatcher, "awx.api_call", api_call
+        )
+        runtime = Runtime(
+            EngineConfig.from_dict(
+                queued_config(action_queue={"enabled": True, "workers": 1})
+            )
+        )
+        await runtime.action_queue.start()
+        engine = runtime.engines["queued"]
+        assert await engine.ActionProcessor([{"key": "busy"}]) == [("awx.api_call", [])]
+        await runtime.action_queue.join()
+        assert dispatched == [{"key": "busy"}]
+        assert await engine.ActionProcessor([{"key": "busy"}]) == [("awx.api_call", [])]
+        await runtime.action_queue.join()
+        assert dispatched == [{"key": "busy"}]
+        await runtime.action_queue.close()
+        await runtime.session_manager.close()
+
+    @pytest.mark.asyncio
+    async def test_jobs_run_elsewhere_are_held(self, tmp_path):
+        path = str(tmp_path / "actions.db")
+        queue = ActionQueue(Handler(), path=path, workers=0)
+        await queue.start()
+        await queue.put(job("a", automaton="queued"))
+        await queue.put(job("b", automaton="removed"))
+        await queue.close()
+
+        # another shard runs "queued": its job is kept for that shard,
+        # the job of the removed automaton is dropped
+        runtime = Runtime(
+            EngineConfig.from_dict(
+                queued_config(
+                    action_queue={"enabled": True, "path": path, "retry_delay": 0.01}
+                )
+            ),
+            lambda name: False,
+        )
+        await runtime.action_queue.start()
+        await asyncio.sleep(0.05)
+        await runtime.action_queue.close()
+        await runtime.session_manager.close()
+        restored = ActionQueue(Handler(), path=path).restored
+        assert [(job.automaton, job.attempts) for job in restored] == [("queued", 0)]
+
+        shard = worker_config(2, {"action_queue": {"path": path}})
+        assert shard["action_queue"]["path"] == path + ".shard-2"
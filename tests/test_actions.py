@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Action Tests"""
+
+import pytest
+import asyncio
+
+from automaton_engine.actions.common import fan_out
+from automaton_engine.actions.notify import (
+    batch_chunks,
+    coalesce,
+    flush,
+    pending_batches,
+)
+
+
+class TestFanOut(object):
+    @pytest.mark.asyncio
+    async def test_fan_out_concurrency(self):
+        in_flight = []
+        peak = []
+
+        async def bucket_call(bucket):
+            in_flight.append(bucket)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(bucket)
+
+        results = await fan_out([{"key": i} for i in range(20)], bucket_call, 4)
+        assert len(results) == 20
+        assert all(result.success for result in results)
+        assert max(peak) == 4
+
+    @pytest.mark.asyncio
+    async def test_fan_out_failures(self):
+        async def bucket_call(bucket):
+            assert bucket["key"] % 2 == 0
+
+        results = await fan_out([{"key": i} for i in range(5)], bucket_call)
+        assert [result.success for result in results] == [
+            True,
+            False,
+            True,
+            False,
+            True,
+        ]
+        assert isinstance(results[1].error, AssertionError)
+        assert results[1].bucket == {"key": 1}
+        assert await fan_out([], bucket_call) == []
+
+
+class FakeResponse(object):
+    def __init__(self, status):
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeSession(object):
+    """Records posted payloads and answers with a fixed status"""
+
+    def __init__(self, status=200):
+        self.status = status
+        self.posts = []
+
+    def post(self, url, data=None, **kwargs):
+        self.posts.append((url, data))
+        return FakeResponse(self.status)
+
+
+class TestRocketchatBatching(object):
+    def test_batch_chunks(self):
+        entries = [("alert", {"key": i}) for i in range(3)] + [("other", {"key": 3})]
+        chunks = batch_chunks(entries)
+        assert len(chunks) == 1
+        assert chunks[0][0].count("alert") == 1
+        assert chunks[0][0].count("action metadata") == 4
+        assert chunks[0][1] == [0, 1, 2, 3]
+
+        chunks = batch_chunks(entries, max_chars=60)
+        assert len(chunks) > 1
+        assert all(text.startswith(("alert", "other")) for text, _ in chunks)
+        assert sum(len(indices) for _, indices in chunks) == 4
+
+    def test_batch_chunks_truncate_long_lines(self):
+        entries = [
+            ("alert", {"key": 0}),
+            ("alert", {"key": 1, "detail": "x" * 500}),
+            ("y" * 300, {"key": 2}),
+        ]
+        chunks = batch_chunks(entries, max_chars=100)
+        assert all(len(text) <= 100 for text, _ in chunks)
+        assert sum(len(indices) for _, indices in chunks) == 3
+        assert "'key': 1, 'detail': 'xxx" in chunks[1][0]
+        assert chunks[1][0].endswith("...")
+
+    @pytest.mark.asyncio
+    async def test_coalesce_window(self):
+        session = FakeSession()
+        action_parameters = {
+            "rocketchat_webhook": "https://rocket.local/hooks/mock-webhook",
+            "rocketchat_message": "mock alert",
+            "rocketchat_timeout": 1,
+            "rocketchat_batch": True,
+            "rocketchat_batch_window": 0.01,
+        }
+        results = await asyncio.gather(
+            coalesce(session, action_parameters, [{"key": 1}, {"key": 2}]),
+            coalesce(session, action_parameters, [{"key": 3}]),
+        )
+        assert len(session.posts) == 1
+        assert [len(result) for result in results] == [2, 1]
+        assert results[1][0].bucket == {"key": 3}
+        assert all(result.success for result in results[0] + results[1])
+        assert pending_batches == {}
+
+    @pytest.mark.asyncio
+    async def test_flush_pending_batches(self):
+        session = FakeSession()
+        action_parameters = {
+            "rocketchat_webhook": "https://rocket.local/hooks/mock-webhook",
+            "rocketchat_message": "mock alert",
+            "rocketchat_timeout": 1,
+            "rocketchat_batch": True,
+            "rocketchat_batch_window": 60,
+        }
+        pending = asyncio.ensure_future(
+            coalesce(session, action_parameters, [{"key": 1}])
+        )
+        await asyncio.sleep(0)
+        await asyncio.wait_for(flush(), 1)
+        assert len(session.posts) == 1
+        assert (await pending)[0].success
+        assert pending_batches == {}
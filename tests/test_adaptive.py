@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Adaptive Polling Tests"""
+
+import pytest
+import asyncio
+
+from automaton_engine import AutomatonEngine
+from automaton_engine import engine as engine_module
+from automaton_engine.adaptive import AdaptiveInterval, adaptive_settings
+from automaton_engine.config import AutomatonConfig, ConfigError
+from automaton_engine.scheduler import Scheduler
+
+
+def query(**adaptive):
+    return {
+        "query_interval": 10,
+        "query_endpoint": "/_search",
+        "query_type": "aggregations",
+        "query_name": "states",
+        "query_payload": {},
+        "query_response_mapping": {},
+        "adaptive": adaptive,
+    }
+
+
+def poll(adaptive, buckets, latency=0.1):
+    adaptive.observe(latency)
+    adaptive.count(buckets)
+    return adaptive.update()
+
+
+class TestAdaptiveInterval(object):
+    def test_settings(self):
+        settings = adaptive_settings(query())
+        assert settings["min_interval"] == 10
+        assert settings["max_interval"] == 100
+        assert adaptive_settings(dict(query(), adaptive=None))["max_interval"] == 100
+        assert adaptive_settings({"query_interval": 10}) is None
+        with pytest.raises(ValueError, match="min_interval must not exceed"):
+            adaptive_settings(query(min_interval=200))
+        with pytest.raises(ValueError, match="backoff_factor must be a positive"):
+            adaptive_settings(query(backoff_factor="2"))
+        automaton = {
+            "name": "adaptive",
+            "enabled": True,
+            "runonce": False,
+            "elasticsearch": {"url": "http://es.loc:9200", "timeout": 1},
+            "elasticsearch_query": query(backoff_factor=1),
+            "actions": [],
+        }
+        with pytest.raises(ConfigError, match="must exceed 1"):
+            AutomatonConfig.from_dict(automaton)
+
+    def test_activity(self):
+        adaptive = AdaptiveInterval(10, 1, 60)
+        assert adaptive.interval == 10
+        # quiet: back off exponentially up to max_interval
+        assert [poll(adaptive, 0) for _ in range(4)] == [20, 40, 60, 60]
+        # buckets appear: snap back to min_interval
+        assert poll(adaptive, 3) == 1
+        assert poll(adaptive, 0) == 2
+        assert poll(adaptive, 2) == 1
+        # steady or falling counts hold, rising counts snap back
+        adaptive.interval = 4
+        assert poll(adaptive, 2) == 4
+        assert poll(adaptive, 1) == 4
+        adaptive.interval = 4
+        assert poll(adaptive, 5) == 1
+
+    def test_pressure(self):
+        adaptive = AdaptiveInterval(10, 1, 60)
+        assert poll(adaptive, 5, latency=0.1) == 1
+        assert poll(adaptive, 6, latency=0.1) == 1
+        # a slow query backs off even though activity rose
+        assert poll(adaptive, 7, latency=0.5) == 2
+        assert poll(adaptive, 8, latency=0.1) == 1
+        # as does a failed poll, which does not count as quiet
+        adaptive.count(0)
+        assert adaptive.update(failed=True) == 2
+        assert poll(adaptive, 9) == 1
+        # polls answered from the query cache leave the latency alone
+        latency = adaptive.latency
+        adaptive.count(10)
+        assert adaptive.update() == 1
+        assert adaptive.latency == latency
+
+    def test_latency_floor(self):
+        adaptive = AdaptiveInterval(10, 1, 60)
+        assert poll(adaptive, 5, latency=0.001) == 1
+        # four times slower, but by milliseconds: jitter, not pressure
+        assert poll(adaptive, 6, latency=0.004) == 1
+        adaptive = AdaptiveInterval(10, 1, 60, latency_floor=0)
+        assert poll(adaptive, 5, latency=0.001) == 1
+        assert poll(adaptive, 6, latency=0.004) == 2
+        assert adaptive_settings(query(latency_floor=0))["latency_floor"] == 0
+        with pytest.raises(ValueError, match="latency_floor must be a positive"):
+            adaptive_settings(query(latency_floor=-1))
+
+
+class FakeEngine(object):
+    """Polls adaptively, through the intervals given"""
+
+    def __init__(self, name, intervals):
+        self.name = name
+        self.runonce = False
+        self.elasticsearch = {"url": "http://es.loc:9200"}
+        self.es_query = {"query_interval": intervals[0]}
+        self.adaptive = AdaptiveInterval(intervals[0], 0.01, 1)
+        self.intervals = list(intervals)
+        self.polls = []
+
+    def PollInterval(self):
+        return self.adaptive.interval
+
+    async def Poll(self):
+        self.polls.append(asyncio.get_event_loop().time())
+        self.adaptive.interval = self.intervals[min(len(self.polls), 3)]
+
+
+class TestAdaptivePolling(object):
+    @pytest.mark.asyncio
+    async def test_engine_poll(self, monkeypatch):
+        # every query takes exactly 0.1s as far as the engine can tell
+        clock = [0.0]
+        monkeypatch.setattr(engine_module.time, "perf_counter", lambda: clock[0])
+        automaton = AutomatonEngine(
+            "adaptive",
+            True,
+            False,
+            {"url": "http://es.loc:9200", "timeout": 1},
+            query(min_interval=1, max_interval=60),
+            [],
+        )
+        responses = [[], [{"key": "a", "doc_count": 1}]]
+
+        async def search_request(url, query_payload):
+            clock[0] += 0.1
+            return {"aggregations": {"states": {"buckets": responses.pop(0)}}}
+
+        automaton.SearchRequest = search_request
+        assert automaton.PollInterval() == 10
+        await automaton.Poll()
+        assert automaton.PollInterval() == 20
+        assert automaton.adaptive.latency == pytest.approx(0.1)
+        await automaton.Poll()
+        assert automaton.PollInterval() == 1
+
+        async def failing(url, query_payload):
+            raise ConnectionError("cluster unavailable")
+
+        automaton.SearchRequest = failing
+        with pytest.raises(ConnectionError):
+            await automaton.Poll()
+        assert automaton.PollInterval() == 2
+
+    @pytest.mark.asyncio
+    async def test_scheduler_follows_interval(self):
+        scheduler = Scheduler(spread=False)
+        engine = FakeEngine("adaptive", [0.02, 0.08, 0.02, 0.02])
+        scheduler.add(engine)
+        runner = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(0.2)
+        scheduler.remove(engine)
+        await runner
+        intervals = [b - a for a, b in zip(engine.polls, engine.polls[1:])]
+        assert len(intervals) >= 3
+        assert abs(intervals[0] - 0.08) < 0.02
+        assert all(abs(interval - 0.02) < 0.015 for interval in intervals[2:])
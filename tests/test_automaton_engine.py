@@ -136,10 +136,23 @@ class TestAutomatonEngine(object):
                 automaton_engine_defaults, queryresponse.pop("aggregations", None)
             )
 
+    def test_automaton_engine_bucketmapper(self, automaton_engine_defaults):
+        buckets = [
+            {"key": "test", "doc_count": 1},
+            {"key": "other", "doc_count": 2},
+            {"doc_count": 3, "key": "reordered", "extra": True},
+        ]
+        mapped = automaton_engine_defaults.BucketMapper(buckets)
+        assert not isinstance(mapped, list)
+        assert list(mapped) == [
+            {"automaton_query": "test", "hits": 1},
+            {"automaton_query": "other", "hits": 2},
+            {"hits": 3, "automaton_query": "reordered", "extra": True},
+        ]
+        assert len(automaton_engine_defaults.mapped_keys) == 2
+
     @pytest.mark.asyncio
     async def test_automaton_engine_actionprocessor(self, automaton_engine_defaults):
-        automaton_engine_defaults.actions[0]["executed"] = False
-        automaton_engine_defaults.actions[1]["executed"] = True
         with asynctest.mock.patch(
             "automaton_engine.AutomatonEngine.ActionProcessor",
             side_effect=None,
@@ -153,10 +166,13 @@ class TestAutomatonEngine(object):
                 automaton_engine_defaults, [{"automaton_query": "test", "hits": 1}]
             )
 
-        with pytest.raises(asyncio.TimeoutError):
-            await AutomatonEngine.ActionProcessor(
-                automaton_engine_defaults, [{"automaton_query": "test", "hits": 1}]
-            )
+        action_results = await AutomatonEngine.ActionProcessor(
+            automaton_engine_defaults, [{"automaton_query": "test", "hits": 1}]
+        )
+        assert action_results[0][0] == "notify.rocketchat_webhook"
+        assert action_results[0][1][0].success is False
+        assert action_results[1][0] == "awx.api_call"
+        assert len(automaton_engine_defaults.backoff_store.entries) == 0
 
         with pytest.raises(TypeError):
             await AutomatonEngine.ActionProcessor(automaton_engine_defaults, None)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine AWX Action Tests"""
+
+import pytest
+import asyncio
+import base64
+import json
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from automaton_engine.actions import awx
+from automaton_engine.session import SessionManager
+
+
+def encoded(value):
+    return base64.b64encode(value.encode("utf-8")).decode("utf-8")
+
+
+class AWXStandIn(object):
+    """Local AWX accepting job, workflow and bulk launches"""
+
+    def __init__(self, fail_after=None):
+        self.launches = []
+        self.fail_after = fail_after
+        app = web.Application()
+        app.router.add_post("/api/v2/job_templates/{id}/launch/", self.launch)
+        app.router.add_post("/api/v2/workflow_job_templates/{id}/launch/", self.launch)
+        app.router.add_post("/api/v2/bulk/job_launch/", self.launch)
+        self.server = TestServer(app)
+
+    async def launch(self, request):
+        assert request.headers["Authorization"] == "Basic " + encoded("awx:secret")
+        self.launches.append(
+            (
+                request.path,
+                json.loads(await request.read()),
+                asyncio.get_event_loop().time(),
+            )
+        )
+        if self.fail_after is not None and len(self.launches) > self.fail_after:
+            return web.json_response({}, status=400)
+        return web.json_response({"id": len(self.launches)}, status=201)
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.server.close()
+        awx.teardown()
+
+    def parameters(self, **parameters):
+        return dict(
+            {
+                "awx_url": str(self.server.make_url("")).rstrip("/"),
+                "awx_context": "/api/v2/job_templates/1/launch/",
+                "awx_timeout": 5,
+                "awx_auth": {"username": encoded("awx"), "password": encoded("secret")},
+            },
+            **parameters
+        )
+
+
+buckets = [{"key": "host-{}".format(index), "doc_count": index} for index in range(5)]
+
+
+class TestAWX(object):
+    def test_launch_batches(self):
+        parameters = {
+            "awx_context": "/api/v2/workflow_job_templates/3/launch/",
+            "awx_launch": "batch",
+            "awx_batch_size": 2,
+        }
+        batches = awx.launch_batches(parameters, buckets)
+        assert [len(chunk) for context, body, chunk in batches] == [2, 2, 1]
+        assert batches[0][1] == {"extra_vars": {"buckets": buckets[:2]}}
+
+        parameters = {"awx_launch": "bulk", "awx_job_template": 7}
+        ((context, body, chunk),) = awx.launch_batches(parameters, buckets)
+        assert context == "/api/v2/bulk/job_launch/"
+        assert body["jobs"][1] == {"unified_job_template": 7, "extra_vars": buckets[1]}
+        assert chunk == buckets
+
+        with pytest.raises(ValueError, match="awx_launch must be one of"):
+            awx.launch_batches({"awx_launch": "all"}, buckets)
+
+    def test_auth_decoded_once(self):
+        awx.awx_auth.cache_clear()
+        for _ in range(3):
+            auth = awx.awx_auth(encoded("awx"), encoded("secret"))
+        assert (auth.login, auth.password) == ("awx", "secret")
+        assert awx.awx_auth.cache_info().hits == 2
+
+    @pytest.mark.asyncio
+    async def test_launch_per_bucket(self):
+        async with AWXStandIn() as stand_in:
+            results = await awx.api_call(stand_in.parameters(), buckets)
+        assert len(stand_in.launches) == 5
+        assert all(result.success for result in results)
+        assert stand_in.launches[0][1] == {"extra_vars": buckets[0]}
+
+    @pytest.mark.asyncio
+    async def test_batch_launch(self):
+        session_manager = SessionManager()
+        async with AWXStandIn(fail_after=1) as stand_in:
+            results = await awx.api_call(
+                stand_in.parameters(
+                    awx_context="/api/v2/workflow_job_templates/3/launch/",
+                    awx_launch="batch",
+                    awx_batch_size=3,
+                    awx_batch_var="hosts",
+                ),
+                buckets,
+                session_manager=session_manager,
+            )
+        await session_manager.close()
+        assert len(stand_in.launches) == 2
+        assert stand_in.launches[1][1] == {"extra_vars": {"hosts": buckets[3:]}}
+        assert [result.bucket for result in results] == buckets
+        # a failed launch fails every bucket it carried
+        assert [result.success for result in results] == [True] * 3 + [False] * 2
+
+    @pytest.mark.asyncio
+    async def test_bulk_launch_rate(self):
+        async with AWXStandIn() as stand_in:
+            results = await awx.api_call(
+                stand_in.parameters(
+                    awx_launch="bulk",
+                    awx_job_template=7,
+                    awx_batch_size=1,
+                    awx_rate=20,
+                ),
+                buckets[:4],
+            )
+        assert all(result.success for result in results)
+        paths = {path for path, body, at in stand_in.launches}
+        assert paths == {"/api/v2/bulk/job_launch/"}
+        times = sorted(at for path, body, at in stand_in.launches)
+        # one launch at once, then one every 1 / awx_rate seconds
+        assert times[-1] - times[0] >= 0.14
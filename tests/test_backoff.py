@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Backoff Tests"""
+
+import pytest
+import asyncio
+import time
+
+from automaton_engine.backoff import BackoffStore, bucket_fingerprint
+from automaton_engine.state import LocalRedis, RedisStateBackend, state_backend
+
+
+def select(store, buckets, now, dedup_fields=None):
+    return store.select(
+        "automaton", "awx.api_call", buckets, "state", 60, 120, dedup_fields, now
+    )
+
+
+def record(store, buckets, now, dedup_fields=None):
+    store.record("automaton", "awx.api_call", buckets, "state", 120, dedup_fields, now)
+
+
+class TestBackoffStore(object):
+    def test_bucket_fingerprint(self):
+        assert bucket_fingerprint({"a": 1, "b": 2}) == bucket_fingerprint(
+            {"b": 2, "a": 1}
+        )
+        assert bucket_fingerprint({"a": 1, "b": 2}, ["a"]) == bucket_fingerprint(
+            {"a": 1, "b": 3}, ["a"]
+        )
+
+    def test_backoff_per_bucket(self):
+        store = BackoffStore()
+        busy = {"state": "busy", "hits": 5}
+        assert select(store, [busy], 0) == [busy]
+        record(store, [busy], 0)
+
+        new = {"state": "new", "hits": 1}
+        assert select(store, [busy, new], 10) == [new]
+        record(store, [new], 10)
+
+        assert select(store, [dict(busy, hits=6)], 30) == []
+        assert select(store, [busy], 90) == []
+        assert select(store, [dict(busy, hits=6)], 90) == [dict(busy, hits=6)]
+
+        store = BackoffStore()
+        record(store, [busy], 0, ["state"])
+        assert select(store, [dict(busy, hits=6)], 90, ["state"]) == []
+
+    def test_backoff_expiry_and_cap(self):
+        store = BackoffStore(max_entries=2)
+        buckets = [{"state": state} for state in "abc"]
+        record(store, buckets, 0)
+        assert len(store.entries) == 2
+        assert select(store, buckets, 1) == [{"state": "a"}]
+
+        assert select(store, [{"state": "c"}], 100) == []
+        assert select(store, [{"state": "b"}], 200) == [{"state": "b"}]
+        assert select(store, [{"state": "c"}], 200) == []
+        assert select(store, [{"state": "c"}], 400) == [{"state": "c"}]
+        assert len(store.entries) == 0
+
+
+@pytest.fixture(params=["sqlite", "file", "redis"])
+def state_backend_factory(request, tmp_path):
+    """Factory creating a fresh backend over the same persisted state"""
+    local_redis = LocalRedis()
+
+    def factory():
+        if request.param == "redis":
+            return RedisStateBackend(local_redis)
+        return state_backend(request.param, path=str(tmp_path / "state"))
+
+    yield factory
+
+
+class TestStateBackends(object):
+    def test_state_backend_round_trip(self, state_backend_factory):
+        backend = state_backend_factory()
+        backend.write(
+            {
+                ("automaton", "awx.api_call", "a"): [1.0, 2.0, "f1", 9e12],
+                ("automaton", "awx.api_call", "b"): [1.0, 1.0, "f2", 9e12],
+            }
+        )
+        backend.write({("automaton", "awx.api_call", "a"): None})
+        backend.write({("automaton", "awx.api_call", "c"): [3.0, 3.0, "f3", 9e12]})
+        backend.close()
+
+        entries = state_backend_factory().load()
+        assert entries == [
+            (("automaton", "awx.api_call", "b"), [1.0, 1.0, "f2", 9e12]),
+            (("automaton", "awx.api_call", "c"), [3.0, 3.0, "f3", 9e12]),
+        ]
+
+    def test_unknown_state_backend(self):
+        with pytest.raises(ValueError):
+            state_backend("etcd")
+
+    @pytest.mark.asyncio
+    async def test_backoff_store_warm_start(self, tmp_path):
+        path = str(tmp_path / "backoff.db")
+        store = BackoffStore(backend="sqlite", path=path, flush_interval=0.01)
+        record(store, [{"state": "busy"}], time.time())
+        await asyncio.sleep(0.05)
+        assert store.changes == {}
+        record(store, [{"state": "idle"}], time.time())
+        await store.close()
+
+        restored = BackoffStore(backend="sqlite", path=path)
+        assert len(restored.entries) == 2
+        assert select(restored, [{"state": "busy"}], time.time()) == []
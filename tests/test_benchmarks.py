@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Benchmark Harness Tests"""
+
+import json
+
+from benchmarks.loadtest import main, parser, percentile, run
+
+
+class TestBenchmarks(object):
+    def test_percentile(self):
+        assert percentile([], 50) is None
+        assert percentile([3, 1, 2, 4], 50) == 3
+        assert percentile(list(range(100)), 99) == 99
+
+    def test_loadtest(self, tmp_path):
+        results = run(
+            parser().parse_args(
+                ["--automatons", "3", "--buckets", "2", "--interval", "0.2"]
+                + ["--duration", "1", "--msearch"]
+            )
+        )["results"]
+        assert results["polls"] > 0
+        assert results["poll_errors"] == 0
+        assert results["queries"] > 0
+        # both actions fire for every changed bucket
+        assert results["actions"] >= results["polls"] * 2 * 2
+        assert results["poll_latency_p50"] <= results["poll_latency_p99"]
+
+    def test_loadtest_output(self, tmp_path):
+        output = tmp_path / "results.json"
+        main(["--automatons", "1", "--duration", "0.5", "--output", str(output)])
+        assert json.loads(output.read_text())["parameters"]["automatons"] == 1
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Bucket Batch Tests"""
+
+import pytest
+import json
+import tracemalloc
+
+from automaton_engine import AutomatonEngine
+from automaton_engine.actions.registry import ActionRegistry
+from automaton_engine.backoff import BackoffStore, bucket_fingerprint
+from automaton_engine.buckets import (
+    Bucket,
+    BucketBatch,
+    as_dicts,
+    column,
+    layout_index,
+)
+from automaton_engine.predicate import Predicate
+
+
+def engine(actions=(), **kwargs):
+    return AutomatonEngine(
+        "compact",
+        True,
+        True,
+        {"url": "http://es.loc:9200", "timeout": 1},
+        {
+            "query_interval": 5,
+            "query_endpoint": "/_search",
+            "query_type": "aggregations",
+            "query_name": "hosts",
+            "query_payload": {},
+            "query_response_mapping": {"key": "host", "doc_count": "events"},
+        },
+        list(actions),
+        **kwargs
+    )
+
+
+def response(*buckets):
+    return {"aggregations": {"hosts": {"buckets": list(buckets)}}}
+
+
+class TestBuckets(object):
+    def test_bucket_mapping(self):
+        bucket = Bucket(layout_index(["host", "events", "host"]), ("a", 3, "b"))
+        assert bucket == {"host": "b", "events": 3}
+        assert [bucket] == [{"host": "b", "events": 3}]
+        assert bucket["events"] == 3
+        assert bucket.get("missing", 0) == 0
+        assert "host" in bucket and len(bucket) == 2
+        assert list(bucket.items()) == [("host", "b"), ("events", 3)]
+        assert json.dumps(bucket.to_dict()) == '{"host": "b", "events": 3}'
+        with pytest.raises(KeyError):
+            bucket["missing"]
+        with pytest.raises(TypeError):
+            bucket["host"] = "c"
+
+    def test_column(self):
+        short, long = layout_index(["host"]), layout_index(["events", "host"])
+        batch = BucketBatch(
+            [Bucket(short, ("a",)), Bucket(long, (1, "b")), {"host": "c"}]
+        )
+        assert batch.column("host") == ["a", "b", "c"]
+        assert batch.column("events", 0) == [0, 1, 0]
+        assert column([{"host": "d"}], "host") == ["d"]
+        assert as_dicts(batch) == [
+            {"host": "a"},
+            {"events": 1, "host": "b"},
+            {"host": "c"},
+        ]
+        assert all(type(bucket) is dict for bucket in as_dicts(batch))
+
+    def test_compact(self):
+        buckets = [
+            {"key": "host-{}".format(index), "doc_count": index, "load": {"value": 1}}
+            for index in range(2000)
+        ]
+        automaton = engine()
+        query_response = response(*buckets)
+        tracemalloc.start()
+        mapped = automaton.ResponseMapper(query_response)
+        compact = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+        dicts = as_dicts(mapped)
+        expanded = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert isinstance(mapped, BucketBatch)
+        assert mapped == dicts
+        assert compact < expanded * 0.8
+        assert bucket_fingerprint(mapped[5]) == bucket_fingerprint(dicts[5])
+
+
+class TestBucketPipeline(object):
+    def test_predicate_and_backoff_keep_batches(self):
+        automaton = engine()
+        mapped = automaton.ResponseMapper(
+            response({"key": "a", "doc_count": 5}, {"key": "b", "doc_count": 1})
+        )
+        matched = Predicate("events > 2", "host").filter(mapped)
+        assert isinstance(matched, BucketBatch) and matched == [
+            {"host": "a", "events": 5}
+        ]
+        store = BackoffStore()
+        selected = store.select("compact", "log", mapped, "host", 60, 60)
+        assert isinstance(selected, BucketBatch) and selected == mapped
+        store.record("compact", "log", as_dicts(selected[:1]), "host", 60)
+        assert store.select("compact", "log", mapped, "host", 60, 60) == mapped[1:]
+
+    @pytest.mark.asyncio
+    async def test_actions_receive_dicts(self):
+        received = []
+
+        async def log(parameters, buckets, session_manager=None):
+            received.append((parameters, buckets))
+            return []
+
+        registry = ActionRegistry()
+        registry["log"] = log
+        action = {"name": "log", "parameters": {"level": "info"}, "backoff_seconds": 60}
+        automaton = engine(
+            [action, dict(action, dedup_ttl_seconds=5)], action_registry=registry
+        )
+        assert [spec.action_id for spec in automaton.action_specs] == ["log#0", "log#1"]
+        assert automaton.action_specs[1].ttl == 5
+        with pytest.raises(AttributeError):
+            automaton.action_specs[0].extra = True
+
+        await automaton.ResponseProcessor(response({"key": "a", "doc_count": 5}))
+        assert [parameters for parameters, buckets in received] == [
+            {"level": "info"}
+        ] * 2
+        assert received[0][1] == [{"host": "a", "events": 5}]
+        assert type(received[0][1][0]) is dict
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Configuration Tests"""
+
+import pytest
+import asyncio
+import json
+import os
+
+from automaton_engine.config import (
+    ConfigError,
+    ConfigWatcher,
+    EngineConfig,
+    load_config,
+)
+from automaton_engine.runner import ConfigReloader, Runtime
+
+
+def automaton(name, interval=5):
+    return {
+        "name": name,
+        "enabled": True,
+        "runonce": False,
+        "elasticsearch": {"url": "http://es.loc:9200", "timeout": 10},
+        "elasticsearch_query": {
+            "query_interval": interval,
+            "query_endpoint": "/_search",
+            "query_type": "aggregations",
+            "query_name": "states",
+            "query_payload": {},
+            "query_response_mapping": {},
+        },
+        "actions": [{"name": "awx.api_call", "backoff_seconds": 60, "parameters": {}}],
+    }
+
+
+def write(path, document):
+    with open(path, "w") as config_file:
+        json.dump(document, config_file)
+
+
+class TestConfig(object):
+    def test_engine_config_validation(self):
+        config = EngineConfig.from_dict(
+            {"automatons": [automaton("a")], "http": {"limit": 5}}
+        )
+        assert config.automatons[0].name == "a"
+        assert config.automatons[0].parallel_actions is False
+        assert config.section("http") == {"limit": 5}
+        assert config.section("scheduler") == {}
+        assert EngineConfig.from_dict(config.to_dict()) == config
+
+        broken = automaton("broken")
+        del broken["elasticsearch_query"]["query_name"]
+        with pytest.raises(ConfigError, match="broken elasticsearch_query: missing"):
+            EngineConfig.from_dict({"automatons": [broken]})
+        with pytest.raises(ConfigError, match="duplicate automaton names: a"):
+            EngineConfig.from_dict({"automatons": [automaton("a"), automaton("a")]})
+        with pytest.raises(ConfigError, match="section http must be a mapping"):
+            EngineConfig.from_dict({"automatons": [], "http": 5})
+
+    def test_load_config_directory(self, tmp_path):
+        write(
+            str(tmp_path / "00-engine.json"),
+            {"automatons": [automaton("a")], "http": {"limit": 5}},
+        )
+        write(str(tmp_path / "10-b.json"), automaton("b"))
+        write(str(tmp_path / "20-cd.json"), [automaton("c"), automaton("d")])
+        (tmp_path / "notes.txt").write_text("ignored")
+        (tmp_path / "30-e.json").write_text(
+            repr(dict(automaton("e"), enabled=True, runonce=False))
+        )
+        config = load_config(str(tmp_path))
+        assert [a.name for a in config.automatons] == ["a", "b", "c", "d", "e"]
+        assert config.section("http") == {"limit": 5}
+
+        (tmp_path / "40-broken.json").write_text("{not json")
+        with pytest.raises(ConfigError, match="unable to parse"):
+            load_config(str(tmp_path))
+
+    def test_config_watcher(self, tmp_path):
+        path = str(tmp_path / "engine.json")
+        write(path, {"automatons": [automaton("a")]})
+        watcher = ConfigWatcher(path)
+        watcher.load()
+        assert not watcher.changed()
+        write(path, {"automatons": [automaton("a"), automaton("b")]})
+        os.utime(path, ns=(0, 0))
+        assert watcher.changed()
+        assert len(watcher.load().automatons) == 2
+        assert not watcher.changed()
+
+
+class TestRuntime(object):
+    @pytest.mark.asyncio
+    async def test_runtime_apply(self):
+        runtime = Runtime(
+            EngineConfig.from_dict({"automatons": [automaton("a"), automaton("b")]})
+        )
+        engine_a = runtime.engines["a"]
+        engine_b = runtime.engines["b"]
+        assert len(runtime.scheduler.entries) == 2
+
+        added, removed, changed = runtime.apply(
+            EngineConfig.from_dict(
+                {"automatons": [automaton("a"), automaton("b", 10), automaton("c")]}
+            )
+        )
+        assert (added, removed, changed) == (["c"], [], ["b"])
+        assert runtime.engines["a"] is engine_a
+        assert runtime.engines["b"] is not engine_b
+        assert runtime.engines["b"].es_query["query_interval"] == 10
+        assert runtime.engines["b"].backoff_store is engine_a.backoff_store
+
+        added, removed, changed = runtime.apply(
+            EngineConfig.from_dict({"automatons": []})
+        )
+        assert sorted(removed) == ["a", "b", "c"]
+        assert runtime.scheduler.entries == {}
+        await runtime.session_manager.close()
+
+    @pytest.mark.asyncio
+    async def test_config_reloader(self, tmp_path):
+        path = str(tmp_path / "engine.json")
+        write(path, {"automatons": [automaton("a")]})
+        watcher = ConfigWatcher(path, interval=0.01)
+        runtime = Runtime(watcher.load(), select=lambda name: name != "skipped")
+        reloader = ConfigReloader(runtime, watcher)
+        await reloader.start()
+        assert runtime.scheduler.persistent
+
+        write(path, {"automatons": [automaton("b"), automaton("skipped")]})
+        os.utime(path, ns=(0, 0))
+        await asyncio.sleep(0.1)
+        assert sorted(runtime.engines) == ["b"]
+
+        (tmp_path / "engine.json").write_text("{not json")
+        await asyncio.sleep(0.1)
+        assert sorted(runtime.engines) == ["b"]
+        await reloader.close()
+        await runtime.session_manager.close()
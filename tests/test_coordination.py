@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Replica Coordination Tests"""
+
+import pytest
+import asyncio
+import os
+import signal
+import time
+
+from automaton_engine.config import EngineConfig
+from automaton_engine.coordination import (
+    LeaseCoordinator,
+    MemoryLeaseStore,
+    SQLiteLeaseStore,
+    lease_store,
+)
+from automaton_engine.runner import (
+    Runtime,
+    build_scheduler,
+    run_until_stopped,
+    serve,
+    worker_config,
+)
+from automaton_engine.sharding import HashRing, shard_config
+
+
+def automaton(name):
+    return {
+        "name": name,
+        "enabled": True,
+        "runonce": False,
+        "elasticsearch": {"url": "http://es.loc:9200", "timeout": 10},
+        "elasticsearch_query": {
+            "query_interval": 5,
+            "query_endpoint": "/_search",
+            "query_type": "aggregations",
+            "query_name": "states",
+            "query_payload": {},
+            "query_response_mapping": {},
+        },
+        "actions": [],
+    }
+
+
+names = ["automaton-{}".format(index) for index in range(20)]
+config = {"automatons": [automaton(name) for name in names]}
+
+
+def replica(store, replica_id, lease_ttl=15.0):
+    runtime = Runtime(EngineConfig.from_dict(config))
+    coordinator = LeaseCoordinator(runtime, store, replica_id, lease_ttl)
+    return runtime, coordinator
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    store = lease_store(request.param, str(tmp_path / "leases.db"))
+    yield store
+    store.close()
+
+
+class TestLeaseStores(object):
+    def test_factory(self, tmp_path):
+        assert isinstance(lease_store(), MemoryLeaseStore)
+        sqlite = lease_store("sqlite", str(tmp_path / "leases.db"))
+        assert isinstance(sqlite, SQLiteLeaseStore)
+        sqlite.close()
+        with pytest.raises(ValueError, match="unknown lease store"):
+            lease_store("zookeeper")
+
+    def test_leases(self, store):
+        assert store.acquire(["a", "b"], "r1", 10) == ["a", "b"]
+        assert store.acquire(["b", "c"], "r2", 10) == ["c"]
+        # renewing a held lease succeeds
+        assert store.acquire(["a"], "r1", 10) == ["a"]
+        store.release(["b", "c"], "r1")
+        assert store.acquire(["b"], "r2", 10) == ["b"]
+        assert store.acquire(["b", "c"], "r1", 10) == []
+
+    def test_expiry(self, store):
+        assert store.acquire(["a"], "r1", 0.05) == ["a"]
+        assert store.acquire(["a"], "r2", 10) == []
+        time.sleep(0.1)
+        assert store.acquire(["a"], "r2", 10) == ["a"]
+
+    def test_members(self, store):
+        assert store.heartbeat("r2", 10) == ["r2"]
+        assert store.heartbeat("r1", 0.05) == ["r1", "r2"]
+        time.sleep(0.1)
+        assert store.heartbeat("r2", 10) == ["r2"]
+        store.leave("r2")
+        assert store.heartbeat("r3", 10) == ["r3"]
+
+
+class TestLeaseCoordinator(object):
+    @pytest.mark.asyncio
+    async def test_partition(self):
+        store = MemoryLeaseStore()
+        first, first_coordinator = replica(store, "r1")
+        await first_coordinator.start()
+        assert sorted(first.engines) == sorted(names)
+
+        second, second_coordinator = replica(store, "r2")
+        await second_coordinator.start()
+        # r1 still holds the leases r2 is assigned until it renews
+        assert second.engines == {}
+        await first_coordinator.renew()
+        await second_coordinator.renew()
+        assert first.engines and second.engines
+        assert not set(first.engines) & set(second.engines)
+        assert sorted(list(first.engines) + list(second.engines)) == sorted(names)
+
+        await second_coordinator.close()
+        assert second.engines == {}
+        await first_coordinator.renew()
+        assert sorted(first.engines) == sorted(names)
+        await first_coordinator.close()
+        await first.session_manager.close()
+        await second.session_manager.close()
+
+    @pytest.mark.asyncio
+    async def test_failover(self):
+        store = MemoryLeaseStore()
+        first, first_coordinator = replica(store, "r1", lease_ttl=0.1)
+        second, second_coordinator = replica(store, "r2", lease_ttl=0.1)
+        await first_coordinator.start()
+        await second_coordinator.start()
+        await asyncio.sleep(0.1)
+        assert first.engines and second.engines
+
+        # r2 stops renewing without releasing its leases
+        second_coordinator.task.cancel()
+        await asyncio.sleep(0.3)
+        assert sorted(first.engines) == sorted(names)
+        await first_coordinator.close()
+        await first.session_manager.close()
+        await second.session_manager.close()
+
+    @pytest.mark.asyncio
+    async def test_store_failure(self):
+        store = MemoryLeaseStore()
+        runtime, coordinator = replica(store, "r1", lease_ttl=0.1)
+        await coordinator.start()
+        assert sorted(runtime.engines) == sorted(names)
+
+        def unavailable(*args):
+            raise ConnectionError("store unavailable")
+
+        store.heartbeat = unavailable
+        await asyncio.sleep(0.2)
+        # leases have expired, so the automatons are no longer run
+        assert runtime.engines == {}
+        await coordinator.close()
+        await runtime.session_manager.close()
+
+    @pytest.mark.asyncio
+    async def test_runtime_section(self, tmp_path):
+        runtime = Runtime(
+            EngineConfig.from_dict(
+                dict(
+                    config,
+                    coordination={
+                        "enabled": True,
+                        "store": "sqlite",
+                        "path": str(tmp_path / "leases.db"),
+                        "replica_id": "r1",
+                    },
+                )
+            )
+        )
+        assert runtime.resources[0] is runtime.coordinator
+        assert runtime.engines == {}
+        await runtime.coordinator.start()
+        assert sorted(runtime.engines) == sorted(names)
+        await runtime.coordinator.close()
+        await runtime.session_manager.close()
+
+    @pytest.mark.asyncio
+    async def test_sharded_replicas(self, tmp_path):
+        coordination = {
+            "enabled": True,
+            "store": "sqlite",
+            "path": str(tmp_path / "leases.db"),
+        }
+        ring = HashRing(4)
+        workers = []
+        for replica in ("a", "b"):
+            for shard, shard_dict in enumerate(shard_config(dict(config), 4)):
+                # each worker process has its own id, as with hostname-pid
+                shard_dict["coordination"] = dict(
+                    coordination, replica_id="{}{}".format(replica, shard)
+                )
+                runtime = Runtime(
+                    EngineConfig.from_dict(worker_config(shard, shard_dict)),
+                    lambda name, shard=shard: ring.shard(name) == shard,
+                )
+                await runtime.coordinator.start()
+                workers.append(runtime)
+        for runtime in workers:
+            await runtime.coordinator.renew()
+        running = [name for runtime in workers for name in runtime.engines]
+        # every automaton runs exactly once, on one of its shard's workers
+        assert sorted(running) == sorted(names)
+        assert workers[0].coordinator.members == ["shard-0/a0", "shard-0/b0"]
+        with pytest.raises(ValueError, match="must not contain"):
+            LeaseCoordinator(workers[0], MemoryLeaseStore(), "shard-0/a")
+        for runtime in workers:
+            await runtime.coordinator.close()
+            await runtime.session_manager.close()
+
+    @pytest.mark.skipif(not hasattr(signal, "SIGTERM"), reason="posix signals")
+    def test_sigterm_releases_leases(self, tmp_path):
+        coordination = {
+            "enabled": True,
+            "store": "sqlite",
+            "path": str(tmp_path / "leases.db"),
+            "replica_id": "r1",
+            "lease_ttl": 60,
+        }
+        scheduler, resources = build_scheduler(dict(config, coordination=coordination))
+        loop = asyncio.new_event_loop()
+        try:
+            loop.call_later(0.2, os.kill, os.getpid(), signal.SIGTERM)
+            run_until_stopped(loop, serve(scheduler, resources))
+        finally:
+            loop.close()
+        # the leases were released rather than left to expire
+        store = lease_store("sqlite", coordination["path"])
+        assert sorted(store.acquire(names, "r2", 10)) == sorted(names)
+        store.close()
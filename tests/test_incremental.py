@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Incremental Query Tests"""
+
+import pytest
+import asyncio
+import threading
+from unittest.mock import patch
+
+from automaton_engine.incremental import (
+    IncrementalQuery,
+    WatermarkStore,
+    find_range,
+    parse_window,
+)
+
+
+@pytest.fixture()
+def es_query_defaults():
+    """Test defaults for an incremental elasticsearch query"""
+    yield {
+        "query_interval": 10,
+        "query_endpoint": "/_search",
+        "query_type": "aggregations",
+        "query_name": "order_qty",
+        "incremental": {"timestamp_field": "@timestamp"},
+        "query_payload": {
+            "size": 0,
+            "query": {
+                "bool": {"filter": [{"range": {"@timestamp": {"gte": "now-1m"}}}]}
+            },
+            "aggregations": {
+                "order_qty": {"terms": {"field": "tags.keyword", "min_doc_count": 3}}
+            },
+        },
+    }
+
+
+def es_response(*buckets):
+    return {
+        "aggregations": {
+            "order_qty": {
+                "buckets": [{"key": key, "doc_count": count} for key, count in buckets]
+            }
+        }
+    }
+
+
+class TestIncremental(object):
+    def test_parse_window(self):
+        assert parse_window("now-1m") == 60
+        assert parse_window("15s") == 15
+        assert parse_window("now-2h") == 7200
+        with pytest.raises(ValueError):
+            parse_window("now/d")
+
+    def test_find_range(self, es_query_defaults):
+        assert find_range(es_query_defaults["query_payload"], "@timestamp") == {
+            "gte": "now-1m"
+        }
+        assert find_range(es_query_defaults["query_payload"], "created") is None
+
+    def test_incremental_prepare(self, es_query_defaults):
+        incremental = IncrementalQuery("order_scaler", es_query_defaults)
+        assert incremental.window == 60
+        assert incremental.min_doc_count == 3
+        with patch("time.time", return_value=1000.0):
+            payload, now = incremental.prepare()
+        assert now == 1000000
+        assert find_range(payload, "@timestamp") == {
+            "gte": 940000,
+            "lt": 1000000,
+            "format": "epoch_millis",
+        }
+        assert payload["aggregations"]["order_qty"]["terms"]["min_doc_count"] == 1
+        assert find_range(es_query_defaults["query_payload"], "@timestamp") == {
+            "gte": "now-1m"
+        }
+
+    def test_incremental_merge(self, es_query_defaults, tmp_path):
+        store = WatermarkStore(str(tmp_path / "watermarks.json"), flush_interval=0)
+        incremental = IncrementalQuery("order_scaler", es_query_defaults, store)
+        with patch("time.time", return_value=1000.0):
+            payload, now = incremental.prepare()
+        merged = incremental.merge(es_response(("a", 2), ("b", 6)), now)
+        assert merged["aggregations"]["order_qty"]["buckets"] == [
+            {"key": "b", "doc_count": 6}
+        ]
+
+        with patch("time.time", return_value=1010.0):
+            payload, now = incremental.prepare()
+        assert find_range(payload, "@timestamp")["gte"] == 1000000
+        merged = incremental.merge(es_response(("a", 2)), now)
+        buckets = merged["aggregations"]["order_qty"]["buckets"]
+        assert {bucket["key"]: bucket["doc_count"] for bucket in buckets} == {
+            "a": 4,
+            "b": 5,
+        }
+
+        restored = IncrementalQuery(
+            "order_scaler", es_query_defaults, WatermarkStore(store.path)
+        )
+        assert restored.watermark == 1010000
+        assert len(restored.slices) == 2
+
+    @pytest.mark.asyncio
+    async def test_checkpoints_batched_off_loop(self, es_query_defaults, tmp_path):
+        store = WatermarkStore(str(tmp_path / "watermarks.json"), flush_interval=0.05)
+        incremental = IncrementalQuery("order_scaler", es_query_defaults, store)
+        writes = []
+        write = store.write
+
+        def recording_write(snapshot):
+            writes.append(threading.get_ident())
+            write(snapshot)
+
+        store.write = recording_write
+        for second in range(5):
+            with patch("time.time", return_value=1000.0 + second):
+                payload, now = incremental.prepare()
+            incremental.merge(es_response(("a", 2)), now)
+        # saves within a flush_interval are written once, off the loop thread
+        assert writes == []
+        await asyncio.sleep(0.1)
+        assert len(writes) == 1 and writes[0] != threading.get_ident()
+        assert WatermarkStore(store.path).load("order_scaler")["watermark"] == now
+        with patch("time.time", return_value=1010.0):
+            payload, now = incremental.prepare()
+        incremental.merge(es_response(("a", 2)), now)
+        await store.close()
+        assert len(writes) == 2
+        assert WatermarkStore(store.path).load("order_scaler")["watermark"] == now
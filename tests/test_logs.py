@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Logging Tests"""
+
+import io
+import json
+import logging
+import queue
+
+from automaton_engine.logs import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    RateLimitFilter,
+    setup_logging,
+    stop_listener,
+)
+
+
+def record(msg, *args, created=0.0, level=logging.INFO, **extra):
+    entry = logging.LogRecord(
+        "automaton_engine.test", level, __file__, 1, msg, args, None
+    )
+    entry.created = created
+    entry.__dict__.update(extra)
+    return entry
+
+
+class Unformattable(object):
+    """Fails the test if a record is ever formatted"""
+
+    def __str__(self):
+        raise AssertionError("formatted on the calling thread")
+
+
+class TestLogs(object):
+    def test_json_formatter(self):
+        document = json.loads(
+            JsonFormatter().format(record("%s buckets", 3, automaton="a"))
+        )
+        assert document["message"] == "3 buckets"
+        assert document["level"] == "INFO"
+        assert document["logger"] == "automaton_engine.test"
+        assert document["automaton"] == "a"
+
+    def test_rate_limit(self):
+        limit = RateLimitFilter(burst=2, interval=1.0)
+        passed = [
+            limit.filter(record("sent %s", bucket, created=bucket * 0.1))
+            for bucket in range(5)
+        ]
+        assert passed == [True, True, False, False, False]
+        assert limit.filter(record("other %s", 1, created=0.5))
+        assert limit.filter(record("sent %s", 1, created=0.5, level=logging.ERROR))
+
+        later = record("sent %s", 9, created=1.5)
+        assert limit.filter(later)
+        assert later.suppressed == 3
+        assert later.getMessage() == "sent 9 [3 similar messages suppressed]"
+
+    def test_queue_handler_drops(self):
+        log_queue = queue.Queue(2)
+        handler = NonBlockingQueueHandler(log_queue)
+        for index in range(4):
+            handler.handle(record("message %s", Unformattable()))
+        assert handler.dropped == 2
+        log_queue.get_nowait()
+        log_queue.get_nowait()
+        handler.handle(record("message %s", 5))
+        dropped = log_queue.get_nowait()
+        assert dropped.getMessage() == "dropped 2 log records, log queue full"
+        assert log_queue.get_nowait().getMessage() == "message 5"
+        assert handler.dropped == 0
+
+    def test_setup_logging(self):
+        stream = io.StringIO()
+        root = logging.getLogger()
+        level, handlers = root.level, list(root.handlers)
+        listener = setup_logging("DEBUG", json_output=True, stream=stream)
+        try:
+            logging.getLogger("automaton_engine.test").info("poll %s", "done")
+        finally:
+            stop_listener(listener)
+            for handler in root.handlers:
+                if handler not in handlers:
+                    root.removeHandler(handler)
+            root.setLevel(level)
+        assert json.loads(stream.getvalue())["message"] == "poll done"
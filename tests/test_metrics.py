@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Metrics Tests"""
+
+import pytest
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer, unused_port
+
+from automaton_engine import AutomatonEngine
+from automaton_engine.metrics import MetricsRegistry, MetricsServer, null_timer
+
+
+def automaton(url, metrics):
+    return AutomatonEngine(
+        "metered",
+        True,
+        True,
+        {"url": url, "timeout": 1},
+        {
+            "query_interval": 5,
+            "query_endpoint": "/_search",
+            "query_type": "aggregations",
+            "query_name": "states",
+            "query_payload": {},
+            "query_response_mapping": {"key": "state"},
+        },
+        [],
+        metrics=metrics,
+    )
+
+
+class TestMetrics(object):
+    def test_disabled_registry(self):
+        registry = MetricsRegistry()
+        assert registry.timer("query", ()) is null_timer
+        registry.inc("buckets_total", (("automaton", "a"),))
+        registry.observe("query_duration_seconds", (("automaton", "a"),), 0.5)
+        assert registry.counters == {} and registry.histograms == {}
+
+    def test_render(self):
+        registry = MetricsRegistry(True, buckets=(0.1, 1.0))
+        labels = (("automaton", 'say "hi"'),)
+        registry.inc("buckets_total", labels, 3)
+        registry.observe("query_duration_seconds", labels, 0.05)
+        registry.observe("query_duration_seconds", labels, 5)
+        with pytest.raises(KeyError):
+            with registry.timer("map", labels):
+                raise KeyError("buckets")
+        rendered = registry.render()
+        assert "# TYPE automaton_engine_buckets_total counter" in rendered
+        assert 'automaton_engine_buckets_total{automaton="say \\"hi\\""} 3' in rendered
+        assert (
+            'automaton_engine_query_duration_seconds_bucket{automaton="say \\"hi\\"",le="0.1"} 1'
+            in rendered
+        )
+        assert (
+            'automaton_engine_query_duration_seconds_bucket{automaton="say \\"hi\\"",le="+Inf"} 2'
+            in rendered
+        )
+        assert (
+            'automaton_engine_query_duration_seconds_count{automaton="say \\"hi\\""} 2'
+            in rendered
+        )
+        assert (
+            'automaton_engine_map_errors_total{automaton="say \\"hi\\""} 1' in rendered
+        )
+
+    @pytest.mark.asyncio
+    async def test_metrics_endpoint(self):
+        async def search(request):
+            return web.json_response(
+                {"aggregations": {"states": {"buckets": [{"key": "busy"}]}}}
+            )
+
+        app = web.Application()
+        app.router.add_post("/_search", search)
+        es = TestServer(app)
+        await es.start_server()
+        registry = MetricsRegistry(True)
+        server = MetricsServer(registry, "127.0.0.1", unused_port(), lag_interval=0)
+        await server.start()
+        try:
+            await automaton(str(es.make_url("")).rstrip("/"), registry).Poll()
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                    "http://127.0.0.1:{}/metrics".format(server.port)
+                ) as response:
+                    assert response.status == 200
+                    rendered = await response.text()
+        finally:
+            await server.close()
+            await es.close()
+        assert 'automaton_engine_buckets_total{automaton="metered"} 1' in rendered
+        assert (
+            'automaton_engine_poll_duration_seconds_count{automaton="metered"} 1'
+            in rendered
+        )
+        assert (
+            'automaton_engine_query_duration_seconds_count{automaton="metered"} 1'
+            in rendered
+        )
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Multi-Search Tests"""
+
+import pytest
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from automaton_engine import AutomatonEngine
+from automaton_engine.actions.registry import ActionRegistry
+from automaton_engine.msearch import MultiSearchBatcher, msearch_header
+from automaton_engine.scheduler import Scheduler
+
+
+def es_response(query_name):
+    return {
+        "aggregations": {query_name: {"buckets": [{"key": query_name, "doc_count": 1}]}}
+    }
+
+
+@asynccontextmanager
+async def es_server(delay=0.0):
+    """Local elasticsearch stand-in answering _search and _msearch, after
+    delay seconds, and recording the most requests it served at once"""
+    requests = []
+    active = []
+
+    async def served(request):
+        active.append(request)
+        server.peak = max(server.peak, len(active))
+        try:
+            await asyncio.sleep(delay)
+            return await request.read()
+        finally:
+            active.remove(request)
+
+    async def search(request):
+        requests.append("_search")
+        payload = json.loads(await served(request))
+        return web.json_response(es_response(payload["query_name"]))
+
+    async def msearch(request):
+        requests.append("_msearch")
+        lines = (await served(request)).decode().strip().split("\n")
+        responses = []
+        for payload in map(json.loads, lines[1::2]):
+            if payload["query_name"] == "broken":
+                responses.append({"error": {"type": "mock"}, "status": 400})
+            else:
+                responses.append(dict(es_response(payload["query_name"]), status=200))
+        return web.json_response({"responses": responses})
+
+    app = web.Application()
+    app.router.add_post("/_search", search)
+    app.router.add_post("/_msearch", msearch)
+    server = TestServer(app)
+    await server.start_server()
+    server.requests = requests
+    server.peak = 0
+    try:
+        yield server
+    finally:
+        await server.close()
+
+
+def automaton(name, url, query_batcher, query_endpoint="/_search", **options):
+    actions = options.pop("actions", [])
+    return AutomatonEngine(
+        name,
+        True,
+        True,
+        {"url": url, "timeout": 1},
+        {
+            "query_interval": 5,
+            "query_endpoint": query_endpoint,
+            "query_type": "aggregations",
+            "query_name": name,
+            "query_payload": {"query_name": name},
+            "query_response_mapping": {},
+        },
+        actions,
+        query_batcher=query_batcher,
+        **options
+    )
+
+
+class TestMultiSearch(object):
+    def test_msearch_header(self):
+        assert msearch_header("/_search") == {}
+        assert msearch_header("/logs-*/_search") == {"index": "logs-*"}
+        assert msearch_header("/_search?size=0") is None
+        assert msearch_header("/_count") is None
+
+    def test_msearch_groups_share_phase(self):
+        query_batcher = MultiSearchBatcher()
+        url = "http://es.loc:9200"
+        engines = [automaton(name, url, query_batcher) for name in "abcdef"]
+        scheduler = Scheduler()
+        # a spread batch group falls due together
+        assert len({scheduler.phase(engine) for engine in engines}) == 1
+        other = automaton("g", "http://other.loc:9200", query_batcher)
+        unbatched = automaton("h", url, query_batcher, query_endpoint="/_count")
+        assert scheduler.phase(unbatched) == scheduler.phase(
+            automaton("h", url, None, query_endpoint="/_count")
+        )
+        assert len({scheduler.phase(engine) for engine in engines + [other]}) == 2
+
+    @pytest.mark.asyncio
+    async def test_msearch_batching(self):
+        async with es_server() as server:
+            url = str(server.make_url("")).rstrip("/")
+            query_batcher = MultiSearchBatcher(linger=1)
+            engines = [automaton(name, url, query_batcher) for name in "abc"]
+            query_responses = await asyncio.gather(
+                *[engine.QueryExecutor() for engine in engines]
+            )
+        assert server.requests == ["_msearch"]
+        for engine, query_response in zip(engines, query_responses):
+            assert engine.ResponseMapper(query_response)[0]["key"] == engine.name
+
+    @pytest.mark.asyncio
+    async def test_msearch_item_fallback(self):
+        async with es_server() as server:
+            url = str(server.make_url("")).rstrip("/")
+            query_batcher = MultiSearchBatcher(linger=0.01)
+            engines = [automaton(name, url, query_batcher) for name in ("a", "broken")]
+            query_responses = await asyncio.gather(
+                *[engine.QueryExecutor() for engine in engines]
+            )
+        assert server.requests == ["_msearch", "_search"]
+        assert engines[1].ResponseMapper(query_responses[1])[0]["key"] == "broken"
+
+    @pytest.mark.asyncio
+    async def test_cluster_slots(self):
+        loop = asyncio.get_event_loop()
+        registry = ActionRegistry(entry_points=False)
+        finished = []
+
+        async def slow(action_parameters, action_metadata):
+            await asyncio.sleep(0.5)
+            finished.append(loop.time())
+
+        registry["slow"] = slow
+        scheduler = Scheduler(spread=False, max_in_flight=1)
+        async with es_server(delay=0.05) as server:
+            url = str(server.make_url("")).rstrip("/")
+            query_batcher = MultiSearchBatcher(linger=0.01)
+            options = {
+                "cluster_slots": scheduler.cluster_slots,
+                "action_registry": registry,
+                "actions": [{"name": "slow", "backoff_seconds": 60, "parameters": {}}],
+            }
+            engines = [automaton(name, url, None, **options) for name in "abc"]
+            engines += [automaton(name, url, query_batcher, **options) for name in "de"]
+            for engine in engines:
+                scheduler.add(engine)
+            started = loop.time()
+            await asyncio.wait_for(scheduler.run(), 5)
+        assert sorted(server.requests) == ["_msearch", "_search", "_search", "_search"]
+        assert server.peak == 1
+        # actions held no slot, the queries did not wait for them
+        assert len(finished) == 5
+        assert max(finished) - started < 0.9
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Composite Paging Tests"""
+
+import pytest
+
+from automaton_engine import AutomatonEngine
+from automaton_engine.config import ConfigError, EngineConfig
+from automaton_engine.paging import page_payload, paging_settings
+
+query_payload = {
+    "size": 0,
+    "aggs": {
+        "hosts": {"composite": {"sources": [{"host": {"terms": {"field": "host"}}}]}}
+    },
+}
+
+
+def query(**paging):
+    return {
+        "query_interval": 5,
+        "query_endpoint": "/_search",
+        "query_type": "aggregations",
+        "query_name": "hosts",
+        "query_payload": query_payload,
+        "query_response_mapping": {"doc_count": "events"},
+        "paging": paging,
+    }
+
+
+class CompositeSearch(object):
+    """Serves the composite buckets of hosts 0 to total-1 by after_key"""
+
+    def __init__(self, total):
+        self.total = total
+        self.payloads = []
+
+    async def __call__(self, payload, batched=True):
+        self.payloads.append(payload)
+        composite = payload["aggs"]["hosts"]["composite"]
+        start = composite["after"]["host"] + 1 if "after" in composite else 0
+        hosts = range(start, min(start + composite["size"], self.total))
+        aggregation = {
+            "buckets": [{"key": {"host": host}, "doc_count": host} for host in hosts]
+        }
+        if hosts:
+            aggregation["after_key"] = {"host": hosts[-1]}
+        return {"aggregations": {"hosts": aggregation}}
+
+
+def engine(search, predicate=None, **paging):
+    es_query = query(**paging)
+    if predicate is not None:
+        es_query["predicate"] = predicate
+    automaton = AutomatonEngine(
+        "paged", True, True, {"url": "http://es.loc:9200", "timeout": 1}, es_query, []
+    )
+    automaton.SearchExecutor = search
+    pages = []
+
+    async def action_processor(action_metadata):
+        pages.append(action_metadata)
+        return []
+
+    automaton.ActionProcessor = action_processor
+    return automaton, pages
+
+
+class TestPaging(object):
+    def test_page_payload(self):
+        payload = page_payload(query_payload, "hosts", 10, {"host": 3})
+        assert payload["aggs"]["hosts"]["composite"]["size"] == 10
+        assert payload["aggs"]["hosts"]["composite"]["after"] == {"host": 3}
+        assert "size" not in query_payload["aggs"]["hosts"]["composite"]
+        assert (
+            "after"
+            not in page_payload(payload, "hosts", 10)["aggs"]["hosts"]["composite"]
+        )
+
+    def test_paging_settings(self):
+        assert paging_settings(query()) == {"page_size": 1000, "max_buckets": 100000}
+        es_query = query(page_size=0)
+        with pytest.raises(ValueError, match="page_size must be a positive"):
+            paging_settings(es_query)
+        es_query = dict(query(), query_name="missing")
+        with pytest.raises(ValueError, match="composite aggregation named missing"):
+            paging_settings(es_query)
+        automaton = {
+            "name": "paged",
+            "enabled": True,
+            "runonce": True,
+            "elasticsearch": {"url": "http://es.loc:9200", "timeout": 1},
+            "elasticsearch_query": dict(query(), incremental={"window": "now-5m"}),
+            "actions": [],
+        }
+        with pytest.raises(ConfigError, match="cannot be combined with incremental"):
+            EngineConfig.from_dict({"automatons": [automaton]})
+
+    @pytest.mark.asyncio
+    async def test_poll_streams_pages(self):
+        search = CompositeSearch(25)
+        automaton, pages = engine(search, page_size=10)
+        await automaton.Poll()
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert pages[2][-1] == {"key": {"host": 24}, "events": 24}
+        assert len(search.payloads) == 3
+
+        search = CompositeSearch(20)
+        automaton, pages = engine(search, page_size=10)
+        await automaton.Poll()
+        # a full last page costs one empty page to find the end
+        assert [len(page) for page in pages] == [10, 10]
+        assert len(search.payloads) == 3
+
+    @pytest.mark.asyncio
+    async def test_max_buckets(self):
+        search = CompositeSearch(100)
+        automaton, pages = engine(search, page_size=10, max_buckets=25)
+        await automaton.Poll()
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert search.payloads[-1]["aggs"]["hosts"]["composite"]["size"] == 5
+
+    @pytest.mark.asyncio
+    async def test_predicate_history_spans_pages(self):
+        search = CompositeSearch(30)
+        automaton, pages = engine(search, "delta(events) >= 0", page_size=10)
+        await automaton.Poll()
+        assert pages == []
+        await automaton.Poll()
+        assert sum(len(page) for page in pages) == 30
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Performance Mode Tests"""
+
+import pytest
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+from automaton_engine import AutomatonEngine
+from automaton_engine.metrics import MetricsRegistry
+from automaton_engine.performance import LoopMonitor, Startup, startup, use_uvloop
+
+
+def blocking_engine(seconds):
+    automaton = AutomatonEngine(
+        "blocking",
+        True,
+        False,
+        {"url": "http://es.loc:9200", "timeout": 1},
+        {
+            "query_interval": 10,
+            "query_endpoint": "/_search",
+            "query_type": "aggregations",
+            "query_name": "states",
+            "query_payload": {},
+            "query_response_mapping": {},
+        },
+        [],
+    )
+
+    async def search_request(url, query_payload):
+        time.sleep(seconds)
+        return {"aggregations": {"states": {"buckets": []}}}
+
+    automaton.SearchRequest = search_request
+    return automaton
+
+
+class TestStartup(object):
+    def test_mark(self):
+        phases = Startup()
+        time.sleep(0.01)
+        assert phases.mark("config") >= 0.01
+        phases.mark("runtime")
+        assert list(phases.phases) == ["config", "runtime"]
+        assert phases.total() == pytest.approx(sum(phases.phases.values()))
+        # the package marks its own imports
+        assert "imports" in startup.phases
+
+    def test_uvloop_missing(self, monkeypatch):
+        monkeypatch.setitem(sys.modules, "uvloop", None)
+        assert use_uvloop() is False
+
+
+class TestLoopMonitor(object):
+    @pytest.mark.asyncio
+    async def test_stall_blamed_on_automaton(self):
+        metrics = MetricsRegistry(True)
+        monitor = LoopMonitor(metrics, threshold=0.05, slowest=2)
+        await monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+            await blocking_engine(0.3).Poll()
+            await asyncio.sleep(0.1)
+        finally:
+            await monitor.close()
+        stalls = monitor.report()
+        assert stalls[0]["seconds"] >= 0.2
+        assert stalls[0]["automaton"] == "blocking"
+        assert "search_request" in stalls[0]["where"]
+        rendered = metrics.render()
+        assert "loop_stalls_total" in rendered
+        assert 'automaton="blocking"' in rendered
+        assert monitor.watchdog is None and monitor.heartbeat_task is None
+
+    @pytest.mark.asyncio
+    @pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="posix signals")
+    async def test_signals(self, tmp_path, caplog):
+        monitor = LoopMonitor(
+            threshold=0.05, profile_seconds=0.1, profile_dir=str(tmp_path)
+        )
+        await monitor.start()
+        try:
+            with caplog.at_level(logging.INFO, logger="automaton_engine.performance"):
+                os.kill(os.getpid(), signal.SIGUSR1)
+                await asyncio.sleep(0.3)
+                os.kill(os.getpid(), signal.SIGUSR2)
+                await asyncio.sleep(0.05)
+        finally:
+            await monitor.close()
+        assert len(list(tmp_path.glob("automaton_engine-*.prof"))) == 1
+        assert "event loop profile written" in caplog.text
+        assert "tasks:" in caplog.text
+        assert monitor.handled == []
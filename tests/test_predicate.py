@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Predicate Tests"""
+
+import pytest
+
+from automaton_engine import AutomatonEngine
+from automaton_engine import predicate as predicate_module
+from automaton_engine.config import ConfigError, EngineConfig
+from automaton_engine.predicate import Predicate, PredicateError
+
+
+@pytest.fixture(params=["python", "numpy"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(predicate_module, "numpy", None)
+    return request.param
+
+
+buckets = [
+    {"key": "a", "order_rate": 5, "order_state": "x", "stats": {"max": 10}},
+    {"key": "b", "order_rate": 2, "order_state": "x", "stats": {"max": 1}},
+    {"key": "c", "order_rate": 7, "order_state": "y"},
+    {"key": "d", "order_rate": None, "order_state": "x"},
+    {"key": "e", "order_rate": "n/a", "order_state": "x"},
+]
+
+
+def keys(matched):
+    return [bucket["key"] for bucket in matched]
+
+
+class TestPredicate(object):
+    def test_expressions(self, backend):
+        cases = {
+            "order_rate > 3 and order_state == 'x'": ["a"],
+            "order_rate > 3 or order_state == 'y'": ["a", "c"],
+            "not order_rate > 3": ["b", "d", "e"],
+            "1 < order_rate * 2 <= 10": ["a", "b"],
+            "stats.max >= 1": ["a", "b"],
+            "abs(order_rate - 6) < 2": ["a", "c"],
+            "order_rate / 0 > 1": [],
+            "order_state != 'x'": ["c"],
+            "True": ["a", "b", "c", "d", "e"],
+        }
+        for expression, expected in cases.items():
+            assert keys(Predicate(expression).filter(buckets)) == expected, expression
+
+    def test_history_functions(self, backend):
+        changes = Predicate("delta(order_rate) > 0")
+        rates = Predicate("rate(order_rate) >= 1")
+        assert changes.filter(buckets, now=100) == []
+        assert rates.filter(buckets, now=100) == []
+        later = [
+            {"key": "a", "order_rate": 6},
+            {"key": "b", "order_rate": 2},
+            {"key": "z", "order_rate": 9},
+        ]
+        assert keys(changes.filter(later, now=110)) == ["a"]
+        assert keys(rates.filter(later, now=101)) == ["a"]
+        # buckets absent from a poll lose their history
+        assert set(changes.history[("order_rate",)]) == {"a", "b", "z"}
+
+        spikes = Predicate("order_rate > percentile(order_rate, 50, 3)")
+        for now, rate in enumerate([3, 3, 2, 3]):
+            assert spikes.filter([{"key": "a", "order_rate": rate}], now=now) == []
+        assert keys(spikes.filter([{"key": "a", "order_rate": 9}], now=5)) == ["a"]
+        assert len(spikes.history[("order_rate",)]["a"]) == 2
+
+    def test_invalid_predicates(self):
+        for expression in (
+            "order_rate >",
+            "order_rate in [1, 2]",
+            "__import__('os')",
+            "delta(3)",
+            "percentile(order_rate)",
+            "percentile(order_rate, x)",
+            "order_rate[0] > 1",
+            "lambda: 1",
+            5,
+        ):
+            with pytest.raises(PredicateError):
+                Predicate(expression)
+
+
+class TestEnginePredicate(object):
+    def test_predicate_config(self):
+        automaton = {
+            "name": "filtered",
+            "enabled": True,
+            "runonce": True,
+            "elasticsearch": {"url": "http://es.loc:9200", "timeout": 1},
+            "elasticsearch_query": {
+                "query_interval": 5,
+                "query_endpoint": "/_search",
+                "query_type": "aggregations",
+                "query_name": "states",
+                "query_payload": {},
+                "query_response_mapping": {"key": "state", "doc_count": "orders"},
+                "predicate": "orders > 3",
+            },
+            "actions": [],
+        }
+        config = EngineConfig.from_dict({"automatons": [automaton]})
+        engine = AutomatonEngine(
+            "filtered",
+            True,
+            True,
+            automaton["elasticsearch"],
+            config.automatons[0].elasticsearch_query,
+            [],
+        )
+        mapped = engine.ResponseMapper(
+            {
+                "aggregations": {
+                    "states": {
+                        "buckets": [
+                            {"key": "a", "doc_count": 5},
+                            {"key": "b", "doc_count": 1},
+                        ]
+                    }
+                }
+            }
+        )
+        assert engine.PredicateFilter(mapped) == [{"state": "a", "orders": 5}]
+
+        automaton["elasticsearch_query"]["predicate"] = "orders >"
+        with pytest.raises(ConfigError, match="automaton filtered: invalid predicate"):
+            EngineConfig.from_dict({"automatons": [automaton]})
+
+    def test_backend_parity(self, monkeypatch):
+        pytest.importorskip("numpy")
+        sparse = buckets + [
+            {"key": "f", "order_state": "x"},
+            {"key": "g", "order_rate": 0, "stats": {}},
+            {"key": "h", "order_rate": 3.5, "order_state": None},
+        ]
+        expressions = [
+            "order_rate != 5",
+            "order_rate == order_rate",
+            "not order_rate < 4",
+            "order_rate - 2 != 0",
+            "stats.max != 10",
+            "order_state != 'x'",
+            "order_rate >= 0 or order_state == 'x'",
+            "order_rate * 2 < 100 and not order_state == 'y'",
+            "abs(order_rate) > 1",
+        ]
+        matched = [
+            keys(Predicate(expression).filter(sparse)) for expression in expressions
+        ]
+        assert predicate_module.numpy is not None
+        monkeypatch.setattr(predicate_module, "numpy", None)
+        assert matched == [
+            keys(Predicate(expression).filter(sparse)) for expression in expressions
+        ]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Query Cache Tests"""
+
+import pytest
+import asyncio
+
+from automaton_engine import AutomatonEngine
+from automaton_engine.query_cache import QueryCache, cache_key
+
+
+def engine(name, query_cache, payload=None, interval=5):
+    return AutomatonEngine(
+        name,
+        True,
+        False,
+        {"url": "http://es.loc:9200", "timeout": 1},
+        {
+            "query_interval": interval,
+            "query_endpoint": "/_search",
+            "query_type": "aggregations",
+            "query_name": "states",
+            "query_payload": payload or {"size": 0, "query": {"match_all": {}}},
+            "query_response_mapping": {},
+        },
+        [],
+        query_cache=query_cache,
+    )
+
+
+class Search(object):
+    """Stands in for SearchExecutor, counting the queries sent"""
+
+    def __init__(self, delay=0.01, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self, query_payload, batched=True):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"aggregations": {"states": {"buckets": [{"key": self.calls}]}}}
+
+
+class TestQueryCache(object):
+    def test_cache_key_canonical(self):
+        cache = QueryCache()
+        first = engine("a", cache, {"size": 0, "query": {"match_all": {}}})
+        second = engine("b", cache, {"query": {"match_all": {}}, "size": 0})
+        assert cache_key(first, first.es_query["query_payload"]) == cache_key(
+            second, second.es_query["query_payload"]
+        )
+        assert len(cache.intervals) == 1
+
+    @pytest.mark.asyncio
+    async def test_single_flight_and_ttl(self):
+        cache = QueryCache(ttl_ratio=0.01)
+        search = Search()
+        engines = [engine(name, cache, interval=5) for name in "abc"]
+        engines.append(engine("fast", cache, interval=2))
+        for automaton in engines:
+            automaton.SearchExecutor = search
+        responses = await asyncio.gather(
+            *[automaton.QueryExecutor() for automaton in engines]
+        )
+        assert search.calls == 1
+        assert all(response is responses[0] for response in responses)
+        assert cache.ttl(list(cache.intervals)[0], engines[0]) == pytest.approx(0.02)
+
+        assert await engines[0].QueryExecutor() is responses[0]
+        assert search.calls == 1
+        await asyncio.sleep(0.03)
+        await engines[1].QueryExecutor()
+        assert search.calls == 2
+        assert (cache.hits, cache.misses) == (4, 2)
+
+    @pytest.mark.asyncio
+    async def test_failures_not_cached(self):
+        cache = QueryCache()
+        search = Search(error=ValueError("query failed"))
+        engines = [engine(name, cache) for name in "ab"]
+        for automaton in engines:
+            automaton.SearchExecutor = search
+        results = await asyncio.gather(
+            *[automaton.QueryExecutor() for automaton in engines],
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+        assert search.calls == 1
+        search.error = None
+        await engines[0].QueryExecutor()
+        assert search.calls == 2
+        assert cache.inflight == {}
+
+    @pytest.mark.asyncio
+    async def test_eviction_and_unregister(self):
+        cache = QueryCache(max_entries=2)
+        engines = [engine(str(size), cache, {"size": size}) for size in range(3)]
+        for automaton in engines:
+            automaton.SearchExecutor = Search(delay=0)
+            await automaton.QueryExecutor()
+        assert len(cache.entries) == 2
+        assert cache_key(engines[0], {"size": 0}) not in cache.entries
+
+        cache.unregister(engines[2])
+        assert len(cache.entries) == 1
+        assert len(cache.intervals) == 2
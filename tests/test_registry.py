@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Action Registry Tests"""
+
+import pytest
+import sys
+
+from automaton_engine import AutomatonEngine
+from automaton_engine.actions.common import BucketResult
+from automaton_engine.actions.registry import ActionRegistry, load_spec
+
+plugin_source = '''
+from automaton_engine.actions.common import BucketResult
+
+calls = []
+
+
+async def setup(session_manager):
+    calls.append(("setup", session_manager))
+
+
+async def flush():
+    calls.append(("flush",))
+
+
+def teardown():
+    calls.append(("teardown",))
+
+
+async def batched(action_parameters, action_metadata, session_manager=None):
+    calls.append(("batched", list(action_metadata)))
+    return [BucketResult(bucket, True, None) for bucket in action_metadata]
+
+
+async def single(action_parameters, bucket, session_manager=None):
+    calls.append(("single", bucket))
+    if bucket.get("fail"):
+        raise ValueError("failed bucket")
+
+
+single.batch = False
+
+
+class Pooled(object):
+    """Holds a pool shared by every call"""
+
+    def __init__(self):
+        self.pool = None
+        self.closed = False
+
+    def setup(self, session_manager):
+        self.pool = []
+
+    def teardown(self):
+        self.closed = True
+
+    async def __call__(self, action_parameters, action_metadata, session_manager=None):
+        self.pool.extend(action_metadata)
+        return [BucketResult(bucket, True, None) for bucket in action_metadata]
+'''
+
+
+@pytest.fixture
+def plugin(tmp_path, monkeypatch):
+    (tmp_path / "registry_plugin.py").write_text(plugin_source)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield "registry_plugin"
+    sys.modules.pop("registry_plugin", None)
+
+
+class TestActionRegistry(object):
+    def test_lazy_builtin_resolution(self):
+        registry = ActionRegistry(entry_points=False)
+        assert registry.actions == {}
+        assert "awx.api_call" in registry
+        assert registry["awx.api_call"].call is load_spec(
+            "automaton_engine.actions.awx:api_call"
+        )
+        assert "awx.missing" not in registry
+        assert "missing.action" not in registry
+        with pytest.raises(KeyError):
+            registry["missing.action"]
+
+    @pytest.mark.asyncio
+    async def test_module_specs_and_hooks(self, plugin):
+        registry = ActionRegistry(
+            {
+                "custom.batched": plugin + ":batched",
+                "custom.single": plugin + ":single",
+            },
+            entry_points=False,
+        )
+        assert plugin not in sys.modules
+        action = await registry.acquire("custom.batched", "sessions")
+        calls = sys.modules[plugin].calls
+        assert calls == [("setup", "sessions")]
+        assert [result.success for result in await action({}, [{"a": 1}])] == [True]
+
+        # the module is only set up once for all of its actions
+        action = await registry.acquire("custom.single")
+        results = await action({}, [{"a": 1}, {"fail": True}])
+        assert [result.success for result in results] == [True, False]
+        assert isinstance(results[1].error, ValueError)
+        assert [call[0] for call in calls].count("setup") == 1
+
+        await registry.close()
+        assert calls[-2:] == [("flush",), ("teardown",)]
+
+    @pytest.mark.asyncio
+    async def test_package_and_class_actions(self, plugin, tmp_path):
+        (tmp_path / "extra_actions").mkdir()
+        (tmp_path / "extra_actions" / "__init__.py").write_text("")
+        (tmp_path / "extra_actions" / "jira.py").write_text(
+            "async def create_issue(*args, **kwargs):\n    return []\n"
+        )
+        registry = ActionRegistry(packages=["extra_actions"], entry_points=False)
+        assert registry["jira.create_issue"].call.__module__ == "extra_actions.jira"
+        assert "awx.api_call" in registry
+        for module in ("extra_actions", "extra_actions.jira"):
+            sys.modules.pop(module, None)
+
+        registry = ActionRegistry({"pooled": plugin + ":Pooled"}, entry_points=False)
+        action = await registry.acquire("pooled")
+        await action({}, [{"a": 1}])
+        await action({}, [{"a": 2}])
+        assert action.call.pool == [{"a": 1}, {"a": 2}]
+        await registry.close()
+        assert action.call.closed
+
+    @pytest.mark.asyncio
+    async def test_setitem_override(self, monkeypatch):
+        registry = ActionRegistry(entry_points=False)
+
+        async def api_call(action_parameters, action_metadata, session_manager=None):
+            return [BucketResult(bucket, True, None) for bucket in action_metadata]
+
+        with monkeypatch.context() as patch:
+            patch.setitem(registry, "awx.api_call", api_call)
+            assert registry["awx.api_call"].call is api_call
+            action = await registry.acquire("awx.api_call")
+            assert (await action({}, [{"a": 1}]))[0].success
+        assert registry["awx.api_call"].call is not api_call
+
+    @pytest.mark.asyncio
+    async def test_legacy_action_results(self):
+        registry = ActionRegistry(entry_points=False)
+        calls = []
+
+        async def legacy(action_parameters, action_metadata):
+            calls.append(list(action_metadata))
+
+        async def single(action_parameters, bucket):
+            calls.append(bucket)
+
+        single.batch = False
+
+        async def malformed(action_parameters, action_metadata, session_manager=None):
+            return {"ok": True}
+
+        async def partial(action_parameters, action_metadata, **options):
+            return [BucketResult(action_metadata[0], True, None)]
+
+        for action in (legacy, single, malformed, partial):
+            registry[action.__name__] = action
+        engine = AutomatonEngine(
+            "legacy",
+            True,
+            False,
+            {"url": "http://es.loc:9200", "timeout": 1},
+            {
+                "query_interval": 5,
+                "query_endpoint": "/_search",
+                "query_type": "aggregations",
+                "query_name": "states",
+                "query_payload": {},
+                "query_response_mapping": {},
+            },
+            [
+                {"name": name, "backoff_seconds": 60, "parameters": {}}
+                for name in ("legacy", "single", "malformed", "partial")
+            ],
+            action_registry=registry,
+        )
+        buckets = [{"key": "a"}, {"key": "b"}]
+
+        def outcomes(results):
+            return {
+                name: [result.success for result in action_results]
+                for name, action_results in results
+            }
+
+        # two argument actions are called without session_manager, and
+        # returning None is taken as every bucket succeeded
+        assert outcomes(await engine.ActionProcessor(buckets)) == {
+            "legacy": [True, True],
+            "single": [True, True],
+            "malformed": [False, False],
+            "partial": [True, False],
+        }
+        assert calls == [buckets, {"key": "a"}, {"key": "b"}]
+        # so those back off, while failed buckets are retried
+        assert outcomes(await engine.ActionProcessor(buckets)) == {
+            "legacy": [],
+            "single": [],
+            "malformed": [False, False],
+            "partial": [True],
+        }
+        assert len(calls) == 3
+        await registry.close()
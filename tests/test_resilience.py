@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Resilience Tests"""
+
+import pytest
+import asyncio
+from contextlib import asynccontextmanager
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from automaton_engine import AutomatonEngine
+from automaton_engine.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    QueryStatusError,
+    ResilienceManager,
+)
+
+
+@asynccontextmanager
+async def es_server(statuses, delay=0.0):
+    """Local elasticsearch stand-in answering with statuses in turn, the
+    last one repeating"""
+    requests = []
+
+    async def search(request):
+        requests.append(request.path)
+        status = statuses[min(len(requests), len(statuses)) - 1]
+        await asyncio.sleep(delay)
+        return web.json_response(
+            {"aggregations": {"states": {"buckets": [{"key": "up"}]}}}, status=status
+        )
+
+    app = web.Application()
+    app.router.add_post("/_search", search)
+    server = TestServer(app)
+    await server.start_server()
+    server.requests = requests
+    try:
+        yield str(server.make_url("")).rstrip("/")
+    finally:
+        await server.close()
+
+
+def automaton(elasticsearch, resilience):
+    return AutomatonEngine(
+        "resilient",
+        True,
+        True,
+        dict(elasticsearch, timeout=1),
+        {
+            "query_interval": 5,
+            "query_endpoint": "/_search",
+            "query_type": "aggregations",
+            "query_name": "states",
+            "query_payload": {},
+            "query_response_mapping": {},
+        },
+        [],
+        resilience=resilience,
+    )
+
+
+class TestResilience(object):
+    @pytest.mark.asyncio
+    async def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.failure()
+        assert breaker.allow()
+        breaker.failure()
+        assert breaker.state == "open" and not breaker.allow()
+        await asyncio.sleep(0.06)
+        assert breaker.allow() and breaker.state == "half-open"
+        assert not breaker.allow()
+        breaker.failure()
+        assert breaker.state == "open"
+        await asyncio.sleep(0.06)
+        assert breaker.allow()
+        breaker.success()
+        assert breaker.state == "closed" and breaker.allow()
+
+    @pytest.mark.asyncio
+    async def test_retries(self):
+        resilience = ResilienceManager({"retry_base_delay": 0.01})
+        async with es_server([503, 502, 200]) as url:
+            engine = automaton({"url": url}, resilience)
+            query_response = await engine.QueryExecutor()
+        assert engine.ResponseMapper(query_response) == [{"key": "up"}]
+        assert resilience.guard(url).retried == 2
+
+        async with es_server([400]) as url:
+            engine = automaton({"url": url}, resilience)
+            with pytest.raises(QueryStatusError):
+                await engine.QueryExecutor()
+        assert resilience.guard(url).retried == 0
+        assert resilience.guard(url).breaker.state == "closed"
+
+    @pytest.mark.asyncio
+    async def test_circuit_opens(self):
+        resilience = ResilienceManager(
+            {"retries": 0, "failure_threshold": 2, "reset_timeout": 60}
+        )
+        async with es_server([503]) as url:
+            engine = automaton({"url": url}, resilience)
+            for attempt in range(2):
+                with pytest.raises(QueryStatusError):
+                    await engine.QueryExecutor()
+            with pytest.raises(CircuitOpenError):
+                await engine.QueryExecutor()
+
+    @pytest.mark.asyncio
+    async def test_hedging(self):
+        resilience = ResilienceManager(
+            {"hedge_min_samples": 1, "hedge_min_delay": 0.02}
+        )
+        async with es_server([200], delay=0.5) as primary, es_server(
+            [200]
+        ) as secondary:
+            engine = automaton({"url": primary, "secondary_url": secondary}, resilience)
+            guard = resilience.guard(primary)
+            guard.latency.record(0.01)
+            query_response = await asyncio.wait_for(engine.QueryExecutor(), 0.3)
+        assert engine.ResponseMapper(query_response) == [{"key": "up"}]
+        assert guard.hedged == 1
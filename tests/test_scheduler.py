@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Scheduler Tests"""
+
+import pytest
+import asyncio
+
+from automaton_engine.scheduler import Scheduler
+
+
+class FakeEngine(object):
+    """Records poll start times, each poll taking duration seconds"""
+
+    def __init__(self, name, interval, runonce=False, duration=0.0):
+        self.name = name
+        self.runonce = runonce
+        self.duration = duration
+        self.elasticsearch = {"url": "http://es.loc:9200"}
+        self.es_query = {"query_interval": interval}
+        self.polls = []
+
+    async def Poll(self):
+        self.polls.append(asyncio.get_event_loop().time())
+        await asyncio.sleep(self.duration)
+
+
+class TestScheduler(object):
+    def test_scheduler_missed_ticks(self):
+        with pytest.raises(ValueError):
+            Scheduler(missed_ticks="sometimes")
+
+    def test_scheduler_phase(self):
+        engines = [FakeEngine("automaton_{}".format(i), 10) for i in range(10)]
+        phases = [Scheduler().phase(engine) for engine in engines]
+        assert all(0 <= phase < 10 for phase in phases)
+        assert len(set(phases)) > 1
+        assert phases == [Scheduler().phase(engine) for engine in engines]
+        assert Scheduler(spread=False).phase(engines[0]) == 0.0
+
+    @pytest.mark.asyncio
+    async def test_scheduler_fixed_rate(self):
+        scheduler = Scheduler(spread=False)
+        engine = FakeEngine("fixed_rate", 0.05, duration=0.03)
+        scheduler.add(engine)
+        runner = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(0.28)
+        scheduler.remove(engine)
+        await runner
+        intervals = [b - a for a, b in zip(engine.polls, engine.polls[1:])]
+        assert len(engine.polls) >= 5
+        assert all(abs(interval - 0.05) < 0.02 for interval in intervals)
+
+    @pytest.mark.asyncio
+    async def test_scheduler_skip_overrun(self):
+        scheduler = Scheduler(spread=False, missed_ticks="skip")
+        engine = FakeEngine("overrun", 0.02, duration=0.05)
+        scheduler.add(engine)
+        runner = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(0.2)
+        scheduler.remove(engine)
+        await runner
+        intervals = [b - a for a, b in zip(engine.polls, engine.polls[1:])]
+        assert all(interval >= 0.05 for interval in intervals)
+
+    @pytest.mark.asyncio
+    async def test_scheduler_runonce_and_errors(self):
+        scheduler = Scheduler()
+        engines = [FakeEngine("once_{}".format(i), 0.01, runonce=True) for i in "ab"]
+        for engine in engines:
+            scheduler.add(engine)
+        await asyncio.wait_for(scheduler.run(), 1)
+        assert [len(engine.polls) for engine in engines] == [1, 1]
+
+        scheduler.fail_fast = True
+        failing = FakeEngine("failing", 0.01)
+        failing.Poll = None
+        scheduler.add(failing)
+        with pytest.raises(TypeError):
+            await asyncio.wait_for(scheduler.run(), 1)
+
+    @pytest.mark.asyncio
+    async def test_scheduler_isolates_failures(self):
+        scheduler = Scheduler(spread=False)
+        healthy = FakeEngine("healthy", 0.02)
+        failing = FakeEngine("failing", 0.02)
+        failing.Poll = None
+        scheduler.add(healthy)
+        scheduler.add(failing)
+        runner = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(0.11)
+        scheduler.remove(healthy)
+        scheduler.remove(failing)
+        await asyncio.wait_for(runner, 1)
+        assert len(healthy.polls) >= 4
+        assert scheduler.errors >= 4
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Session Tests"""
+
+import pytest
+
+from automaton_engine.session import SessionManager, client_session, target_key
+
+
+@pytest.fixture()
+def session_manager_defaults():
+    """Test defaults for session manager"""
+    yield SessionManager(
+        {
+            "limit": 50,
+            "targets": {"https://awx.local": {"limit": 5, "verify_ssl": False}},
+        }
+    )
+
+
+class TestSessionManager(object):
+    def test_target_key(self):
+        assert target_key("http://es.loc:9200/_search") == "http://es.loc:9200"
+        assert target_key("https://awx.local/api/v2/") == "https://awx.local:443"
+        assert target_key("http://rocket.local/hooks") == "http://rocket.local:80"
+
+    def test_session_manager_settings(self, session_manager_defaults):
+        assert session_manager_defaults.settings("http://es.loc:9200")["limit"] == 50
+        awx_settings = session_manager_defaults.settings("https://awx.local/api")
+        assert awx_settings["limit"] == 5
+        assert awx_settings["verify_ssl"] is False
+        assert awx_settings["keepalive_timeout"] == 30
+
+    @pytest.mark.asyncio
+    async def test_session_manager_pools(self, session_manager_defaults):
+        es_session = session_manager_defaults.get("http://es.loc:9200/_search")
+        assert es_session is session_manager_defaults.get("http://es.loc:9200/_msearch")
+        assert es_session.connector.limit == 50
+
+        awx_session = session_manager_defaults.get("https://awx.local/api/v2/")
+        assert awx_session is not es_session
+        assert awx_session.connector.limit == 5
+
+        async with client_session(
+            session_manager_defaults, "http://es.loc:9200"
+        ) as session:
+            assert session is es_session
+
+        await session_manager_defaults.close()
+        assert es_session.closed
+        assert awx_session.closed
+        assert session_manager_defaults.sessions == {}
+
+    @pytest.mark.asyncio
+    async def test_client_session_without_manager(self):
+        async with client_session(None, "http://es.loc:9200") as session:
+            assert not session.closed
+        assert session.closed
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Automaton Engine Sharding Tests"""
+
+import os
+import sys
+
+from automaton_engine.sharding import HashRing, ShardSupervisor, shard_config
+
+
+def flaky_worker(shard, config, log_queue, stats_queue):
+    """Fails on its first run, reports stats and exits cleanly after"""
+    marker = os.path.join(config["marker_dir"], str(shard))
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        sys.exit(1)
+    stats_queue.put(
+        {"shard": shard, "pid": os.getpid(), "automatons": len(config["automatons"])}
+    )
+
+
+class TestSharding(object):
+    def test_hash_ring(self):
+        names = ["automaton_{}".format(i) for i in range(1000)]
+        ring = HashRing(4)
+        assignments = [ring.shard(name) for name in names]
+        assert assignments == [HashRing(4).shard(name) for name in names]
+        assert all(assignments.count(shard) > 150 for shard in range(4))
+
+        grown = [HashRing(5).shard(name) for name in names]
+        moved = sum(1 for a, b in zip(assignments, grown) if a != b)
+        assert moved < 350
+        assert all(b == 4 for a, b in zip(assignments, grown) if a != b)
+
+    def test_shard_config(self):
+        config = {
+            "http": {"limit": 10},
+            "automatons": [{"name": "automaton_{}".format(i)} for i in range(20)],
+        }
+        configs = shard_config(config, 3)
+        assert len(configs) == 3
+        assert all(shard["http"] == {"limit": 10} for shard in configs)
+        assert sorted(
+            automaton["name"] for shard in configs for automaton in shard["automatons"]
+        ) == sorted(automaton["name"] for automaton in config["automatons"])
+
+    def test_shard_supervisor_restarts(self, tmp_path):
+        config = {
+            "marker_dir": str(tmp_path),
+            "automatons": [{"name": "automaton_{}".format(i)} for i in range(10)],
+        }
+        supervisor = ShardSupervisor(config, flaky_worker, workers=2, restart_delay=0)
+        supervisor.run()
+        summary = supervisor.summary()
+        assert summary["restarts"] == 2
+        assert summary["automatons"] == 10
+        assert all(process.exitcode == 0 for process in supervisor.processes.values())
+
+    def test_shard_supervisor_reloading_starts_every_shard(self, tmp_path):
+        config = {
+            "marker_dir": str(tmp_path),
+            "automatons": [{"name": "automaton_0"}],
+        }
+        supervisor = ShardSupervisor(config, flaky_worker, workers=3, restart_delay=0)
+        supervisor.run()
+        assert len(supervisor.processes) == 1
+
+        # automatons added by a reload may hash to any shard
+        config["reload"] = {"path": str(tmp_path / "config.json")}
+        supervisor = ShardSupervisor(config, flaky_worker, workers=3, restart_delay=0)
+        supervisor.run()
+        assert sorted(supervisor.processes) == [0, 1, 2]
+        config["reload"]["enabled"] = False
+        assert not ShardSupervisor(config, flaky_worker, workers=3).reloading